@@ -0,0 +1,72 @@
+"""
+Multi-prompt batch jobs: one job, many (prompt, seed, LoRA scale) items
+
+A job with an `items` list renders one image per item in a single worker
+visit, so queueing, login, pipeline setup, LoRA loading and the response are
+paid once instead of once per image. Items are grouped by LoRA scale (one
+pipeline call runs at one adapter weight), their prompts are encoded per
+group in one call, and each group is split into chunks of as many images as
+the device runs without offloading. A chunk's images go to the output stage
+as soon as it is decoded, so encoding and uploads overlap the next chunk.
+
+A chunk that fails is retried one item at a time. An item that still fails,
+or whose encoding or upload fails, is reported with its error while the
+other items succeed.
+"""
+
+import os
+
+
+# Most images per pipeline call for batch items (lowered further to what fits the device)
+ITEMS_MAX_CHUNK = int(os.environ.get("ITEMS_MAX_CHUNK", "4"))
+
+
+def resolve_items(items, params):
+    """
+    Fill in each item's defaults from the job
+
+    An item without a seed gets the job seed plus its index, so a seeded job
+    is reproducible item by item (None when the job has no seed either).
+    """
+    resolved = []
+    for index, item in enumerate(items):
+        seed = item.get('seed')
+        if seed is None and params['seed'] is not None:
+            seed = params['seed'] + index
+        scale = item.get('custom_lora_scale')
+        resolved.append({
+            'prompt': item['prompt'],
+            'seed': seed,
+            'custom_lora_scale': params['custom_lora_scale'] if scale is None else scale,
+        })
+    return resolved
+
+
+def plan_chunks(items, chunk_size):
+    """
+    Group item indices by LoRA scale (in order of first appearance) and split each group into chunks
+
+    Returns:
+        list: (scale, [[index, ...], ...]) per scale
+    """
+    groups = {}
+    for index, item in enumerate(items):
+        groups.setdefault(item['custom_lora_scale'], []).append(index)
+    return [
+        (scale, [indices[start:start + chunk_size] for start in range(0, len(indices), chunk_size)])
+        for scale, indices in groups.items()
+    ]
+
+
+def summarize_items(entries):
+    """
+    Order per-item results and count failures
+
+    Raises:
+        RuntimeError: If every item failed (the job itself failed)
+    """
+    entries = sorted(entries, key=lambda entry: entry["index"])
+    failed = sum(1 for entry in entries if "error" in entry)
+    if entries and failed == len(entries):
+        raise RuntimeError(f"All {failed} item(s) failed, first error: {entries[0]['error']}")
+    return {"items": entries, "num_items": len(entries), "failed_items": failed}
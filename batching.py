@@ -0,0 +1,201 @@
+"""
+Micro-batching scheduler that merges compatible concurrent jobs into one pipeline call
+
+Jobs are grouped by a compatibility key (resolution, steps, guidance, active
+LoRA, ...). A group is flushed when it reaches the image limit or when its
+oldest job has waited max_wait_ms and the pipeline is free. Batches run one
+at a time on a single worker thread, so the pipeline is never called
+concurrently. Work that cannot be merged (a multi-item batch job) is queued
+on the same thread with run_alone().
+"""
+
+import asyncio
+import os
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+
+BATCHING_ENABLED = os.environ.get("BATCHING_ENABLED", "0") == "1"
+BATCH_MAX_IMAGES = int(os.environ.get("BATCH_MAX_IMAGES", "4"))
+BATCH_MAX_WAIT_MS = float(os.environ.get("BATCH_MAX_WAIT_MS", "50"))
+# Number of jobs RunPod hands to the worker at once in batching mode
+BATCH_CONCURRENCY = int(os.environ.get("BATCH_CONCURRENCY", str(BATCH_MAX_IMAGES)))
+# Recent jobs and batches kept for the latency percentiles in stats()
+BATCH_STATS_WINDOW = int(os.environ.get("BATCH_STATS_WINDOW", "1000"))
+
+
+def percentile(values, pct):
+    """Nearest-rank percentile of a sequence of numbers"""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))]
+
+
+class _Pending:
+    """A job waiting in a batch group"""
+
+    __slots__ = ("request", "num_images", "future", "submitted")
+
+    def __init__(self, request, num_images, future):
+        self.request = request
+        self.num_images = num_images
+        self.future = future
+        self.submitted = time.perf_counter()
+
+
+class _Group:
+    """Compatible jobs that will share one pipeline call"""
+
+    def __init__(self, key):
+        self.key = key
+        self.items = []
+        self.images = 0
+        self.expired = False
+        self.timer = None
+        # Callable run instead of run_batch (run_alone)
+        self.run = None
+        self.created = time.perf_counter()
+
+
+class MicroBatcher:
+    """Collects compatible jobs for a short window and runs them as one batch"""
+
+    def __init__(self, run_batch, max_batch_images=BATCH_MAX_IMAGES, max_wait_ms=BATCH_MAX_WAIT_MS):
+        """
+        Initialize the batcher
+
+        Args:
+            run_batch: Callable taking a list of requests and returning one result per request.
+                Called on a dedicated worker thread.
+            max_batch_images: Maximum number of images in one pipeline call
+            max_wait_ms: Maximum time the first job of a group waits for companions
+                while the pipeline is idle. While a batch is running, open groups
+                keep collecting jobs until the pipeline frees up.
+        """
+        self.run_batch = run_batch
+        self.max_batch_images = max_batch_images
+        self.max_wait = max_wait_ms / 1000
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="batch")
+        self._open = {}
+        self._ready = deque()
+        self._busy = False
+        self.batches = 0
+        self.jobs = 0
+        self.images = 0
+        self.busy_seconds = 0.0
+        self.latencies = deque(maxlen=BATCH_STATS_WINDOW)
+        self.batch_sizes = deque(maxlen=BATCH_STATS_WINDOW)
+
+    async def submit(self, key, request, num_images=1):
+        """Queue a request under a compatibility key and wait for its result"""
+        loop = asyncio.get_running_loop()
+        pending = _Pending(request, num_images, loop.create_future())
+
+        group = self._open.get(key)
+        if group is not None and group.images + num_images > self.max_batch_images:
+            # A job that would overflow the open group closes it and starts a new one
+            self._close(group)
+            group = None
+        if group is None:
+            group = _Group(key)
+            self._open[key] = group
+            group.timer = loop.call_later(self.max_wait, self._expire, group)
+
+        group.items.append(pending)
+        group.images += num_images
+        if group.images >= self.max_batch_images:
+            self._close(group)
+
+        result = await pending.future
+        self.latencies.append(time.perf_counter() - pending.submitted)
+        return result
+
+    async def run_alone(self, fn, *args, num_images=1):
+        """Run fn(*args) on the batch worker thread between batches and return its result"""
+        loop = asyncio.get_running_loop()
+        pending = _Pending(None, num_images, loop.create_future())
+        group = _Group(None)
+        group.run = lambda requests: [fn(*args)]
+        group.items.append(pending)
+        group.images = num_images
+        self._ready.append(group)
+        self._dispatch()
+        return await pending.future
+
+    def _expire(self, group):
+        group.expired = True
+        self._dispatch()
+
+    def _close(self, group):
+        """Stop a group from accepting jobs and queue it for the batch worker"""
+        if group.timer is not None:
+            group.timer.cancel()
+        if self._open.get(group.key) is group:
+            del self._open[group.key]
+        self._ready.append(group)
+        self._dispatch()
+
+    def _dispatch(self):
+        """Start the next batch if the worker is idle"""
+        if self._busy:
+            return
+        if not self._ready:
+            expired = [group for group in self._open.values() if group.expired]
+            if not expired:
+                return
+            group = min(expired, key=lambda g: g.created)
+            del self._open[group.key]
+            self._ready.append(group)
+        self._busy = True
+        asyncio.ensure_future(self._run(self._ready.popleft()))
+
+    async def _run(self, group):
+        loop = asyncio.get_running_loop()
+        requests = [pending.request for pending in group.items]
+        start = time.perf_counter()
+        try:
+            results = await loop.run_in_executor(self._executor, self._timed_run, group.run or self.run_batch, requests)
+        except Exception as e:
+            for pending in group.items:
+                if not pending.future.done():
+                    pending.future.set_exception(e)
+            return
+        finally:
+            self._busy = False
+            self._dispatch()
+
+        self.batches += 1
+        self.jobs += len(group.items)
+        self.images += group.images
+        self.batch_sizes.append(len(group.items))
+        print(
+            f"Batch of {len(group.items)} job(s) / {group.images} image(s) done in "
+            f"{time.perf_counter() - start:.2f}s"
+        )
+        for pending, result in zip(group.items, results):
+            if not pending.future.done():
+                pending.future.set_result(result)
+
+    def _timed_run(self, run_batch, requests):
+        start = time.perf_counter()
+        try:
+            return run_batch(requests)
+        finally:
+            self.busy_seconds += time.perf_counter() - start
+
+    def stats(self):
+        """Throughput-vs-latency report for the batches run so far (latencies over the last BATCH_STATS_WINDOW jobs)"""
+        return {
+            "batches": self.batches,
+            "jobs": self.jobs,
+            "images": self.images,
+            "mean_batch_jobs": self.jobs / self.batches if self.batches else 0.0,
+            "images_per_busy_second": self.images / self.busy_seconds if self.busy_seconds else 0.0,
+            "latency_p50": percentile(self.latencies, 50),
+            "latency_p95": percentile(self.latencies, 95),
+        }
+
+    def shutdown(self):
+        self._executor.shutdown(wait=True)
@@ -0,0 +1,113 @@
+#!/usr/bin/env python3
+"""
+Throughput-vs-latency sweep for the micro-batching scheduler
+
+Jobs arrive as a Poisson stream and are served by a stand-in pipeline whose
+cost is a fixed per-call overhead plus a per-image cost, which is how a GPU
+behaves for small (512-1024px) Flux jobs. Pass --tiny to use the tiny
+random-weight Flux pipeline instead.
+
+Usage:
+    python benchmarks/bench_batching.py --jobs 64 --rate 20
+"""
+
+import argparse
+import asyncio
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from batching import MicroBatcher  # noqa: E402
+
+
+class StandInPipeline:
+    """Sleeps for call_overhead + per_image * images to emulate one pipeline call"""
+
+    def __init__(self, call_overhead, per_image):
+        self.call_overhead = call_overhead
+        self.per_image = per_image
+
+    def __call__(self, prompts):
+        time.sleep(self.call_overhead + self.per_image * len(prompts))
+        return [f"image:{prompt}" for prompt in prompts]
+
+
+def make_run_batch(pipeline):
+    def run_batch(batch):
+        prompts = [item["prompt"] for item in batch]
+        images = pipeline(prompts)
+        return [([image], item["seed"]) for image, item in zip(images, batch)]
+    return run_batch
+
+
+def make_tiny_run_batch(steps, size):
+    import torch
+    from tiny_flux import make_tiny_pipeline
+
+    pipe = make_tiny_pipeline()
+
+    def run_batch(batch):
+        output = pipe(
+            prompt=[item["prompt"] for item in batch],
+            height=size,
+            width=size,
+            num_inference_steps=steps,
+            generator=[torch.Generator().manual_seed(item["seed"]) for item in batch],
+        )
+        return [([image], item["seed"]) for image, item in zip(output.images, batch)]
+    return run_batch
+
+
+async def run_load(run_batch, jobs, rate, max_batch, max_wait_ms, seed):
+    rng = random.Random(seed)
+    batcher = MicroBatcher(run_batch, max_batch_images=max_batch, max_wait_ms=max_wait_ms)
+    tasks = []
+    start = time.perf_counter()
+    for i in range(jobs):
+        request = {"prompt": f"portrait {i}", "seed": i}
+        tasks.append(asyncio.ensure_future(batcher.submit(("1024x1024",), request)))
+        await asyncio.sleep(rng.expovariate(rate))
+    await asyncio.gather(*tasks)
+    elapsed = time.perf_counter() - start
+    batcher.shutdown()
+    stats = batcher.stats()
+    stats["jobs_per_second"] = jobs / elapsed
+    return stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--jobs", type=int, default=64)
+    parser.add_argument("--rate", type=float, default=20.0, help="Mean job arrival rate (jobs/s)")
+    parser.add_argument("--call-overhead-ms", type=float, default=60.0)
+    parser.add_argument("--per-image-ms", type=float, default=25.0)
+    parser.add_argument("--max-batch", type=int, nargs="+", default=[1, 2, 4, 8])
+    parser.add_argument("--max-wait-ms", type=float, nargs="+", default=[0, 25, 50, 100])
+    parser.add_argument("--tiny", action="store_true", help="Use the tiny random-weight Flux pipeline")
+    parser.add_argument("--steps", type=int, default=4)
+    parser.add_argument("--size", type=int, default=64)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    if args.tiny:
+        run_batch = make_tiny_run_batch(args.steps, args.size)
+    else:
+        run_batch = make_run_batch(StandInPipeline(args.call_overhead_ms / 1000, args.per_image_ms / 1000))
+
+    print(f"{'max_batch':>9} {'max_wait':>9} {'jobs/s':>8} {'img/busy-s':>11} "
+          f"{'mean_batch':>10} {'p50 ms':>8} {'p95 ms':>8}")
+    for max_batch in args.max_batch:
+        for max_wait_ms in args.max_wait_ms:
+            stats = asyncio.run(run_load(run_batch, args.jobs, args.rate, max_batch, max_wait_ms, args.seed))
+            print(
+                f"{max_batch:>9} {max_wait_ms:>9.0f} {stats['jobs_per_second']:>8.2f} "
+                f"{stats['images_per_busy_second']:>11.2f} {stats['mean_batch_jobs']:>10.2f} "
+                f"{stats['latency_p50'] * 1000:>8.1f} {stats['latency_p95'] * 1000:>8.1f}"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,155 @@
+#!/usr/bin/env python3
+"""
+Client-side cost of submitting many jobs: blocking client vs the asyncio client
+
+Runs --jobs jobs against the local RunPod stand-in (runpod_standin.py), whose
+jobs take --latency seconds (+/- --jitter) and return --num-images images of
+--image-kb each, with --fail-rate of requests answered 503 and --drop-rate of
+/run requests queued without a response. Reports per client:
+
+    wall         seconds until every job finished
+    connections  TCP connections the stand-in accepted
+    requests     /run and /status requests, and status polls per job
+    overshoot    mean seconds between a job finishing and the client noticing
+    duplicates   jobs queued twice by a retried /run (same seed, so the worker
+                 can serve the repeat from its result cache)
+    peak MB      peak Python heap allocations (tracemalloc) while decoding results
+
+The blocking client is examples/python_example.py's FluxCustomFacesClient
+driven like its example_async() (fixed --poll-interval sleep loop), one job
+per thread on --threads threads. The asyncio client is
+examples/async_client.py writing images to disk as responses stream in.
+
+Usage:
+    python benchmarks/bench_client.py --jobs 500 --latency 2 --jitter 1 --concurrency 64
+"""
+
+import argparse
+import asyncio
+import os
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+
+from runpod_standin import RunPodStandIn
+
+EXAMPLES_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "examples")
+sys.path.insert(0, EXAMPLES_DIR)
+
+from async_client import AsyncFluxCustomFacesClient  # noqa: E402
+from python_example import FluxCustomFacesClient  # noqa: E402
+
+
+def job_inputs(args):
+    return [{"prompt": f"portrait {index}", "num_images": args.num_images, "seed": index} for index in range(args.jobs)]
+
+
+def run_blocking(standin, args, output_dir):
+    """One thread per job: POST /run, then poll /status every poll_interval seconds"""
+    client = FluxCustomFacesClient("standin", "key", base_url=standin.endpoint_url())
+    overshoot = []
+
+    def run(job_input):
+        job_id = None
+        for attempt in range(5):
+            try:
+                job_id = client.generate_async(**job_input)["id"]
+                break
+            except Exception:
+                time.sleep(0.1 * 2 ** attempt)
+        if job_id is None:
+            raise RuntimeError("Submission failed")
+        while True:
+            time.sleep(args.poll_interval)
+            try:
+                status = client.check_status(job_id)
+            except Exception:
+                continue
+            if status["status"] == "COMPLETED":
+                overshoot.append(time.monotonic() - standin.jobs[job_id]["done"])
+                for index, image in enumerate(status["output"]["images"]):
+                    client.save_base64_image(image, os.path.join(output_dir, f"{job_id}_{index}.png"))
+                return status
+
+    with ThreadPoolExecutor(max_workers=args.threads) as pool:
+        results = list(pool.map(run, job_inputs(args)))
+    return results, overshoot
+
+
+async def run_async(standin, args, output_dir):
+    overshoot = []
+    async with AsyncFluxCustomFacesClient("standin", "key", base_url=standin.endpoint_url(),
+                                          max_concurrency=args.concurrency, retry_backoff=0.1,
+                                          output_dir=output_dir) as client:
+        original = client.status
+
+        async def status(job_id):
+            result = await original(job_id)
+            if result["status"] == "COMPLETED":
+                overshoot.append(time.monotonic() - standin.jobs[job_id]["done"])
+            return result
+
+        client.status = status
+        results = await client.generate_many(job_inputs(args))
+    errors = [result for result in results if isinstance(result, Exception)]
+    if errors:
+        raise errors[0]
+    return results, overshoot
+
+
+def measure(name, args, run):
+    rng = random.Random(0)
+    standin = RunPodStandIn(
+        latency=lambda job_input: max(0.05, args.latency + rng.uniform(-args.jitter, args.jitter)),
+        image_bytes=args.image_kb * 1024,
+        fail_rate=args.fail_rate,
+        drop_rate=args.drop_rate
+    ).start()
+    # The blocking client prints a line per saved image
+    stdout, sys.stdout = sys.stdout, open(os.devnull, "w")
+    try:
+        with tempfile.TemporaryDirectory() as output_dir:
+            tracemalloc.start()
+            start = time.perf_counter()
+            results, overshoot = run(standin, args, output_dir)
+            wall = time.perf_counter() - start
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+            files = len(os.listdir(output_dir))
+    finally:
+        sys.stdout.close()
+        sys.stdout = stdout
+        standin.stop()
+    completed = sum(1 for result in results if result["status"] == "COMPLETED")
+    print(f"{name:>9} {wall:>7.2f}s {standin.connections:>11} {standin.requests['run']:>6} "
+          f"{standin.requests['status']:>7} {standin.requests['status'] / args.jobs:>9.1f} "
+          f"{sum(overshoot) / max(1, len(overshoot)):>9.2f}s {standin.duplicates:>10} "
+          f"{peak / 1024 / 1024:>8.1f} {completed:>5}/{args.jobs} jobs, {files} files")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--jobs", type=int, default=200)
+    parser.add_argument("--latency", type=float, default=2.0, help="Mean job latency in seconds")
+    parser.add_argument("--jitter", type=float, default=1.0)
+    parser.add_argument("--num-images", type=int, default=1)
+    parser.add_argument("--image-kb", type=int, default=512)
+    parser.add_argument("--fail-rate", type=float, default=0.02)
+    parser.add_argument("--drop-rate", type=float, default=0.01)
+    parser.add_argument("--threads", type=int, default=64, help="Blocking client threads")
+    parser.add_argument("--poll-interval", type=float, default=2.0, help="Blocking client poll interval")
+    parser.add_argument("--concurrency", type=int, default=64, help="Asyncio client requests in flight")
+    args = parser.parse_args()
+
+    print(f"{args.jobs} jobs, {args.latency}s +/- {args.jitter}s, {args.num_images} x {args.image_kb}KB images")
+    print(f"{'client':>9} {'wall':>8} {'connections':>11} {'/run':>6} {'/status':>7} {'polls/job':>9} "
+          f"{'overshoot':>10} {'duplicates':>10} {'peak MB':>8}")
+    measure("blocking", args, run_blocking)
+    measure("asyncio", args, lambda standin, args, output_dir: asyncio.run(run_async(standin, args, output_dir)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,107 @@
+#!/usr/bin/env python3
+"""
+Per-step latency of the regionally compiled transformer vs eager
+
+For each requested size, reports the bucket it snaps to, the first-call time
+(compilation) and the steady-state per-step latency of the tiny Flux pipeline,
+eager vs with every transformer block compiled, plus the largest difference
+between the eager and compiled latents.
+
+Then it starts two fresh processes that share one compile cache directory and
+compile the same bucket, to show what the persistent Inductor cache saves on a
+worker restart.
+
+Usage:
+    python benchmarks/bench_compile.py --sizes 256 320 384 --buckets 256x256,384x384 --steps 8
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+import torch
+
+from tiny_flux import make_tiny_pipeline
+
+from compilation import ResolutionBuckets, compile_blocks, configure_cache, parse_buckets
+
+
+def generate(pipe, height, width, steps):
+    return pipe(prompt="portrait", height=height, width=width, num_inference_steps=steps,
+                generator=torch.Generator().manual_seed(0), output_type="latent").images
+
+
+def step_latency(pipe, height, width, steps, repeats):
+    """(first call seconds, median seconds per step over the following calls, latents)"""
+    start = time.perf_counter()
+    latents = generate(pipe, height, width, steps)
+    first = time.perf_counter() - start
+    timings = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        generate(pipe, height, width, steps)
+        timings.append((time.perf_counter() - start) / steps)
+    return first, statistics.median(timings), latents
+
+
+def probe(cache_dir, size, steps):
+    """Child process: compile one bucket against cache_dir and print the first-call time as JSON"""
+    configure_cache(cache_dir)
+    pipe = make_tiny_pipeline()
+    compile_blocks(pipe.transformer)
+    start = time.perf_counter()
+    generate(pipe, size, size, steps)
+    print(json.dumps({"first_call": time.perf_counter() - start}))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[256, 320, 384], help="Requested square sizes")
+    parser.add_argument("--buckets", default="256x256,384x384", help="WIDTHxHEIGHT compile buckets")
+    parser.add_argument("--steps", type=int, default=8)
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument("--probe", nargs=2, metavar=("CACHE_DIR", "SIZE"), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.probe:
+        probe(args.probe[0], int(args.probe[1]), args.steps)
+        return
+
+    with tempfile.TemporaryDirectory() as cache_dir:
+        configure_cache(cache_dir)
+        buckets = ResolutionBuckets(parse_buckets(args.buckets), cache_dir=None)
+        eager = make_tiny_pipeline()
+        compiled = make_tiny_pipeline()
+        blocks = compile_blocks(compiled.transformer)
+        print(f"Compiled {blocks} blocks, {args.steps} steps per call")
+
+        print(f"{'size':>6} {'bucket':>9} {'eager ms/step':>14} {'compiled ms/step':>17} {'speedup':>8} "
+              f"{'compile s':>10} {'max |diff|':>11}")
+        for size in args.sizes:
+            height, width = buckets.snap(size, size)
+            _, eager_step, eager_latents = step_latency(eager, height, width, args.steps, args.repeats)
+            first, compiled_step, compiled_latents = step_latency(compiled, height, width, args.steps, args.repeats)
+            diff = (eager_latents - compiled_latents).abs().max().item()
+            print(f"{size:>6} {f'{width}x{height}':>9} {eager_step * 1000:>14.2f} {compiled_step * 1000:>17.2f} "
+                  f"{eager_step / compiled_step:>7.2f}x {first:>10.2f} {diff:>11.2e}")
+
+    # Restart behaviour: the second process finds the first one's compiled graphs on disk
+    env = {name: value for name, value in os.environ.items() if name not in ("TORCHINDUCTOR_CACHE_DIR", "TRITON_CACHE_DIR")}
+    with tempfile.TemporaryDirectory() as cache_dir:
+        size = buckets.snap(args.sizes[0], args.sizes[0])[0]
+        for label in ("cold cache", "warm cache"):
+            output = subprocess.run(
+                [sys.executable, os.path.abspath(__file__), "--probe", cache_dir, str(size), "--steps", str(args.steps)],
+                check=True, capture_output=True, text=True, env=env
+            ).stdout
+            first_call = json.loads(output.strip().splitlines()[-1])["first_call"]
+            print(f"New process, {label}: first {size}x{size} call {first_call:.2f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,134 @@
+#!/usr/bin/env python3
+"""
+Quality vs speed of fast_mode (first-block step caching) across thresholds
+
+Runs the same prompts and seeds with and without the step cache and reports,
+per threshold: steps skipped, wall-clock speedup, the relative L2 distance of
+the final latents and the PSNR of the decoded images against the full run,
+with the worst case over all prompt/seed pairs. It then suggests the largest
+threshold whose worst PSNR stays above --min-psnr.
+
+The tiny random-weight pipeline only exercises the mechanics, since its
+denoising trajectory is not FLUX.1-dev's. To pick production defaults, point
+--model at the real weights and run on a GPU.
+
+Usage:
+    python benchmarks/bench_fast_mode.py --thresholds 0.02 0.05 0.08 0.12 0.2 --steps 28
+    python benchmarks/bench_fast_mode.py --model /workspace/models/flux-dev --size 1024 --min-psnr 30
+"""
+
+import argparse
+import math
+import statistics
+import time
+
+import torch
+from diffusers import FluxPipeline
+
+from tiny_flux import make_tiny_pipeline
+
+from step_cache import first_block_cache
+
+
+PROMPTS = [
+    "studio portrait photo of a person, soft light",
+    "a person hiking in the mountains at sunset, wide shot",
+    "close-up of a face with freckles, film grain",
+    "a person reading in a cafe, shallow depth of field",
+]
+
+
+def load_pipeline(model):
+    if model is None:
+        return make_tiny_pipeline()
+    device = "cuda" if torch.cuda.is_available() else "cpu"
+    pipe = FluxPipeline.from_pretrained(model, torch_dtype=torch.bfloat16).to(device)
+    pipe.set_progress_bar_config(disable=True)
+    return pipe
+
+
+def generate(pipe, prompt, seed, args, threshold):
+    """(latents, seconds, step cache report or None)"""
+    kwargs = {
+        "prompt": prompt,
+        "height": args.size,
+        "width": args.size,
+        "num_inference_steps": args.steps,
+        "guidance_scale": 3.5,
+        "generator": torch.Generator(device=pipe._execution_device).manual_seed(seed),
+        "output_type": "latent",
+    }
+    start = time.perf_counter()
+    if threshold is None:
+        latents, report = pipe(**kwargs).images, None
+    else:
+        with first_block_cache(pipe.transformer, threshold) as state:
+            latents = pipe(**kwargs).images
+        report = state.report()
+    if torch.cuda.is_available():
+        torch.cuda.synchronize()
+    return latents, time.perf_counter() - start, report
+
+
+def decode(pipe, latents, size):
+    """Decode packed latents to float images in [0, 1]"""
+    unpacked = pipe._unpack_latents(latents, size, size, pipe.vae_scale_factor)
+    unpacked = unpacked / pipe.vae.config.scaling_factor + pipe.vae.config.shift_factor
+    with torch.no_grad():
+        images = pipe.vae.decode(unpacked.to(pipe.vae.dtype)).sample
+    return ((images.float() + 1) / 2).clamp(0, 1)
+
+
+def psnr(a, b):
+    mse = torch.mean((a - b) ** 2).item()
+    return math.inf if mse == 0 else 10 * math.log10(1 / mse)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--thresholds", type=float, nargs="+", default=[0.02, 0.05, 0.08, 0.12, 0.2])
+    parser.add_argument("--prompts", type=int, default=len(PROMPTS))
+    parser.add_argument("--seeds", type=int, default=2)
+    parser.add_argument("--steps", type=int, default=28)
+    parser.add_argument("--size", type=int, default=128)
+    parser.add_argument("--model", default=None, help="Path or repo of real Flux weights (default: tiny random pipeline)")
+    parser.add_argument("--min-psnr", type=float, default=30.0, help="Worst-case PSNR (dB) a safe threshold must keep")
+    args = parser.parse_args()
+
+    pipe = load_pipeline(args.model)
+    cases = [(prompt, seed) for prompt in PROMPTS[:args.prompts] for seed in range(args.seeds)]
+
+    # Warm up kernels and allocator so the first measured run is not penalized
+    generate(pipe, cases[0][0], 0, args, None)
+
+    references = []
+    for prompt, seed in cases:
+        latents, seconds, _ = generate(pipe, prompt, seed, args, None)
+        references.append((latents, decode(pipe, latents, args.size), seconds))
+    full_seconds = sum(seconds for _, _, seconds in references)
+
+    print(f"{len(cases)} prompt/seed pairs, {args.size}x{args.size}, {args.steps} steps")
+    print(f"{'threshold':>9} {'skipped':>8} {'speedup':>8} {'latent rel L2':>14} {'PSNR mean':>10} {'PSNR min':>9}")
+    safe = None
+    for threshold in sorted(args.thresholds):
+        skipped, distances, psnrs, seconds = [], [], [], 0.0
+        for (prompt, seed), (ref_latents, ref_images, _) in zip(cases, references):
+            latents, elapsed, report = generate(pipe, prompt, seed, args, threshold)
+            seconds += elapsed
+            skipped.append(report["skipped_steps"])
+            distances.append(((latents - ref_latents).norm() / ref_latents.norm()).item())
+            psnrs.append(psnr(decode(pipe, latents, args.size), ref_images))
+        worst = min(psnrs)
+        if worst >= args.min_psnr:
+            safe = threshold
+        print(f"{threshold:>9.3f} {statistics.mean(skipped):>5.1f}/{args.steps:<2} {full_seconds / seconds:>7.2f}x "
+              f"{statistics.mean(distances):>14.4f} {statistics.mean(psnrs):>10.2f} {worst:>9.2f}")
+
+    if safe is None:
+        print(f"No threshold kept the worst-case PSNR above {args.min_psnr}dB")
+    else:
+        print(f"Largest threshold with worst-case PSNR >= {args.min_psnr}dB: {safe}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,79 @@
+#!/usr/bin/env python3
+"""
+Benchmark LoRA switching: reload-per-job (previous behaviour) vs the adapter cache
+
+Usage:
+    python benchmarks/bench_lora_cache.py --loras 8 --jobs 64
+"""
+
+import argparse
+import os
+import random
+import statistics
+import tempfile
+import time
+
+from tiny_flux import make_tiny_lora, make_tiny_pipeline
+
+from lora_cache import LoraCache, UNCENSORED_ADAPTER
+
+
+def percentile(values, pct):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))]
+
+
+def report(label, timings):
+    print(
+        f"{label:<22} p50={percentile(timings, 50) * 1000:8.2f}ms "
+        f"p95={percentile(timings, 95) * 1000:8.2f}ms "
+        f"mean={statistics.mean(timings) * 1000:8.2f}ms"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--loras", type=int, default=8, help="Number of distinct face LoRAs")
+    parser.add_argument("--jobs", type=int, default=64, help="Number of simulated jobs")
+    parser.add_argument("--max-adapters", type=int, default=4, help="Cache size for the eviction run")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    with tempfile.TemporaryDirectory() as tmp:
+        pipe = make_tiny_pipeline()
+        lora_dirs = [
+            make_tiny_lora(pipe, os.path.join(tmp, f"face_{i}"), seed=i) for i in range(args.loras + 1)
+        ]
+        pinned_dir, face_dirs = lora_dirs[0], lora_dirs[1:]
+        sequence = [rng.choice(face_dirs) for _ in range(args.jobs)]
+
+        # Previous behaviour: load_lora_weights on every job, adapters accumulate
+        baseline = make_tiny_pipeline()
+        baseline.load_lora_weights(pinned_dir, weight_name="lora.safetensors", adapter_name=UNCENSORED_ADAPTER)
+        reload_timings = []
+        for repo in sequence:
+            start = time.perf_counter()
+            baseline.load_lora_weights(repo, weight_name="lora.safetensors")
+            reload_timings.append(time.perf_counter() - start)
+
+        for max_adapters in (args.loras, args.max_adapters):
+            cached = make_tiny_pipeline()
+            cached.load_lora_weights(pinned_dir, weight_name="lora.safetensors", adapter_name=UNCENSORED_ADAPTER)
+            cache = LoraCache(cached, pinned_adapters=[UNCENSORED_ADAPTER], max_adapters=max_adapters)
+            cold, warm = [], []
+            for repo in sequence:
+                state = cache.activate(repo, weight_name="lora.safetensors")
+                (warm if state["hit"] else cold).append(state["seconds"])
+            print(f"\nAdapter cache (max_adapters={max_adapters}): {cache.stats()}")
+            if cold:
+                report("  cold load", cold)
+            if warm:
+                report("  warm switch", warm)
+
+        print(f"\nReload per job ({args.jobs} jobs, {len(baseline.get_list_adapters()['transformer'])} adapters left resident)")
+        report("  load_lora_weights", reload_timings)
+
+
+if __name__ == "__main__":
+    main()
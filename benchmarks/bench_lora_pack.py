@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+"""
+Adapter load time from a LoRA pack vs one safetensors file per LoRA
+
+Writes --loras tiny face LoRAs, packs them with lora_pack.append_to_pack and
+reports, per adapter:
+
+    state dict   safetensors.torch.load_file of the LoRA's own file vs
+                 LoraPack.state_dict (views into the memory-mapped pack)
+    load         load_lora_weights from the directory vs from the packed state dict,
+                 i.e. what a LoRA adapter cache miss costs (the adapter is deleted
+                 again after each load)
+
+Both paths read from the page cache after the first pass; run with a larger
+--rank to make the files bigger.
+
+Usage:
+    python benchmarks/bench_lora_pack.py --loras 32 --rank 16 --repeats 3
+"""
+
+import argparse
+import os
+import statistics
+import tempfile
+import time
+
+from safetensors.torch import load_file
+
+from tiny_flux import make_tiny_lora, make_tiny_pipeline
+
+from lora_pack import LoraPack, append_to_pack
+
+
+WEIGHT_NAME = "lora.safetensors"
+
+
+def report(label, timings):
+    print(f"  {label:<28} mean={statistics.mean(timings) * 1000:8.3f}ms  "
+          f"median={statistics.median(timings) * 1000:8.3f}ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--loras", type=int, default=32)
+    parser.add_argument("--rank", type=int, default=16)
+    parser.add_argument("--repeats", type=int, default=3, help="Passes over all LoRAs")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        pipe = make_tiny_pipeline()
+        directories = [
+            make_tiny_lora(pipe, os.path.join(tmp, f"face_{i}"), rank=args.rank, seed=i) for i in range(args.loras)
+        ]
+        pack_dir = os.path.join(tmp, "pack")
+        start = time.perf_counter()
+        append_to_pack(pack_dir, [(directory, WEIGHT_NAME, None) for directory in directories])
+        print(f"Packed {args.loras} LoRAs in {time.perf_counter() - start:.2f}s")
+        pack = LoraPack(pack_dir)
+
+        timings = {label: [] for label in ("file state dict", "pack state dict", "file load", "pack load")}
+        for _ in range(args.repeats):
+            for i, directory in enumerate(directories):
+                start = time.perf_counter()
+                load_file(os.path.join(directory, WEIGHT_NAME))
+                timings["file state dict"].append(time.perf_counter() - start)
+
+                start = time.perf_counter()
+                pack.state_dict(directory, WEIGHT_NAME)
+                timings["pack state dict"].append(time.perf_counter() - start)
+
+                start = time.perf_counter()
+                pipe.load_lora_weights(directory, weight_name=WEIGHT_NAME, adapter_name=f"file_{i}")
+                timings["file load"].append(time.perf_counter() - start)
+                pipe.delete_adapters(f"file_{i}")
+
+                start = time.perf_counter()
+                pipe.load_lora_weights(pack.state_dict(directory, WEIGHT_NAME), adapter_name=f"pack_{i}")
+                timings["pack load"].append(time.perf_counter() - start)
+                pipe.delete_adapters(f"pack_{i}")
+
+        print(f"Per adapter over {args.repeats} x {args.loras} loads (rank {args.rank})")
+        for label, values in timings.items():
+            report(label, values)
+        speedup = statistics.mean(timings["file load"]) / statistics.mean(timings["pack load"])
+        print(f"  pack load speedup: {speedup:.2f}x, pack stats {pack.stats()}")
+
+
+if __name__ == "__main__":
+    main()
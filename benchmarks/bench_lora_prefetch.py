@@ -0,0 +1,146 @@
+#!/usr/bin/env python3
+"""
+LoRA downloads through the LoraStore: parallel ranges, resume and prefetching
+
+Serves tiny face LoRAs from a local hub stand-in (hub_standin.py) whose
+connections are throttled so one LoRA takes --download-seconds over a single
+stream, and reports:
+
+    download   seconds per LoRA into an empty store, one stream vs --streams Range requests
+    resume     bytes fetched again after a connection drops mid-download
+    gpu idle   a stream of jobs, each needing a new LoRA, run on a single GPU thread with
+               --concurrency jobs admitted at once: time the GPU thread waits for LoRA
+               activation (download + load) with on-demand downloads vs prefetch on arrival
+
+Usage:
+    python benchmarks/bench_lora_prefetch.py --loras 6 --streams 4 --download-seconds 0.5 --concurrency 2
+"""
+
+import argparse
+import math
+import os
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import torch
+
+from hub_standin import HubStandIn
+from tiny_flux import make_tiny_lora, make_tiny_pipeline
+
+from lora_cache import LoraCache
+from lora_store import LoraStore
+
+
+WEIGHT_NAME = "lora.safetensors"
+# Bytes of one response sent before the stand-in drops the connection in the resume check
+DROP_AFTER = 16 * 1024
+
+
+def make_store(root, hub, streams, size):
+    # One chunk per stream, so a single LoRA is split across all of them
+    return LoraStore(root=root, endpoint=hub.url, streams=streams, chunk_bytes=math.ceil(size / streams))
+
+
+def run_jobs(repos, store, args, prefetch):
+    """Run one job per repo on a single GPU thread; return (wall seconds, GPU seconds spent activating LoRAs)"""
+    pipe = make_tiny_pipeline()
+    pipe.set_progress_bar_config(disable=True)
+    lora_cache = LoraCache(pipe, pinned_adapters=[], fetch=store.fetch)
+    gpu = ThreadPoolExecutor(max_workers=1, thread_name_prefix="gpu")
+    slots = threading.Semaphore(args.concurrency)
+    idle = []
+
+    def gpu_job(repo):
+        start = time.perf_counter()
+        lora_cache.activate(repo, weight_name=WEIGHT_NAME)
+        idle.append(time.perf_counter() - start)
+        pipe(prompt="portrait", height=args.size, width=args.size, num_inference_steps=args.steps,
+             generator=torch.Generator().manual_seed(0))
+
+    start = time.perf_counter()
+    futures = []
+    for repo in repos:
+        # A job is admitted when a slot frees up, as with the worker's concurrency limit
+        slots.acquire()
+        if prefetch:
+            store.prefetch(repo, WEIGHT_NAME)
+        future = gpu.submit(gpu_job, repo)
+        future.add_done_callback(lambda _: slots.release())
+        futures.append(future)
+    for future in futures:
+        future.result()
+    wall = time.perf_counter() - start
+    gpu.shutdown()
+    return wall, sum(idle)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--loras", type=int, default=6, help="Distinct face LoRAs (one job each)")
+    parser.add_argument("--streams", type=int, default=4, help="Parallel Range requests per download")
+    parser.add_argument("--download-seconds", type=float, default=0.5,
+                        help="Single-stream download time of one LoRA (sets the per-connection bandwidth)")
+    parser.add_argument("--size", type=int, default=128)
+    parser.add_argument("--steps", type=int, default=8)
+    parser.add_argument("--concurrency", type=int, default=2, help="Jobs admitted at once")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        tiny = make_tiny_pipeline()
+        files = {}
+        for i in range(args.loras):
+            directory = make_tiny_lora(tiny, os.path.join(tmp, f"face_{i}"), seed=i)
+            with open(os.path.join(directory, WEIGHT_NAME), "rb") as f:
+                files[(f"bench/face-{i}", WEIGHT_NAME)] = f.read()
+        repos = [repo for repo, _ in files]
+        size = max(len(data) for data in files.values())
+        hub = HubStandIn(files, bandwidth=size / args.download_seconds).start()
+        print(f"{args.loras} LoRAs of {size / 1024:.0f}KB, {hub.bandwidth / 1024:.0f}KB/s per connection")
+
+        try:
+            print("\nDownload into an empty store")
+            for streams in sorted({1, args.streams}):
+                store = make_store(os.path.join(tmp, f"download_{streams}"), hub, streams, size)
+                start = time.perf_counter()
+                for repo in repos:
+                    store.fetch(repo, WEIGHT_NAME)
+                per_lora = (time.perf_counter() - start) / len(repos)
+                print(f"  {streams} stream(s): {per_lora * 1000:8.1f}ms per LoRA")
+
+            print("\nResume after a dropped connection")
+            store = make_store(os.path.join(tmp, "resume"), hub, args.streams, size)
+            hub.drop_after = DROP_AFTER
+            sent_before = hub.bytes_sent
+            try:
+                store.fetch(repos[0], WEIGHT_NAME)
+                print("  the connection was not dropped (file smaller than one block?)")
+            except IOError as e:
+                print(f"  first attempt failed: {e}")
+            sent_first = hub.bytes_sent - sent_before
+            store.fetch(repos[0], WEIGHT_NAME)
+            sent_second = hub.bytes_sent - sent_before - sent_first
+            print(f"  first attempt sent {sent_first / 1024:.0f}KB (dropped after {DROP_AFTER // 1024}KB), "
+                  f"resume fetched {sent_second / 1024:.0f}KB of {len(files[(repos[0], WEIGHT_NAME)]) / 1024:.0f}KB, "
+                  f"store stats {store.stats()}")
+
+            print(f"\nGPU idle over {len(repos)} jobs ({args.size}x{args.size}, {args.steps} steps, "
+                  f"concurrency {args.concurrency})")
+            baseline = None
+            for label, streams, prefetch in (
+                ("on demand, 1 stream", 1, False),
+                (f"on demand, {args.streams} streams", args.streams, False),
+                (f"prefetch, {args.streams} streams", args.streams, True),
+            ):
+                store = make_store(os.path.join(tmp, f"jobs_{streams}_{prefetch}"), hub, streams, size)
+                wall, idle = run_jobs(repos, store, args, prefetch)
+                baseline = idle if baseline is None else baseline
+                print(f"  {label:<24} wall={wall:7.2f}s  LoRA activation on GPU thread={idle:6.2f}s "
+                      f"(download wait {store.stats()['wait_seconds']:.2f}s)  idle saved={baseline - idle:6.2f}s")
+        finally:
+            hub.stop()
+
+
+if __name__ == "__main__":
+    main()
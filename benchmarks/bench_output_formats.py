@@ -0,0 +1,71 @@
+#!/usr/bin/env python3
+"""
+Encode time vs payload size for each output format
+
+Usage:
+    python benchmarks/bench_output_formats.py --size 1024 --repeats 5
+"""
+
+import argparse
+import base64
+import os
+import statistics
+import sys
+import time
+
+import numpy as np
+from PIL import Image
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from image_encoding import encode_image  # noqa: E402
+
+
+SETTINGS = [
+    ("png", {"compress_level": 1}),
+    ("png", {"compress_level": 6}),
+    ("png", {"compress_level": 9}),
+    ("webp", {"quality": 80}),
+    ("webp", {"quality": 90}),
+    ("jpeg", {"quality": 85}),
+    ("jpeg", {"quality": 95}),
+]
+
+
+def make_image(size, seed=0):
+    """Smooth gradients plus mild noise, closer to a photo than random pixels"""
+    rng = np.random.default_rng(seed)
+    ramp = np.linspace(0, 255, size, dtype=np.float32)
+    base = np.stack([
+        ramp[None, :].repeat(size, 0),
+        ramp[:, None].repeat(size, 1),
+        (ramp[None, :] + ramp[:, None]) / 2,
+    ], axis=-1)
+    noise = rng.normal(0, 6, (size, size, 3))
+    return Image.fromarray(np.clip(base + noise, 0, 255).astype(np.uint8))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--size", type=int, default=1024)
+    parser.add_argument("--repeats", type=int, default=5)
+    parser.add_argument("--image", default=None, help="Encode this image file instead of a synthetic one")
+    args = parser.parse_args()
+
+    image = Image.open(args.image).convert("RGB") if args.image else make_image(args.size)
+    print(f"{'format':<8} {'setting':<18} {'encode ms':>10} {'bytes':>10} {'base64 JSON':>12}")
+    for output_format, options in SETTINGS:
+        timings = []
+        for _ in range(args.repeats):
+            start = time.perf_counter()
+            encoded = encode_image(image, output_format, **options)
+            timings.append(time.perf_counter() - start)
+        setting = ", ".join(f"{k}={v}" for k, v in options.items())
+        print(
+            f"{output_format:<8} {setting:<18} {statistics.median(timings) * 1000:>10.1f} "
+            f"{len(encoded):>10,} {len(base64.b64encode(encoded)):>12,}"
+        )
+
+
+if __name__ == "__main__":
+    main()
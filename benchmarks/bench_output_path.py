@@ -0,0 +1,178 @@
+#!/usr/bin/env python3
+"""
+Host memory and latency of the output path, from decoded images to base64 data URIs
+
+Feeds the same VAE-decoder-like tensor ([B, 3, H, W] in [-1, 1]) through the
+pipeline's postprocessing and the worker's encoding, with both output paths:
+
+    pil     output_type="pil": float32 host copy, numpy quantization, one PIL
+            image per frame, then encode_image per image (the previous path)
+    tensor  output_type="pt" and to_uint8: the batch is quantized on the
+            tensor's device and encoded straight from uint8 frames (TENSOR_OUTPUT)
+
+Both paths encode and base64 the images in parallel on the output stage. Every
+path runs in its own process and reports:
+
+    convert     seconds from the decoded tensor to encodable images
+    total       convert plus parallel encode and base64, per job
+    peak RSS    growth of the process's peak resident memory over one job (all allocators)
+    traced      peak of Python and numpy allocations over one job (tracemalloc)
+
+The encoded bytes of both paths are compared, so the output is unchanged.
+
+Usage:
+    python benchmarks/bench_output_path.py --num-images 4 --size 1024
+"""
+
+import argparse
+import base64
+import hashlib
+import multiprocessing
+import resource
+import time
+import tracemalloc
+
+import torch
+from diffusers.image_processor import VaeImageProcessor
+
+from tiny_flux import REPO_ROOT  # noqa: F401  (puts the repository root on sys.path)
+
+from image_encoding import encode_image, to_uint8
+from output_stage import OutputStage, gather
+
+
+PATHS = ("pil", "tensor")
+
+
+def make_decoded(num_images, size, dtype, device, seed=0):
+    """Smooth gradients plus noise in [-1, 1], shaped like the VAE decoder's output"""
+    generator = torch.Generator().manual_seed(seed)
+    ramp = torch.linspace(-1, 1, size)
+    base = torch.stack([
+        ramp[None, :].expand(size, size),
+        ramp[:, None].expand(size, size),
+        (ramp[None, :] + ramp[:, None]) / 2,
+    ])
+    noise = torch.randn((num_images, 3, size, size), generator=generator) * 0.05
+    return (base + noise).clamp(-1, 1).to(device=device, dtype=dtype)
+
+
+def reset_peak_rss():
+    """Reset the process's peak RSS to its current RSS (Linux), returning whether it could"""
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+        return True
+    except OSError:
+        return False
+
+
+def peak_rss():
+    """Peak resident bytes of the process"""
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def current_rss():
+    """Resident bytes of the process, or None where /proc is not available"""
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return None
+
+
+def encode_job(path, decoded, processor, stage, args):
+    """Run one job's output path, returning (convert seconds, data URIs)"""
+    start = time.perf_counter()
+    if path == "pil":
+        images = processor.postprocess(decoded, output_type="pil")
+    else:
+        images = to_uint8(processor.postprocess(decoded, output_type="pt"))
+    convert = time.perf_counter() - start
+
+    def publish(image):
+        encoded = encode_image(image, args.output_format, quality=args.quality, compress_level=args.compress_level)
+        return encoded, f"data:image/{args.output_format};base64,{base64.b64encode(encoded).decode()}"
+
+    return convert, gather([stage.submit(publish, image) for image in images])
+
+
+def run_path(path, args):
+    """Measure one path in a fresh process, so peak RSS is its own"""
+    decoded = make_decoded(args.num_images, args.size, getattr(torch, args.dtype), args.device)
+    processor = VaeImageProcessor(vae_scale_factor=16)
+    stage = OutputStage(max_workers=args.workers)
+
+    # Without a peak reset, the growth over the import-time peak is a lower bound
+    before = current_rss() if reset_peak_rss() else None
+    before = peak_rss() if before is None else before
+    _, outputs = encode_job(path, decoded, processor, stage, args)
+    rss_growth = peak_rss() - before
+    digest = hashlib.sha256(b"".join(encoded for encoded, _ in outputs)).hexdigest()
+    del outputs
+
+    tracemalloc.start()
+    encode_job(path, decoded, processor, stage, args)
+    _, traced = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    converts = []
+    totals = []
+    for _ in range(args.repeats):
+        start = time.perf_counter()
+        convert, _ = encode_job(path, decoded, processor, stage, args)
+        totals.append(time.perf_counter() - start)
+        converts.append(convert)
+    stage.shutdown()
+    return {
+        "convert": min(converts),
+        "total": min(totals),
+        "peak_rss": rss_growth,
+        "traced": traced,
+        "digest": digest,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--num-images", type=int, default=4)
+    parser.add_argument("--size", type=int, default=1024)
+    parser.add_argument("--repeats", type=int, default=5)
+    parser.add_argument("--dtype", default="bfloat16", choices=["bfloat16", "float16", "float32"])
+    parser.add_argument("--device", default="cuda" if torch.cuda.is_available() else "cpu")
+    parser.add_argument("--output-format", default="png", choices=["png", "webp", "jpeg"])
+    parser.add_argument("--compress-level", type=int, default=6)
+    parser.add_argument("--quality", type=int, default=90)
+    parser.add_argument("--workers", type=int, default=8, help="Output stage threads")
+    args = parser.parse_args()
+
+    # One process per path, so the first path's peak does not hide the second's
+    context = multiprocessing.get_context("spawn")
+    results = {}
+    for path in PATHS:
+        with context.Pool(1) as pool:
+            results[path] = pool.apply(run_path, (path, args))
+
+    mb = 1024 * 1024
+    print(f"{args.num_images} x {args.size}px {args.output_format}, {args.dtype} on {args.device}, "
+          f"{args.workers} output workers")
+    print(f"{'path':<8} {'convert':>10} {'total':>10} {'peak RSS':>10} {'traced':>10}")
+    for path, result in results.items():
+        print(f"{path:<8} {result['convert'] * 1000:>8.1f}ms {result['total'] * 1000:>8.1f}ms "
+              f"{result['peak_rss'] / mb:>8.1f}MB {result['traced'] / mb:>8.1f}MB")
+    identical = results["pil"]["digest"] == results["tensor"]["digest"]
+    print(f"Encoded bytes identical: {'yes' if identical else 'NO'}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,134 @@
+#!/usr/bin/env python3
+"""
+Wall-clock of the output stage (PNG encode, base64, S3 upload) against a local S3 stand-in
+
+Compares the previous sequential per-image loop with the output stage pool,
+and the previous job-after-job flow with pipelined mode where the next job's
+(simulated) denoising overlaps the current job's uploads.
+
+Requires moto's server mode: pip install "moto[server]"
+
+Usage:
+    python benchmarks/bench_output_stage.py --jobs 8 --num-images 4 --size 1024
+"""
+
+import argparse
+import base64
+import io
+import time
+
+import boto3
+import numpy as np
+from moto.server import ThreadedMotoServer
+from PIL import Image
+
+from tiny_flux import REPO_ROOT  # noqa: F401  (puts the repository root on sys.path)
+
+import handler
+from metrics import JobMetrics
+
+
+BUCKET = "bench-bucket"
+
+
+def make_images(count, size, seed):
+    """Smooth gradients plus noise, so PNG encoding cost is closer to real photos than flat colour"""
+    rng = np.random.default_rng(seed)
+    ramp = np.linspace(0, 255, size, dtype=np.float32)
+    images = []
+    for _ in range(count):
+        base = (ramp[None, :, None] + ramp[:, None, None]) / 2
+        noise = rng.normal(0, 12, (size, size, 3))
+        images.append(Image.fromarray(np.clip(base + noise, 0, 255).astype(np.uint8)))
+    return images
+
+
+def sequential_outputs(images, params):
+    """The previous loop: encode and upload one image at a time on the request thread"""
+    s3_client = boto3.client(
+        "s3",
+        aws_access_key_id=params["aws_access_key_id"],
+        aws_secret_access_key=params["aws_secret_access_key"],
+        region_name=params["aws_region"],
+        endpoint_url=params["s3_endpoint_url"],
+    )
+    urls = []
+    for idx, image in enumerate(images):
+        buffered = io.BytesIO()
+        image.save(buffered, format="PNG")
+        urls.append(f"data:image/png;base64,{base64.b64encode(buffered.getvalue()).decode()}")
+        s3_client.put_object(Bucket=BUCKET, Key=f"seq/{idx}.png", Body=buffered.getvalue(), ContentType="image/png")
+    return urls
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--jobs", type=int, default=8)
+    parser.add_argument("--num-images", type=int, default=4)
+    parser.add_argument("--size", type=int, default=1024)
+    parser.add_argument("--denoise-ms", type=float, default=1500.0, help="Simulated GPU time per job")
+    parser.add_argument("--port", type=int, default=5055)
+    args = parser.parse_args()
+
+    server = ThreadedMotoServer(port=args.port, verbose=False)
+    server.start()
+    endpoint_url = f"http://127.0.0.1:{args.port}"
+    params = {
+        "aws_access_key_id": "testing",
+        "aws_secret_access_key": "testing",
+        "aws_region": "us-east-1",
+        "s3_bucket": BUCKET,
+        "s3_prefix": "bench",
+        "s3_endpoint_url": endpoint_url,
+        "output_format": "png",
+        "output_quality": 90,
+        "png_compress_level": 6,
+        "return_mode": "both",
+    }
+    try:
+        handler.make_s3_client(params).create_bucket(Bucket=BUCKET)
+        images = make_images(args.num_images, args.size, seed=0)
+        handler.process_images(images, 0, params, JobMetrics())  # warm up
+
+        start = time.perf_counter()
+        for _ in range(args.jobs):
+            sequential_outputs(images, params)
+        sequential = (time.perf_counter() - start) / args.jobs
+
+        start = time.perf_counter()
+        for _ in range(args.jobs):
+            handler.process_images(images, 0, params, JobMetrics())
+        pooled = (time.perf_counter() - start) / args.jobs
+
+        print(f"Output stage per job ({args.num_images} x {args.size}px, workers={handler.output_stage.max_workers})")
+        print(f"  sequential loop: {sequential * 1000:8.1f}ms")
+        print(f"  output pool:     {pooled * 1000:8.1f}ms  (saves {(sequential - pooled) * 1000:.1f}ms/job)")
+
+        # Job stream: denoise, then outputs. Pipelined mode overlaps job N's outputs with job N+1's denoise.
+        denoise = args.denoise_ms / 1000
+        start = time.perf_counter()
+        for _ in range(args.jobs):
+            time.sleep(denoise)
+            sequential_outputs(images, params)
+        serial_stream = time.perf_counter() - start
+
+        start = time.perf_counter()
+        pending = []
+        for _ in range(args.jobs):
+            time.sleep(denoise)
+            pending.extend(handler.submit_outputs(images, params, JobMetrics()))
+        for future in pending:
+            future.result()
+        pipelined_stream = time.perf_counter() - start
+
+        print(f"Job stream of {args.jobs} jobs with {args.denoise_ms:.0f}ms denoise each")
+        print(f"  previous flow:   {serial_stream / args.jobs * 1000:8.1f}ms/job")
+        print(f"  pipelined:       {pipelined_stream / args.jobs * 1000:8.1f}ms/job  "
+              f"(saves {(serial_stream - pipelined_stream) / args.jobs * 1000:.1f}ms/job, "
+              f"backpressure waits: {handler.output_stage.blocked})")
+    finally:
+        server.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,83 @@
+#!/usr/bin/env python3
+"""
+Cost of streaming latent previews relative to a denoising step
+
+Runs the tiny Flux pipeline with the streaming ProgressReporter attached and
+reports, per resolution: mean step time, mean preview (projection + copy)
+time on the pipeline thread, its fraction of a step, thumbnail encode time
+and size, and how long a full VAE decode of the same latents takes instead.
+Also reports how close the linear preview is to the VAE decode (PSNR at
+latent resolution).
+
+Usage:
+    python benchmarks/bench_previews.py --sizes 128 256 512 --steps 8 --every 2
+"""
+
+import argparse
+import statistics
+import time
+
+import numpy as np
+import torch
+import torch.nn.functional as F
+
+from tiny_flux import make_tiny_pipeline
+
+from previews import LatentPreviewer, ProgressReporter, encode_preview
+
+
+def psnr(a, b):
+    mse = np.mean((a.astype(np.float32) - b.astype(np.float32)) ** 2)
+    return float("inf") if mse == 0 else 10 * np.log10(255 ** 2 / mse)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[128, 256, 512])
+    parser.add_argument("--steps", type=int, default=8)
+    parser.add_argument("--every", type=int, default=2)
+    parser.add_argument("--format", default="jpeg", choices=["jpeg", "webp"])
+    args = parser.parse_args()
+
+    pipe = make_tiny_pipeline()
+    previewer = LatentPreviewer(pipe)
+
+    print(f"{'size':>6} {'step ms':>9} {'preview ms':>11} {'of step':>8} {'encode ms':>10} "
+          f"{'uri len':>7} {'VAE ms':>8} {'PSNR dB':>8}")
+    for size in args.sizes:
+        # Effectively never back off, so every requested preview is measured
+        reporter = ProgressReporter(previewer, size, size, every=args.every, max_step_fraction=float("inf"))
+        pipe(prompt="portrait", height=size, width=size, num_inference_steps=args.steps,
+             generator=torch.Generator().manual_seed(0), callback_on_step_end=reporter)
+        reporter.finish()
+        events = [event for event in iter(reporter.events.get, None) if "preview" in event]
+
+        encode_ms, sizes = [], []
+        for event in events:
+            start = time.perf_counter()
+            uri = encode_preview(event["preview"], image_format=args.format)
+            encode_ms.append((time.perf_counter() - start) * 1000)
+            sizes.append(len(uri))
+
+        # Full VAE decode of final latents vs the linear preview of the same latents
+        latents = pipe(prompt="portrait", height=size, width=size, num_inference_steps=args.steps,
+                       generator=torch.Generator().manual_seed(0), output_type="latent").images
+        start = time.perf_counter()
+        unpacked = pipe._unpack_latents(latents, size, size, pipe.vae_scale_factor)
+        with torch.no_grad():
+            decoded = pipe.vae.decode(unpacked / pipe.vae.config.scaling_factor + pipe.vae.config.shift_factor).sample
+        vae_ms = (time.perf_counter() - start) * 1000
+        preview = previewer.preview(latents, size, size)
+        reference = F.adaptive_avg_pool2d(decoded.float(), preview.shape[:2])
+        reference = ((reference.clamp(-1, 1) + 1) * 127.5).round().to(torch.uint8)[0].permute(1, 2, 0).numpy()
+
+        stats = reporter.stats()
+        print(
+            f"{size:>6} {stats['step_ms_mean']:>9.2f} {stats['preview_ms_mean']:>11.3f} "
+            f"{stats['preview_step_fraction']:>8.1%} {statistics.mean(encode_ms):>10.2f} "
+            f"{int(statistics.mean(sizes)):>7} {vae_ms:>8.2f} {psnr(preview, reference):>8.1f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,72 @@
+#!/usr/bin/env python3
+"""
+Benchmark the prompt embedding cache on a templated prompt stream
+
+Usage:
+    python benchmarks/bench_prompt_cache.py --jobs 200 --templates 10 --subjects 20
+"""
+
+import argparse
+import random
+import tempfile
+import time
+
+from tiny_flux import make_tiny_pipeline
+
+from prompt_cache import PromptEmbeddingCache
+
+
+TEMPLATES = [
+    "Portrait of {}, professional headshot with studio lighting",
+    "Portrait of {}, outdoor golden hour, shallow depth of field",
+    "Photo of {} in a business suit, corporate office background",
+    "Close-up of {}, soft window light, film grain",
+    "{} smiling, casual clothes, city street",
+]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--jobs", type=int, default=200)
+    parser.add_argument("--templates", type=int, default=len(TEMPLATES))
+    parser.add_argument("--subjects", type=int, default=20)
+    parser.add_argument("--cache-size", type=int, default=128)
+    parser.add_argument("--disk", action="store_true", help="Enable the on-disk tier")
+    parser.add_argument("--offload-t5", action="store_true", help="Keep T5 off the device between misses")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    templates = TEMPLATES[:args.templates]
+    prompts = [
+        rng.choice(templates).format(f"person{rng.randrange(args.subjects)}") for _ in range(args.jobs)
+    ]
+    pipe = make_tiny_pipeline()
+
+    # Baseline: run both encoders for every job
+    start = time.perf_counter()
+    for prompt in prompts:
+        pipe.encode_prompt(prompt=prompt, prompt_2=None, device=pipe.device, max_sequence_length=512)
+    uncached = time.perf_counter() - start
+
+    with tempfile.TemporaryDirectory() as cache_dir:
+        cache = PromptEmbeddingCache(
+            pipe,
+            max_entries=args.cache_size,
+            cache_dir=cache_dir if args.disk else None,
+            offload_t5=args.offload_t5,
+        )
+        start = time.perf_counter()
+        for prompt in prompts:
+            cache.encode([prompt])
+        cached = time.perf_counter() - start
+        stats = cache.stats()
+
+    print(f"Jobs: {args.jobs}, distinct prompts: {len(set(prompts))}")
+    print(f"Encoders every job: {uncached * 1000:9.1f}ms total, {uncached / args.jobs * 1000:7.2f}ms/job")
+    print(f"Prompt cache:       {cached * 1000:9.1f}ms total, {cached / args.jobs * 1000:7.2f}ms/job")
+    print(f"Hit rate: {stats['hit_rate']:.1%}, encoder time saved (cache estimate): {stats['seconds_saved'] * 1000:.1f}ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,127 @@
+#!/usr/bin/env python3
+"""
+Quality, speed and memory of the weight-only quantized transformer and T5 encoder
+
+Saves a tiny random-weight Flux pipeline, builds a quantized checkpoint per
+configuration exactly as download_weights.py does (quantize_checkpoint), loads
+it through the worker's startup path and compares it with the unquantized
+pipeline:
+
+    checkpoint MB  size of the quantized components on disk (float weights for "none")
+    weights MB     resident bytes of the transformer and T5 encoder
+    load           startup load_components wall-clock
+    step           mean seconds per denoising step
+    psnr           PSNR (dB) of the decoded images against the unquantized pipeline, same seed
+    lora psnr      the same with a custom face LoRA loaded through the adapter cache
+    lora effect    mean |difference| the LoRA makes to the image (should match "none")
+
+The tiny model runs in float32 with toy layer widths, so use a small
+--group-size for int4; quantization error on random weights is pessimistic
+compared with trained FLUX.1-dev weights.
+
+Usage:
+    python benchmarks/bench_quantization.py --steps 4 --size 64 --group-size 16
+"""
+
+import argparse
+import os
+import tempfile
+import time
+
+import numpy as np
+import torch
+
+from tiny_flux import make_tiny_lora, make_tiny_pipeline
+
+from download_weights import quantize_checkpoint
+from lora_cache import LoraCache
+from memory_planner import module_bytes
+from startup import PhaseTimer, load_base_pipeline, quantized_checkpoint
+
+
+CONFIGS = {
+    "none": {},
+    "transformer int8": {"transformer": "int8"},
+    "transformer int4": {"transformer": "int4"},
+    "t5 int8": {"text_encoder_2": "int8"},
+    "both int8": {"transformer": "int8", "text_encoder_2": "int8"},
+    "both int4": {"transformer": "int4", "text_encoder_2": "int4"},
+}
+
+
+def generate(pipe, args):
+    generator = torch.Generator().manual_seed(0)
+    start = time.perf_counter()
+    images = pipe(prompt="portrait photo", height=args.size, width=args.size, num_inference_steps=args.steps,
+                  guidance_scale=3.5, generator=generator, output_type="np").images
+    return images, (time.perf_counter() - start) / args.steps
+
+
+def psnr(expected, actual):
+    mse = float(np.mean((expected - actual) ** 2))
+    return float("inf") if mse == 0 else 10 * np.log10(1.0 / mse)
+
+
+def checkpoint_bytes(directory):
+    return sum(
+        os.path.getsize(os.path.join(root, name))
+        for root, _, names in os.walk(directory)
+        for name in names
+        if name.endswith(".safetensors")
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--steps", type=int, default=4)
+    parser.add_argument("--size", type=int, default=64)
+    parser.add_argument("--group-size", type=int, default=16, help="Inputs per int4 scale")
+    parser.add_argument("--configs", nargs="+", default=list(CONFIGS), choices=list(CONFIGS))
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        model_dir = os.path.join(tmp, "base")
+        tiny = make_tiny_pipeline(num_layers=2, num_single_layers=2)
+        tiny.save_pretrained(model_dir)
+        face_dir = make_tiny_lora(tiny, os.path.join(tmp, "face"), seed=1)
+        float_bytes = sum(checkpoint_bytes(os.path.join(model_dir, name)) for name in ("transformer", "text_encoder_2"))
+
+        print(f"{args.size}x{args.size}, {args.steps} steps, int4 group size {args.group_size}")
+        print(f"{'config':<18} {'ckpt MB':>8} {'weights MB':>10} {'load':>8} {'step':>9} {'psnr':>7} "
+              f"{'lora psnr':>9} {'lora effect':>11}")
+        reference = None
+        for label in args.configs:
+            modes = CONFIGS[label]
+            quantized = None
+            size = float_bytes
+            if modes:
+                quantized_dir = os.path.join(tmp, label.replace(" ", "_"))
+                quantize_checkpoint(model_dir, quantized_dir, modes, dtype=torch.float32, group_size=args.group_size)
+                quantized = quantized_checkpoint(quantized_dir=quantized_dir)
+                size = checkpoint_bytes(quantized_dir) + sum(
+                    checkpoint_bytes(os.path.join(model_dir, name))
+                    for name in ("transformer", "text_encoder_2") if name not in modes
+                )
+
+            timer = PhaseTimer()
+            pipe = load_base_pipeline(torch.device("cpu"), timer, dtype=torch.float32, parallel=True, offline=True,
+                                      model_id=model_dir, quantized=quantized)
+            pipe.set_progress_bar_config(disable=True)
+            load_seconds = timer.report()["load_components"]
+            weights = module_bytes(pipe.transformer) + module_bytes(pipe.text_encoder_2)
+
+            images, step = generate(pipe, args)
+            cache = LoraCache(pipe, pinned_adapters=[])
+            cache.activate(face_dir)
+            lora_images, _ = generate(pipe, args)
+            if reference is None:
+                reference = (images, lora_images)
+            effect = float(np.mean(np.abs(lora_images - images)))
+
+            print(f"{label:<18} {size / 1024 ** 2:>8.2f} {weights / 1024 ** 2:>10.2f} {load_seconds:>7.3f}s "
+                  f"{step * 1000:>7.2f}ms {psnr(reference[0], images):>7.1f} {psnr(reference[1], lora_images):>9.1f} "
+                  f"{effect:>11.4f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,155 @@
+#!/usr/bin/env python3
+"""
+Throughput scaling of the multi-replica worker on CPU
+
+Starts ReplicaPool with N CPU replicas (each loading the tiny random-weight
+Flux pipeline through the real startup path and splitting the CPU threads),
+submits a burst of jobs that cycle through --loras tiny face LoRAs, and
+reports for each replica count and dispatch policy:
+
+    jobs/s      completed jobs per second over the burst
+    speedup     jobs/s relative to one replica with the same policy
+    p50/p95     job latency from submit to result
+    lora loads  custom LoRA cache misses across all replicas (affinity routing
+                keeps each LoRA on few replicas)
+
+With --kill one replica is killed halfway through the last run, to show the
+failed job, the restart and the jobs completed around it.
+
+Usage:
+    python benchmarks/bench_replicas.py --replicas 1 2 4 --jobs 48 --loras 6 --size 64 --steps 4
+    python benchmarks/bench_replicas.py --replicas 2 --kill
+"""
+
+import argparse
+import functools
+import os
+import random
+import signal
+import tempfile
+import time
+
+import torch
+
+from tiny_flux import make_tiny_lora, make_tiny_pipeline, tiny_input_validator
+
+import handler
+import startup
+from batching import percentile
+from replica_pool import ReplicaPool
+
+
+def setup_replica(model_dir, uncensored_dir):
+    """Replica setup: the real initialize_pipeline, pointed at the tiny model"""
+    handler.load_base_pipeline = functools.partial(
+        startup.load_base_pipeline, model_id=model_dir, dtype=torch.float32, offline=True)
+    handler.fused_checkpoint = lambda: None
+    handler.uncensored_lora_source = lambda: uncensored_dir
+    # Jobs are seeded, so repeats would otherwise be served from the result cache
+    handler.result_cache = None
+    handler.input_validator = tiny_input_validator()
+    handler.initialize_pipeline()
+    handler.pipe.set_progress_bar_config(disable=True)
+
+
+def wait_ready(pool, timeout=300):
+    deadline = time.monotonic() + timeout
+    while not all(replica["ready"] for replica in pool.stats()["replicas"]):
+        if time.monotonic() > deadline:
+            raise TimeoutError("Replicas did not become ready")
+        time.sleep(0.1)
+
+
+def run_burst(pool, jobs, kill_after=None):
+    """Submit every job at once and wait for all of them"""
+    latencies = []
+    failed = 0
+    start = time.perf_counter()
+    futures = []
+    for job, key in jobs:
+        submitted = time.perf_counter()
+        future = pool.submit(job, key=key)
+        future.add_done_callback(lambda f, submitted=submitted: latencies.append(time.perf_counter() - submitted))
+        futures.append(future)
+    for index, future in enumerate(futures):
+        if index == kill_after:
+            victim = pool.replicas[0].process
+            print(f"  killing replica 0 (pid {victim.pid})")
+            os.kill(victim.pid, signal.SIGKILL)
+        try:
+            result = future.result()
+        except Exception as e:
+            print(f"  job {index} failed: {e}")
+            failed += 1
+            continue
+        if "error" in result:
+            raise RuntimeError(result["error"])
+    return time.perf_counter() - start, latencies, failed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--replicas", type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument("--jobs", type=int, default=48)
+    parser.add_argument("--loras", type=int, default=6, help="Distinct face LoRAs the jobs pick from")
+    parser.add_argument("--size", type=int, default=64)
+    parser.add_argument("--steps", type=int, default=4)
+    parser.add_argument("--policies", nargs="+", default=["affinity", "fifo"], choices=["affinity", "fifo"])
+    parser.add_argument("--kill", action="store_true", help="Kill a replica halfway through the last run")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        model_dir = os.path.join(tmp, "base")
+        tiny = make_tiny_pipeline()
+        tiny.save_pretrained(model_dir)
+        uncensored_dir = make_tiny_lora(tiny, os.path.join(tmp, "uncensored"), seed=0)
+        face_dirs = [make_tiny_lora(tiny, os.path.join(tmp, f"face_{i}"), seed=i + 1) for i in range(args.loras)]
+
+        rng = random.Random(0)
+        jobs = []
+        for index in range(args.jobs):
+            face = rng.choice(face_dirs)
+            job_input = {
+                "prompt": f"portrait photo {index % 5}",
+                "custom_lora_repo": face,
+                "height": args.size,
+                "width": args.size,
+                "num_inference_steps": args.steps,
+                "seed": index,
+                "return_mode": "inline",
+            }
+            jobs.append(({"id": f"bench-{index}", "input": job_input}, (face, "lora.safetensors", None)))
+
+        print(f"{args.jobs} jobs over {args.loras} LoRAs, {args.size}x{args.size}, {args.steps} steps, "
+              f"{os.cpu_count()} CPUs")
+        print(f"{'replicas':>8} {'policy':>9} {'jobs/s':>8} {'speedup':>8} {'p50':>8} {'p95':>8} {'lora loads':>11}")
+        baseline = {}
+        runs = [(replicas, policy) for replicas in args.replicas for policy in args.policies]
+        for run_index, (replicas, policy) in enumerate(runs):
+            pool = ReplicaPool(
+                ["cpu"] * replicas,
+                setup=functools.partial(setup_replica, model_dir, uncensored_dir),
+                handle=handler.generate_image,
+                loaded=handler.loaded_loras,
+                affinity=policy == "affinity",
+                restart_backoff=0.5
+            ).start()
+            try:
+                wait_ready(pool)
+                last = run_index == len(runs) - 1
+                elapsed, latencies, failed = run_burst(pool, jobs, kill_after=args.jobs // 2 if args.kill and last else None)
+                stats = pool.stats()
+            finally:
+                pool.shutdown()
+            throughput = (args.jobs - failed) / elapsed
+            baseline.setdefault(policy, throughput)
+            loads = sum(replica["jobs"] - replica["affinity_hits"] for replica in stats["replicas"])
+            print(f"{replicas:>8} {policy:>9} {throughput:>8.2f} {throughput / baseline[policy]:>7.2f}x "
+                  f"{percentile(latencies, 50):>7.2f}s {percentile(latencies, 95):>7.2f}s {loads:>11}")
+            if failed or any(replica["restarts"] for replica in stats["replicas"]):
+                restarts = sum(replica["restarts"] for replica in stats["replicas"])
+                print(f"  {failed} job(s) failed, {restarts} replica restart(s)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+"""
+Per-job S3 upload latency: a fresh boto3 client per job (previous behaviour) vs the client pool
+
+Runs against moto's local S3 server, or any endpoint passed with --endpoint-url.
+Requires moto's server mode: pip install "moto[server]"
+
+Usage:
+    python benchmarks/bench_s3_pool.py --jobs 50 --object-kb 1500
+"""
+
+import argparse
+import os
+import statistics
+import time
+
+import boto3
+from moto.server import ThreadedMotoServer
+
+from tiny_flux import REPO_ROOT  # noqa: F401  (puts the repository root on sys.path)
+
+from s3_pool import S3ClientPool, upload_bytes
+
+
+BUCKET = "bench-bucket"
+
+
+def summarize(label, timings):
+    ordered = sorted(timings)
+    p95 = ordered[min(len(ordered) - 1, int(round(0.95 * (len(ordered) - 1))))]
+    print(f"{label:<28} p50={statistics.median(timings) * 1000:7.1f}ms p95={p95 * 1000:7.1f}ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--jobs", type=int, default=50)
+    parser.add_argument("--object-kb", type=int, default=1500, help="Size of one encoded image")
+    parser.add_argument("--large-mb", type=int, default=32, help="Size of the multipart comparison object")
+    parser.add_argument("--endpoint-url", default=None, help="Use an existing S3-compatible endpoint")
+    parser.add_argument("--port", type=int, default=5056)
+    args = parser.parse_args()
+
+    server = None
+    endpoint_url = args.endpoint_url
+    if endpoint_url is None:
+        server = ThreadedMotoServer(port=args.port, verbose=False)
+        server.start()
+        endpoint_url = f"http://127.0.0.1:{args.port}"
+    credentials = ("testing", "testing", "us-east-1")
+
+    try:
+        pool = S3ClientPool()
+        pool.get(*credentials, endpoint_url=endpoint_url).create_bucket(Bucket=BUCKET)
+        body = os.urandom(args.object_kb * 1024)
+
+        fresh = []
+        for i in range(args.jobs):
+            start = time.perf_counter()
+            client = boto3.client(
+                "s3",
+                aws_access_key_id=credentials[0],
+                aws_secret_access_key=credentials[1],
+                region_name=credentials[2],
+                endpoint_url=endpoint_url,
+            )
+            client.put_object(Bucket=BUCKET, Key=f"fresh/{i}.png", Body=body, ContentType="image/png")
+            fresh.append(time.perf_counter() - start)
+
+        pooled = []
+        for i in range(args.jobs):
+            start = time.perf_counter()
+            client = pool.get(*credentials, endpoint_url=endpoint_url)
+            upload_bytes(client, BUCKET, f"pooled/{i}.png", body, "image/png")
+            pooled.append(time.perf_counter() - start)
+
+        print(f"{args.jobs} jobs, {args.object_kb}KB per upload, endpoint {endpoint_url}")
+        summarize("fresh client per job", fresh)
+        summarize("pooled client", pooled)
+        print(f"pool hits={pool.hits} misses={pool.misses}")
+
+        large = os.urandom(args.large_mb * 1024 * 1024)
+        client = pool.get(*credentials, endpoint_url=endpoint_url)
+        start = time.perf_counter()
+        client.put_object(Bucket=BUCKET, Key="large/single.bin", Body=large)
+        single = time.perf_counter() - start
+        start = time.perf_counter()
+        upload_bytes(client, BUCKET, "large/multipart.bin", large, "application/octet-stream")
+        multipart = time.perf_counter() - start
+        print(f"{args.large_mb}MB object: single PUT {single * 1000:.1f}ms, multipart {multipart * 1000:.1f}ms")
+    finally:
+        if server is not None:
+            server.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,210 @@
+#!/usr/bin/env python3
+"""
+Stage-level latency of generate_image end to end on CPU
+
+Drives handler.generate_image with a tiny random-weight Flux pipeline (saved
+to disk and loaded through the real startup path), tiny face LoRAs and a local
+S3 stand-in (moto), and reports p50/p95 of the per-stage timings the handler
+returns with return_metrics:
+
+    init            pipeline initialization (measured separately, --init-repeats times)
+    lora_load       custom faces LoRA activation (load on a cache miss, switch on a hit)
+    memory_plan     memory estimate and plan switch
+    text_encoding   prompt embedding lookup / CLIP + T5
+    denoise         denoising loop
+    vae_decode      VAE decode
+    image_encoding  PNG/WebP/JPEG encode, summed over the job's images
+    upload          S3 upload, summed over the job's images
+    total           generate_image wall-clock
+    outputs_wall    total minus the GPU-thread stages (parallel encode/upload wall-clock
+                    plus handler bookkeeping)
+
+Sweeps every combination of --sizes, --steps and --num-images. With --json the
+results are written as JSON; with --baseline the p50s are compared against a
+previous JSON file and the script exits non-zero on a regression, so CI can run it.
+
+Requires moto's server mode: pip install "moto[server]"
+
+Usage:
+    python benchmarks/bench_stages.py --sizes 64 128 --steps 4 --num-images 1 2 --jobs 10 --json stages.json
+    python benchmarks/bench_stages.py --baseline stages.json --max-regression 0.25
+"""
+
+import argparse
+import functools
+import itertools
+import json
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+import torch
+from moto.server import ThreadedMotoServer
+
+from tiny_flux import make_tiny_lora, make_tiny_pipeline, tiny_input_validator
+
+import handler
+import startup
+from batching import percentile
+
+
+BUCKET = "bench-bucket"
+STAGES = ("lora_load", "memory_plan", "text_encoding", "denoise", "vae_decode", "image_encoding", "upload")
+COLUMNS = STAGES + ("total", "outputs_wall")
+
+
+def summarize(values):
+    return {
+        "p50": percentile(values, 50),
+        "p95": percentile(values, 95),
+        "mean": statistics.mean(values),
+        "n": len(values),
+    }
+
+
+def print_row(label, summary):
+    print(f"  {label:<16} p50={summary['p50'] * 1000:9.2f}ms  p95={summary['p95'] * 1000:9.2f}ms")
+
+
+def compare(results, baseline_path, max_regression, min_ms):
+    """Return the stages whose p50 grew by more than max_regression over the baseline"""
+    with open(baseline_path) as f:
+        baseline = json.load(f)
+    previous = {json.dumps(run["config"], sort_keys=True): run["stages"] for run in baseline["runs"]}
+    previous["init"] = {"init": baseline["init"]}
+    current = {json.dumps(run["config"], sort_keys=True): run["stages"] for run in results["runs"]}
+    current["init"] = {"init": results["init"]}
+
+    regressions = []
+    for config, stages in current.items():
+        for stage, summary in stages.items():
+            before = previous.get(config, {}).get(stage)
+            if before is None or before["p50"] * 1000 < min_ms:
+                continue
+            change = summary["p50"] / before["p50"] - 1
+            if change > max_regression:
+                regressions.append(f"{config} {stage}: p50 {before['p50'] * 1000:.2f}ms -> "
+                                   f"{summary['p50'] * 1000:.2f}ms (+{change:.0%})")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[64, 128])
+    parser.add_argument("--steps", type=int, nargs="+", default=[4])
+    parser.add_argument("--num-images", type=int, nargs="+", default=[1, 2])
+    parser.add_argument("--jobs", type=int, default=10, help="Measured jobs per configuration")
+    parser.add_argument("--warmup-jobs", type=int, default=1, help="Unmeasured jobs per configuration")
+    parser.add_argument("--loras", type=int, default=3, help="Distinct face LoRAs the jobs cycle through")
+    parser.add_argument("--init-repeats", type=int, default=3)
+    parser.add_argument("--output-format", default="png")
+    parser.add_argument("--port", type=int, default=5056)
+    parser.add_argument("--json", default=None, help="Write results to this file")
+    parser.add_argument("--baseline", default=None, help="Fail if p50s regress against this results file")
+    parser.add_argument("--max-regression", type=float, default=0.25)
+    parser.add_argument("--min-ms", type=float, default=1.0, help="Ignore stages faster than this in the baseline")
+    args = parser.parse_args()
+
+    server = ThreadedMotoServer(port=args.port, verbose=False)
+    server.start()
+    endpoint_url = f"http://127.0.0.1:{args.port}"
+    try:
+        with tempfile.TemporaryDirectory() as tmp:
+            model_dir = os.path.join(tmp, "base")
+            tiny = make_tiny_pipeline()
+            tiny.save_pretrained(model_dir)
+            uncensored_dir = make_tiny_lora(tiny, os.path.join(tmp, "uncensored"), seed=0)
+            face_dirs = [make_tiny_lora(tiny, os.path.join(tmp, f"face_{i}"), seed=i + 1) for i in range(args.loras)]
+
+            # Real startup path, pointed at the tiny model
+            handler.load_base_pipeline = functools.partial(
+                startup.load_base_pipeline, model_id=model_dir, dtype=torch.float32, offline=True)
+            handler.fused_checkpoint = lambda: None
+            handler.uncensored_lora_source = lambda: uncensored_dir
+            # Jobs are seeded, so repeats would otherwise be served from the result cache
+            handler.result_cache = None
+            handler.input_validator = tiny_input_validator()
+
+            init_timings = []
+            for _ in range(args.init_repeats):
+                handler.pipe = None
+                start = time.perf_counter()
+                handler.initialize_pipeline()
+                init_timings.append(time.perf_counter() - start)
+            handler.pipe.set_progress_bar_config(disable=True)
+
+            base_input = {
+                "aws_access_key_id": "testing",
+                "aws_secret_access_key": "testing",
+                "aws_region": "us-east-1",
+                "s3_bucket": BUCKET,
+                "s3_prefix": "bench",
+                "s3_endpoint_url": endpoint_url,
+                "output_format": args.output_format,
+                "return_metrics": True,
+            }
+            setup_params = handler.read_job_input({"prompt": "setup", **base_input}, handler.JobMetrics())
+            handler.make_s3_client(setup_params).create_bucket(Bucket=BUCKET)
+
+            results = {"init": summarize(init_timings), "runs": []}
+            print(f"Pipeline init ({args.init_repeats} runs)")
+            print_row("init", results["init"])
+
+            job_index = 0
+            for size, steps, num_images in itertools.product(args.sizes, args.steps, args.num_images):
+                config = {"size": size, "steps": steps, "num_images": num_images}
+                timings = {column: [] for column in COLUMNS}
+                for measured in [False] * args.warmup_jobs + [True] * args.jobs:
+                    job_input = {
+                        **base_input,
+                        "prompt": f"portrait photo {job_index % 5}",
+                        "custom_lora_repo": face_dirs[job_index % len(face_dirs)] if face_dirs else None,
+                        "height": size,
+                        "width": size,
+                        "num_inference_steps": steps,
+                        "num_images": num_images,
+                        "seed": job_index,
+                    }
+                    job_index += 1
+                    start = time.perf_counter()
+                    result = handler.generate_image({"id": f"bench-{job_index}", "input": job_input})
+                    elapsed = time.perf_counter() - start
+                    if "error" in result:
+                        raise RuntimeError(result["error"])
+                    if not measured:
+                        continue
+                    stages = result["metrics"]["stages"]
+                    for stage in STAGES:
+                        timings[stage].append(stages.get(stage, 0.0))
+                    timings["total"].append(elapsed)
+                    # Encode and upload run in parallel per image, so only the GPU-thread stages are subtracted
+                    serial = sum(stages.get(stage, 0.0) for stage in STAGES if stage not in ("image_encoding", "upload"))
+                    timings["outputs_wall"].append(max(elapsed - serial, 0.0))
+
+                run = {"config": config, "stages": {stage: summarize(values) for stage, values in timings.items()}}
+                results["runs"].append(run)
+                print(f"{size}x{size}, {steps} steps, {num_images} image(s), {args.jobs} jobs")
+                for column in COLUMNS:
+                    print_row(column, run["stages"][column])
+    finally:
+        server.stop()
+
+    results["settings"] = {"output_format": args.output_format, "loras": args.loras, "torch": torch.__version__}
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"Results written to {args.json}")
+
+    if args.baseline:
+        regressions = compare(results, args.baseline, args.max_regression, args.min_ms)
+        for line in regressions:
+            print(f"REGRESSION {line}")
+        if regressions:
+            sys.exit(1)
+        print(f"No stage regressed by more than {args.max_regression:.0%} against {args.baseline}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,42 @@
+#!/usr/bin/env python3
+"""
+Cold-start breakdown: FluxPipeline.from_pretrained vs parallel component loading
+
+Saves the tiny random-weight pipeline to a temporary directory and loads it
+back both ways, printing the per-phase breakdown of each.
+
+Usage:
+    python benchmarks/bench_startup.py --layers 4
+"""
+
+import argparse
+import tempfile
+
+import torch
+
+from tiny_flux import make_tiny_pipeline
+
+from startup import PhaseTimer, load_base_pipeline
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--layers", type=int, default=4, help="Dual and single transformer blocks of the tiny model")
+    parser.add_argument("--repeats", type=int, default=3)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as model_dir:
+        make_tiny_pipeline(num_layers=args.layers, num_single_layers=args.layers).save_pretrained(model_dir)
+        for parallel in (False, True):
+            totals = []
+            for _ in range(args.repeats):
+                timer = PhaseTimer()
+                load_base_pipeline(torch.device("cpu"), timer, dtype=torch.float32, parallel=parallel,
+                                   offline=True, model_id=model_dir)
+                totals.append(timer.report()["total"])
+            timer.print_report("Parallel load" if parallel else "from_pretrained")
+            print(f"  best total of {args.repeats}: {min(totals):.3f}s\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,133 @@
+#!/usr/bin/env python3
+"""
+Build-time base model download: selective vs whole repository, parallel, resumable
+
+Serves a FLUX.1-dev-shaped repository from the throttled local hub stand-in
+(hub_standin.py): diffusers components with sharded safetensors, .bin
+duplicates, a second weight variant and the top-level single-file
+checkpoints. File sizes are the real ones divided by --scale. Reports:
+
+    selection   files and bytes fetched with BASE_MODEL_PATTERNS and the variant filter
+                vs every file in the repository
+    download    seconds for the selected files, one file and one stream at a time vs
+                --files files with --streams Range requests
+    resume      bytes fetched again after a connection drops mid-download
+    rerun       seconds for a second run against an unchanged manifest
+    startup     seconds for the worker's offline manifest check (sizes, and with checksums)
+
+Usage:
+    python benchmarks/bench_weight_download.py --scale 2000 --bandwidth 4 --streams 8 --files 4
+"""
+
+import argparse
+import os
+import tempfile
+import time
+
+from hub_standin import HubStandIn
+
+from hub_download import RangeDownloader, download_snapshot
+from startup import BASE_MODEL_PATTERNS, check_weights, select_variant
+
+
+REPO = "black-forest-labs/FLUX.1-dev"
+MB = 1024 * 1024
+
+# (filename, size in MB) of the real repository
+REPOSITORY = [
+    ("model_index.json", 0.001),
+    ("flux1-dev.safetensors", 23800),
+    ("ae.safetensors", 335),
+    ("scheduler/scheduler_config.json", 0.001),
+    ("tokenizer/vocab.json", 1.0),
+    ("tokenizer/merges.txt", 0.5),
+    ("tokenizer_2/spiece.model", 0.8),
+    ("tokenizer_2/tokenizer.json", 2.4),
+    ("text_encoder/config.json", 0.001),
+    ("text_encoder/model.safetensors", 246),
+    ("text_encoder/model.fp16.safetensors", 246),
+    ("text_encoder/pytorch_model.bin", 246),
+    ("text_encoder_2/config.json", 0.001),
+    ("text_encoder_2/model.safetensors.index.json", 0.02),
+    ("text_encoder_2/model-00001-of-00002.safetensors", 4990),
+    ("text_encoder_2/model-00002-of-00002.safetensors", 4530),
+    ("transformer/config.json", 0.001),
+    ("transformer/diffusion_pytorch_model.safetensors.index.json", 0.1),
+    ("transformer/diffusion_pytorch_model-00001-of-00003.safetensors", 9980),
+    ("transformer/diffusion_pytorch_model-00002-of-00003.safetensors", 9950),
+    ("transformer/diffusion_pytorch_model-00003-of-00003.safetensors", 3870),
+    ("vae/config.json", 0.001),
+    ("vae/diffusion_pytorch_model.safetensors", 168),
+]
+
+
+def timed_snapshot(hub, local_dir, args, streams, files, selective=True, chunk_bytes=None):
+    downloader = RangeDownloader(streams=streams, chunk_bytes=chunk_bytes or args.chunk_kb * 1024)
+    start = time.perf_counter()
+    try:
+        manifest = download_snapshot(
+            REPO,
+            local_dir,
+            allow_patterns=BASE_MODEL_PATTERNS if selective else None,
+            select=select_variant(None) if selective else None,
+            endpoint=hub.url,
+            downloader=downloader,
+            max_files=files
+        )
+    finally:
+        downloader.shutdown()
+    return time.perf_counter() - start, manifest, downloader
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--scale", type=float, default=2000, help="Divide the real file sizes by this")
+    parser.add_argument("--bandwidth", type=float, default=4, help="Per-connection MB/s of the stand-in")
+    parser.add_argument("--streams", type=int, default=8)
+    parser.add_argument("--files", type=int, default=4)
+    parser.add_argument("--chunk-kb", type=int, default=512)
+    args = parser.parse_args()
+
+    files = {(REPO, name): os.urandom(max(1, int(size * MB / args.scale))) for name, size in REPOSITORY}
+    total = sum(len(data) for data in files.values())
+    hub = HubStandIn(files, bandwidth=args.bandwidth * MB).start()
+    try:
+        with tempfile.TemporaryDirectory() as tmp:
+            _, manifest, _ = timed_snapshot(hub, os.path.join(tmp, "selected"), args, args.streams, args.files)
+            selected = sum(entry["size"] for entry in manifest["files"].values())
+            print(f"selection: {len(manifest['files'])}/{len(files)} files, "
+                  f"{selected / MB:.1f}/{total / MB:.1f}MB ({1 - selected / total:.0%} less)")
+            skipped = [name for _, name in files if name not in manifest["files"]]
+            print(f"  skipped: {', '.join(skipped)}")
+
+            single, _, _ = timed_snapshot(hub, os.path.join(tmp, "single"), args, 1, 1, chunk_bytes=total)
+            parallel, _, _ = timed_snapshot(hub, os.path.join(tmp, "parallel"), args, args.streams, args.files)
+            print(f"download: one stream {single:.2f}s, {args.files} files x {args.streams} streams {parallel:.2f}s "
+                  f"({single / parallel:.1f}x)")
+
+            # Drop the next response partway through, then run again
+            resume_dir = os.path.join(tmp, "resume")
+            hub.drop_after = args.chunk_kb * 1024 // 2
+            try:
+                timed_snapshot(hub, resume_dir, args, args.streams, 1)
+                print("resume: no download failed (the dropped response was retried in time)")
+            except IOError as e:
+                elapsed, _, downloader = timed_snapshot(hub, resume_dir, args, args.streams, args.files)
+                print(f"resume: first run failed ({str(e).splitlines()[0][:80]}...), second run fetched "
+                      f"{downloader.bytes_downloaded / MB:.1f}MB of {selected / MB:.1f}MB, resumed "
+                      f"{downloader.resumed} file(s) in {elapsed:.2f}s")
+
+            rerun, _, downloader = timed_snapshot(hub, os.path.join(tmp, "parallel"), args, args.streams, args.files)
+            print(f"rerun: {rerun:.2f}s, {downloader.bytes_downloaded} bytes downloaded")
+
+            for checksums in (False, True):
+                start = time.perf_counter()
+                check_weights(os.path.join(tmp, "parallel"), manifest, checksums=checksums)
+                print(f"startup check ({'sizes and checksums' if checksums else 'sizes'}): "
+                      f"{(time.perf_counter() - start) * 1000:.1f}ms")
+    finally:
+        hub.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+"""
+Numerical-equivalence check of the fused checkpoint against runtime LoRA loading
+
+Builds a tiny random-weight Flux pipeline and a random "uncensored" LoRA, then
+generates latents (a) with the LoRA loaded as an adapter at runtime and (b)
+from the fused checkpoint written by download_weights.py. Does the same again
+with a custom face LoRA stacked on top, and reports per-step latency of both.
+Exits non-zero if the outputs differ by more than the tolerance.
+
+Usage:
+    python benchmarks/check_fused_equivalence.py --steps 4 --atol 1e-4
+"""
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+import torch
+
+from tiny_flux import make_tiny_lora, make_tiny_pipeline
+
+from download_weights import fuse_lora_into_pipeline, save_fused_checkpoint
+from lora_cache import LoraCache, UNCENSORED_ADAPTER
+from startup import PhaseTimer, fused_checkpoint, load_base_pipeline
+
+
+def load(model_dir, fused=None):
+    return load_base_pipeline(torch.device("cpu"), PhaseTimer(), dtype=torch.float32, parallel=True,
+                              offline=True, model_id=model_dir, fused=fused)
+
+
+def generate(pipe, steps, size):
+    generator = torch.Generator().manual_seed(0)
+    start = time.perf_counter()
+    latents = pipe(prompt="portrait", height=size, width=size, num_inference_steps=steps,
+                   generator=generator, output_type="latent").images
+    return latents, (time.perf_counter() - start) / steps
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--steps", type=int, default=4)
+    parser.add_argument("--size", type=int, default=64)
+    parser.add_argument("--atol", type=float, default=1e-4)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        model_dir = os.path.join(tmp, "base")
+        fused_dir = os.path.join(tmp, "fused")
+        base = make_tiny_pipeline(num_layers=2, num_single_layers=2)
+        base.set_progress_bar_config(disable=True)
+        base.save_pretrained(model_dir)
+        uncensored_dir = make_tiny_lora(base, os.path.join(tmp, "uncensored"), seed=1)
+        face_dir = make_tiny_lora(base, os.path.join(tmp, "face"), seed=2)
+
+        # Build stage, exactly as download_weights.py runs it
+        builder = load(model_dir)
+        components = fuse_lora_into_pipeline(builder, uncensored_dir)
+        save_fused_checkpoint(builder, components, fused_dir, lora=uncensored_dir)
+
+        # (a) runtime LoRA, (b) fused checkpoint
+        unfused = load(model_dir)
+        unfused.load_lora_weights(uncensored_dir, adapter_name=UNCENSORED_ADAPTER)
+        unfused_cache = LoraCache(unfused, pinned_adapters=[UNCENSORED_ADAPTER])
+        fused = load(model_dir, fused=fused_checkpoint(fused_dir))
+        fused_cache = LoraCache(fused, pinned_adapters=[])
+        for pipe in (unfused, fused):
+            pipe.set_progress_bar_config(disable=True)
+
+        failures = 0
+        for label, face in (("base + uncensored", None), ("+ custom face LoRA", face_dir)):
+            unfused_cache.activate(face)
+            fused_cache.activate(face)
+            expected, unfused_step = generate(unfused, args.steps, args.size)
+            actual, fused_step = generate(fused, args.steps, args.size)
+            max_diff = (expected - actual).abs().max().item()
+            ok = max_diff <= args.atol
+            failures += not ok
+            print(
+                f"{label:<20} max |diff| = {max_diff:.2e} ({'PASS' if ok else 'FAIL'})  "
+                f"step: runtime LoRA {unfused_step * 1000:.2f}ms, fused {fused_step * 1000:.2f}ms"
+            )
+
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,134 @@
+#!/usr/bin/env python3
+"""
+Checks of the memory planner's estimation model on the tiny Flux pipeline
+
+1. Estimates grow with resolution and batch size, and every plan is no more
+   expensive than the one before it.
+2. Shrinking the budget escalates the chosen plan in order
+   (resident -> vae_slicing -> vae_tiling -> model_cpu_offload -> sequential_cpu_offload).
+3. Estimated vs measured peak memory of a real (tiny) pipeline call per
+   resolution and batch size: torch.cuda.max_memory_allocated on a GPU, peak
+   RSS of a fresh subprocess on CPU. Reported, not asserted, since the activation
+   factors are calibrated for FLUX.1-dev in bf16.
+
+Exits non-zero if check 1 or 2 fails.
+
+Usage:
+    python benchmarks/check_memory_planner.py --sizes 64 128 256 --batches 1 2 4
+"""
+
+import argparse
+import json
+import resource
+import subprocess
+import sys
+
+import torch
+
+from tiny_flux import make_tiny_pipeline
+
+from memory_planner import GB, PLANS, MemoryPlanner
+
+
+def check_monotonic(planner, sizes, batches):
+    failures = 0
+    for size in sizes:
+        for batch in batches:
+            peaks = planner.estimate(size, size, batch)["peaks"]
+            ordered = [peaks[plan] for plan in PLANS[:3]]
+            if ordered != sorted(ordered, reverse=True):
+                print(f"FAIL {size}x{size} x{batch}: VAE plan peaks not decreasing: {ordered}")
+                failures += 1
+    for batch in batches:
+        by_size = [planner.estimate(size, size, batch)["peaks"]["resident"] for size in sizes]
+        if by_size != sorted(by_size):
+            print(f"FAIL batch {batch}: resident peak not increasing with resolution: {by_size}")
+            failures += 1
+    for size in sizes:
+        by_batch = [planner.estimate(size, size, batch)["peaks"]["resident"] for batch in batches]
+        if by_batch != sorted(by_batch):
+            print(f"FAIL {size}x{size}: resident peak not increasing with batch size: {by_batch}")
+            failures += 1
+    print(f"monotonicity: {'PASS' if not failures else 'FAIL'}")
+    return failures
+
+
+def check_escalation(pipe, size, batch):
+    """Each plan's own peak as the budget, largest first, must never pick a less intrusive plan"""
+    peaks = MemoryPlanner(pipe, torch.device("cpu")).estimate(size, size, batch)["peaks"]
+    chosen = []
+    for budget in sorted(peaks.values(), reverse=True):
+        choice = MemoryPlanner(pipe, torch.device("cpu"), budget_bytes=budget).choose(size, size, batch)
+        chosen.append(PLANS.index(choice["plan"]))
+        print(f"  budget {budget / 2**20:10.2f}MB -> {choice['plan']}")
+    failures = int(chosen != sorted(chosen))
+    print(f"escalation: {'PASS' if not failures else 'FAIL'}")
+    return failures
+
+
+def measure(size, batch, steps):
+    """Run one pipeline call and report the peak memory above the loaded pipeline"""
+    device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+    pipe = make_tiny_pipeline().to(device)
+    planner = MemoryPlanner(pipe, device, budget_bytes=None)
+    estimate = planner.estimate(size, size, batch)
+    generator = torch.Generator(device=device).manual_seed(0)
+
+    if device.type == "cuda":
+        torch.cuda.synchronize()
+        baseline = torch.cuda.memory_allocated()
+        torch.cuda.reset_peak_memory_stats()
+    else:
+        baseline = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+    pipe(prompt=["portrait"] * batch, height=size, width=size, num_inference_steps=steps, generator=generator)
+    if device.type == "cuda":
+        peak = torch.cuda.max_memory_allocated()
+    else:
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+    weights = sum(estimate["weights"].values())
+    return {
+        "device": device.type,
+        "estimated": estimate["peaks"]["resident"] - weights,
+        "measured": max(peak - baseline, 0),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[64, 128, 256])
+    parser.add_argument("--batches", type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument("--steps", type=int, default=2)
+    parser.add_argument("--measure", type=int, nargs=2, default=None, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.measure:
+        # Child process: one measurement with a clean peak RSS
+        print(json.dumps(measure(*args.measure, args.steps)))
+        return
+
+    pipe = make_tiny_pipeline()
+    planner = MemoryPlanner(pipe, torch.device("cpu"), budget_bytes=1 * GB)
+    print(f"weights (bytes): {planner.weight_bytes()}")
+    failures = check_monotonic(planner, sorted(args.sizes), sorted(args.batches))
+    failures += check_escalation(pipe, max(args.sizes), max(args.batches))
+
+    print(f"\n{'size':>6} {'batch':>6} {'estimated MB':>13} {'measured MB':>12} {'ratio':>7}")
+    for size in sorted(args.sizes):
+        for batch in sorted(args.batches):
+            output = subprocess.run(
+                [sys.executable, __file__, "--measure", str(size), str(batch), "--steps", str(args.steps)],
+                capture_output=True, text=True, check=True
+            ).stdout.strip().splitlines()[-1]
+            row = json.loads(output)
+            ratio = row["estimated"] / row["measured"] if row["measured"] else float("inf")
+            print(
+                f"{size:>6} {batch:>6} {row['estimated'] / 2**20:>13.2f} "
+                f"{row['measured'] / 2**20:>12.2f} {ratio:>7.2f}  ({row['device']})"
+            )
+
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,151 @@
+"""
+Local stand-in for the Hugging Face hub's file and model info endpoints
+
+Serves files at /{repo}/resolve/{revision}/{filename} with the headers
+huggingface_hub reads (X-Repo-Commit, ETag = sha256 like LFS files,
+Content-Length, Accept-Ranges) and honours single Range requests. Each
+connection is throttled to `bandwidth` bytes/s, like a per-connection CDN
+limit, and the next response longer than `drop_after` bytes can be cut off
+there once to test resumed downloads. /api/models/{repo} lists a repository's files like
+HfApi.model_info. Point a LoraStore or download_snapshot at it with
+endpoint=server.url (or set HF_ENDPOINT).
+"""
+
+import hashlib
+import json
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import unquote
+
+
+PATH = re.compile(r"^/(?P<repo>[^/]+/[^/]+)/resolve/(?P<revision>[^/]+)/(?P<filename>.+)$")
+API_PATH = re.compile(r"^/api/models/(?P<repo>[^/]+/[^/]+)(/revision/[^/]+)?$")
+RANGE = re.compile(r"^bytes=(\d+)-(\d*)$")
+BLOCK = 16 * 1024
+
+
+class HubStandIn:
+    """Threaded HTTP server emulating hub file downloads"""
+
+    def __init__(self, files, bandwidth=None, port=0):
+        """
+        Args:
+            files: {(repo_id, filename): bytes}
+            bandwidth: Per-connection bytes/s (None = unthrottled)
+            port: Port to bind on 127.0.0.1 (0 = any free port)
+        """
+        self.files = {key: (data, hashlib.sha256(data).hexdigest()) for key, data in files.items()}
+        self.bandwidth = bandwidth
+        self.drop_after = None
+        self.requests = 0
+        self.bytes_sent = 0
+        self.lock = threading.Lock()
+        self._server = ThreadingHTTPServer(("127.0.0.1", port), self._handler())
+        self._server.daemon_threads = True
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self._server.server_address[1]}"
+
+    def start(self):
+        threading.Thread(target=self._server.serve_forever, name="hub-standin", daemon=True).start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def _handler(self):
+        hub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def _model_info(self, repo):
+                files = sorted(filename for file_repo, filename in hub.files if file_repo == repo)
+                if not files:
+                    self.send_error(404)
+                    return
+                body = json.dumps({
+                    "id": repo,
+                    "sha": hashlib.sha1(repo.encode()).hexdigest(),
+                    "siblings": [{"rfilename": filename} for filename in files],
+                }).encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def _lookup(self):
+                match = PATH.match(unquote(self.path.split("?")[0]))
+                entry = match and hub.files.get((match["repo"], match["filename"]))
+                if entry is None:
+                    self.send_error(404)
+                    return None, None
+                data, etag = entry
+                commit = hashlib.sha1(match["repo"].encode()).hexdigest()
+                return data, {"X-Repo-Commit": commit, "ETag": f'"{etag}"', "Accept-Ranges": "bytes"}
+
+            def do_HEAD(self):
+                data, headers = self._lookup()
+                if data is None:
+                    return
+                self.send_response(200)
+                for name, value in headers.items():
+                    self.send_header(name, value)
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+
+            def do_GET(self):
+                match = API_PATH.match(unquote(self.path.split("?")[0]))
+                if match:
+                    self._model_info(match["repo"])
+                    return
+                data, headers = self._lookup()
+                if data is None:
+                    return
+                first, last = 0, len(data) - 1
+                status = 200
+                match = RANGE.match(self.headers.get("Range", ""))
+                if match:
+                    first = int(match[1])
+                    last = min(int(match[2]), last) if match[2] else last
+                    status = 206
+                body = data[first:last + 1]
+                self.send_response(status)
+                for name, value in headers.items():
+                    self.send_header(name, value)
+                if status == 206:
+                    self.send_header("Content-Range", f"bytes {first}-{last}/{len(data)}")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+
+                with hub.lock:
+                    hub.requests += 1
+                    limit = None
+                    if hub.drop_after is not None and len(body) > hub.drop_after:
+                        limit, hub.drop_after = hub.drop_after, None
+                started = time.perf_counter()
+                sent = 0
+                for offset in range(0, len(body), BLOCK):
+                    if limit is not None and sent >= limit:
+                        # Simulate a dropped connection mid-response
+                        self.close_connection = True
+                        return
+                    block = body[offset:offset + BLOCK]
+                    self.wfile.write(block)
+                    sent += len(block)
+                    with hub.lock:
+                        hub.bytes_sent += len(block)
+                    if hub.bandwidth:
+                        delay = sent / hub.bandwidth - (time.perf_counter() - started)
+                        if delay > 0:
+                            time.sleep(delay)
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
@@ -0,0 +1,198 @@
+"""
+Local stand-in for a RunPod serverless endpoint
+
+Serves POST /v2/{endpoint}/run and /runsync, GET /v2/{endpoint}/status/{id}
+and POST /v2/{endpoint}/cancel/{id} with RunPod's response shapes. A job is
+queued for `queue_delay` seconds, then completes `latency` seconds later
+(a callable of the job input for varied latencies) with a worker-like
+output: num_images base64 PNG data URIs of `image_bytes` bytes each,
+image_url and seed. Jobs with the same input get the same images. /runsync
+waits up to `sync_wait` seconds and otherwise returns the job still in
+progress, like RunPod.
+
+With fail_rate a share of requests is answered 503 without doing anything;
+with drop_rate a share of /run requests creates the job and then closes the
+connection without a response, so a client cannot tell whether it was
+queued. Requests are counted by route, plus TCP connections accepted and
+/run requests that repeated an earlier job input.
+"""
+
+import base64
+import hashlib
+import json
+import random
+import re
+import threading
+import time
+import uuid
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+PATH = re.compile(r"^/v2/[^/]+/(?P<route>run|runsync|status|cancel)(/(?P<job_id>[^/?]+))?$")
+# 8-byte PNG signature, so the decoded files look like PNGs
+PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+
+
+class RunPodStandIn:
+    """Threaded HTTP server emulating a RunPod serverless endpoint"""
+
+    def __init__(self, latency=1.0, queue_delay=0.0, image_bytes=256 * 1024, sync_wait=2.0, fail_rate=0.0,
+                 drop_rate=0.0, port=0, seed=0):
+        """
+        Args:
+            latency: Seconds a job runs, or a callable taking the job input
+            queue_delay: Seconds a job waits IN_QUEUE before it runs
+            image_bytes: Size of each generated image
+            sync_wait: Longest /runsync waits for the job to finish
+            fail_rate: Share of requests answered 503
+            drop_rate: Share of /run requests that queue the job but get no response
+            port: Port to bind on 127.0.0.1 (0 = any free port)
+            seed: Seed of the failure injection
+        """
+        self.latency = latency if callable(latency) else (lambda job_input: latency)
+        self.queue_delay = queue_delay
+        self.image_bytes = image_bytes
+        self.sync_wait = sync_wait
+        self.fail_rate = fail_rate
+        self.drop_rate = drop_rate
+        self.jobs = {}
+        self.requests = Counter()
+        self.connections = 0
+        self.duplicates = 0
+        self.lock = threading.Lock()
+        self._inputs = set()
+        self._rng = random.Random(seed)
+        self._server = ThreadingHTTPServer(("127.0.0.1", port), self._handler())
+        self._server.daemon_threads = True
+        # Clients dropping pooled keep-alive connections are not errors
+        self._server.handle_error = lambda request, client_address: None
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self._server.server_address[1]}"
+
+    def endpoint_url(self, endpoint_id="standin"):
+        """Base URL of an endpoint, as https://api.runpod.ai/v2/{endpoint_id}"""
+        return f"{self.url}/v2/{endpoint_id}"
+
+    def start(self):
+        threading.Thread(target=self._server.serve_forever, name="runpod-standin", daemon=True).start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def _submit(self, job_input):
+        identity = json.dumps(job_input, sort_keys=True)
+        now = time.monotonic()
+        job = {
+            "id": str(uuid.uuid4()),
+            "input": job_input,
+            "identity": identity,
+            "submitted": now,
+            "started": now + self.queue_delay,
+            "done": now + self.queue_delay + self.latency(job_input),
+            "cancelled": False,
+        }
+        with self.lock:
+            self.duplicates += identity in self._inputs
+            self._inputs.add(identity)
+            self.jobs[job["id"]] = job
+        return job
+
+    def _status(self, job):
+        now = time.monotonic()
+        if job["cancelled"]:
+            return {"id": job["id"], "status": "CANCELLED"}
+        if now < job["started"]:
+            return {"id": job["id"], "status": "IN_QUEUE"}
+        if now < job["done"]:
+            return {"id": job["id"], "status": "IN_PROGRESS"}
+        return {
+            "id": job["id"],
+            "status": "COMPLETED",
+            "delayTime": int((job["started"] - job["submitted"]) * 1000),
+            "executionTime": int((job["done"] - job["started"]) * 1000),
+            "output": self._output(job),
+        }
+
+    def _output(self, job):
+        if "output" in job:
+            return job["output"]
+        job_input = job["input"]
+        seed = job_input.get("seed")
+        images = []
+        for index in range(job_input.get("num_images", 1)):
+            digest = hashlib.sha256(f"{job['identity']}/{index}".encode()).digest()
+            data = PNG_SIGNATURE + random.Random(digest).randbytes(self.image_bytes - len(PNG_SIGNATURE))
+            images.append(f"data:image/png;base64,{base64.b64encode(data).decode()}")
+        job["output"] = {"image_url": images[0], "images": images, "seed": seed, "num_images": len(images)}
+        return job["output"]
+
+    def _handler(self):
+        standin = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def setup(self):
+                super().setup()
+                with standin.lock:
+                    standin.connections += 1
+
+            def _send_json(self, status, body):
+                data = json.dumps(body).encode()
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def _handle(self):
+                length = int(self.headers.get("Content-Length") or 0)
+                body = json.loads(self.rfile.read(length)) if length else {}
+                match = PATH.match(self.path)
+                if match is None:
+                    self._send_json(404, {"error": "not found"})
+                    return
+                route, job_id = match.group("route"), match.group("job_id")
+                with standin.lock:
+                    standin.requests[route] += 1
+                    roll = standin._rng.random()
+                if roll < standin.fail_rate:
+                    self._send_json(503, {"error": "service unavailable"})
+                    return
+
+                if route in ("run", "runsync"):
+                    job = standin._submit(body.get("input", {}))
+                    if route == "run":
+                        if roll < standin.fail_rate + standin.drop_rate:
+                            # Queued, but the client never hears about it
+                            self.close_connection = True
+                            return
+                        self._send_json(200, {"id": job["id"], "status": "IN_QUEUE"})
+                        return
+                    time.sleep(max(0.0, min(standin.sync_wait, job["done"] - time.monotonic())))
+                    self._send_json(200, standin._status(job))
+                    return
+
+                job = standin.jobs.get(job_id)
+                if job is None:
+                    self._send_json(404, {"error": f"job {job_id} not found"})
+                    return
+                if route == "cancel":
+                    job["cancelled"] = True
+                self._send_json(200, standin._status(job))
+
+            def do_GET(self):
+                self._handle()
+
+            def do_POST(self):
+                self._handle()
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
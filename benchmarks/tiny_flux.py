@@ -0,0 +1,104 @@
+"""
+Tiny random-weight Flux pipeline for CPU benchmarks
+
+Mirrors the component layout of FLUX.1-dev with toy sizes so handler code
+paths can be exercised without the real model or a GPU.
+"""
+
+import os
+import sys
+
+import torch
+from diffusers import AutoencoderKL, FlowMatchEulerDiscreteScheduler, FluxPipeline, FluxTransformer2DModel
+from safetensors.torch import save_file
+from transformers import AutoTokenizer, CLIPTextConfig, CLIPTextModel, CLIPTokenizer, T5EncoderModel
+
+# Make the worker modules in the repository root importable from benchmark scripts
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if REPO_ROOT not in sys.path:
+    sys.path.insert(0, REPO_ROOT)
+
+
+def make_tiny_pipeline(seed=0, num_layers=1, num_single_layers=1):
+    """Build a tiny FluxPipeline with random weights on CPU"""
+    torch.manual_seed(seed)
+    transformer = FluxTransformer2DModel(
+        patch_size=1,
+        in_channels=4,
+        num_layers=num_layers,
+        num_single_layers=num_single_layers,
+        attention_head_dim=16,
+        num_attention_heads=2,
+        joint_attention_dim=32,
+        pooled_projection_dim=32,
+        axes_dims_rope=[4, 4, 8],
+    )
+    text_encoder = CLIPTextModel(CLIPTextConfig(
+        bos_token_id=0,
+        eos_token_id=2,
+        hidden_size=32,
+        intermediate_size=37,
+        layer_norm_eps=1e-05,
+        num_attention_heads=4,
+        num_hidden_layers=5,
+        pad_token_id=1,
+        vocab_size=1000,
+        hidden_act="gelu",
+        projection_dim=32,
+    ))
+    text_encoder_2 = T5EncoderModel.from_pretrained("hf-internal-testing/tiny-random-t5")
+    tokenizer = CLIPTokenizer.from_pretrained("hf-internal-testing/tiny-random-clip")
+    tokenizer_2 = AutoTokenizer.from_pretrained("hf-internal-testing/tiny-random-t5")
+    vae = AutoencoderKL(
+        sample_size=32,
+        in_channels=3,
+        out_channels=3,
+        block_out_channels=(4,),
+        layers_per_block=1,
+        latent_channels=1,
+        norm_num_groups=1,
+        use_quant_conv=False,
+        use_post_quant_conv=False,
+        shift_factor=0.0609,
+        scaling_factor=1.5035,
+    )
+    pipe = FluxPipeline(
+        scheduler=FlowMatchEulerDiscreteScheduler(),
+        vae=vae,
+        text_encoder=text_encoder,
+        tokenizer=tokenizer,
+        text_encoder_2=text_encoder_2,
+        tokenizer_2=tokenizer_2,
+        transformer=transformer,
+    )
+    pipe.set_progress_bar_config(disable=True)
+    return pipe
+
+
+def make_tiny_lora(pipe, directory, weight_name="lora.safetensors", rank=4, seed=0,
+                   targets=("to_q", "to_k", "to_v")):
+    """Write a random LoRA for the tiny transformer's attention projections"""
+    generator = torch.Generator().manual_seed(seed)
+    state_dict = {}
+    for name, module in pipe.transformer.named_modules():
+        if not isinstance(module, torch.nn.Linear) or name.split(".")[-1] not in targets:
+            continue
+        prefix = f"transformer.{name}"
+        state_dict[f"{prefix}.lora_A.weight"] = torch.randn(rank, module.in_features, generator=generator) * 0.01
+        state_dict[f"{prefix}.lora_B.weight"] = torch.randn(module.out_features, rank, generator=generator) * 0.01
+    os.makedirs(directory, exist_ok=True)
+    save_file(state_dict, os.path.join(directory, weight_name))
+    return directory
+
+
+def tiny_input_validator(min_size=16):
+    """Handler input validator that also accepts the small sizes the tiny pipeline renders"""
+    from schemas import INPUT_SCHEMA
+    from validation import InputValidator
+
+    sizes = {"constraints": lambda x: min_size <= x <= 2048, "allowed": f"{min_size}-2048"}
+    return InputValidator(schema={
+        **INPUT_SCHEMA,
+        "height": {**INPUT_SCHEMA["height"], **sizes},
+        "width": {**INPUT_SCHEMA["width"], **sizes},
+    })
@@ -0,0 +1,189 @@
+"""
+Opt-in regional compilation of the Flux transformer with resolution buckets
+
+torch.compile specializes on the latent sequence length, so compiling for any
+height and width in 256-2048 would recompile on nearly every new shape.
+Instead:
+
+- Each double-stream and single-stream transformer block is compiled on its
+  own. Blocks of one kind run the same code, so one compiled graph serves all
+  of them and compiling takes a fraction of a whole-model compile.
+- Requested sizes are snapped up to a resolution bucket (COMPILE_BUCKETS, or
+  the next multiple of COMPILE_BUCKET_MULTIPLE), generated at the bucket size
+  and center-cropped back, so only a handful of shapes are ever compiled.
+- Inductor's FX graph cache and the Triton kernel cache live in
+  COMPILE_CACHE_DIR, so a restarted worker reuses compiled code.
+- Bucket usage is counted on disk, and startup warmup compiles the most
+  requested buckets first.
+
+Loading or switching LoRA adapters changes the modules the blocks run, so the
+first job with a new adapter set recompiles the blocks for its bucket.
+"""
+
+import json
+import os
+import threading
+import time
+from collections import Counter
+
+import torch
+
+from startup import MODEL_CACHE_DIR
+
+
+# Compile the transformer blocks (opt-in)
+COMPILE_TRANSFORMER = os.environ.get("COMPILE_TRANSFORMER", "0") == "1"
+# torch.compile mode for the blocks (e.g. max-autotune-no-cudagraphs)
+COMPILE_MODE = os.environ.get("COMPILE_MODE") or None
+# WIDTHxHEIGHT buckets, e.g. "1024x1024,832x1216,1216x832" (empty = next multiple of COMPILE_BUCKET_MULTIPLE)
+COMPILE_BUCKETS = os.environ.get("COMPILE_BUCKETS", "512x512,768x768,1024x1024,832x1216,1216x832,1024x768,768x1024")
+COMPILE_BUCKET_MULTIPLE = int(os.environ.get("COMPILE_BUCKET_MULTIPLE", "64"))
+# Inductor/Triton caches and bucket usage counts, kept across worker restarts
+COMPILE_CACHE_DIR = os.environ.get("COMPILE_CACHE_DIR", os.path.join(MODEL_CACHE_DIR, "compile-cache"))
+# Buckets compiled at startup (most requested first) and steps per warmup run
+COMPILE_WARMUP_BUCKETS = int(os.environ.get("COMPILE_WARMUP_BUCKETS", "2"))
+COMPILE_WARMUP_STEPS = int(os.environ.get("COMPILE_WARMUP_STEPS", "2"))
+# Compiled variants kept per block before falling back to eager (buckets x adapter sets)
+COMPILE_CACHE_SIZE_LIMIT = int(os.environ.get("COMPILE_CACHE_SIZE_LIMIT", "64"))
+
+USAGE_FILE = "bucket_usage.json"
+# Flux latents are 2x2-packed after the 8x VAE, so sizes must be multiples of 16
+SIZE_MULTIPLE = 16
+
+
+def parse_buckets(spec):
+    """Parse "WIDTHxHEIGHT,..." into a list of (height, width)"""
+    buckets = []
+    for item in filter(None, (part.strip() for part in spec.split(","))):
+        width, height = (int(value) for value in item.lower().split("x"))
+        if height % SIZE_MULTIPLE or width % SIZE_MULTIPLE:
+            raise ValueError(f"Compile bucket {item} is not a multiple of {SIZE_MULTIPLE}")
+        buckets.append((height, width))
+    return buckets
+
+
+def round_up(value, multiple):
+    return -(-value // multiple) * multiple
+
+
+def configure_cache(cache_dir=COMPILE_CACHE_DIR):
+    """Point Inductor's FX graph cache and Triton's kernel cache at a persistent directory"""
+    os.makedirs(cache_dir, exist_ok=True)
+    os.environ.setdefault("TORCHINDUCTOR_CACHE_DIR", os.path.join(cache_dir, "inductor"))
+    os.environ.setdefault("TRITON_CACHE_DIR", os.path.join(cache_dir, "triton"))
+    import torch._dynamo
+    import torch._inductor.config
+    torch._inductor.config.fx_graph_cache = True
+    torch._dynamo.config.cache_size_limit = max(torch._dynamo.config.cache_size_limit, COMPILE_CACHE_SIZE_LIMIT)
+
+
+def compile_blocks(transformer, mode=COMPILE_MODE):
+    """
+    Compile every transformer block in place
+
+    Returns:
+        int: Number of blocks compiled
+    """
+    blocks = list(transformer.transformer_blocks) + list(transformer.single_transformer_blocks)
+    for block in blocks:
+        block.compile(mode=mode, dynamic=False)
+    return len(blocks)
+
+
+def center_crop(image, height, width):
+    """Crop an image generated at a bucket size (PIL image or [H, W, 3] array) back to the requested size"""
+    if hasattr(image, "shape"):
+        image_height, image_width = image.shape[:2]
+    else:
+        image_height, image_width = image.height, image.width
+    if image_height == height and image_width == width:
+        return image
+    top = (image_height - height) // 2
+    left = (image_width - width) // 2
+    if hasattr(image, "shape"):
+        # A view of the frame, copied only when it is encoded
+        return image[top:top + height, left:left + width]
+    return image.crop((left, top, left + width, top + height))
+
+
+class ResolutionBuckets:
+    """Snaps requested sizes to compiled shapes and counts how often each is used"""
+
+    def __init__(self, buckets=None, multiple=COMPILE_BUCKET_MULTIPLE, cache_dir=COMPILE_CACHE_DIR):
+        """
+        Initialize the buckets
+
+        Args:
+            buckets: (height, width) buckets (defaults to COMPILE_BUCKETS)
+            multiple: Sizes outside every bucket are rounded up to this multiple
+            cache_dir: Directory holding the usage counts
+        """
+        self.buckets = sorted(parse_buckets(COMPILE_BUCKETS) if buckets is None else buckets,
+                              key=lambda bucket: bucket[0] * bucket[1])
+        self.multiple = multiple
+        self.usage_path = os.path.join(cache_dir, USAGE_FILE) if cache_dir else None
+        self.lock = threading.Lock()
+        self.usage = Counter()
+        if self.usage_path and os.path.exists(self.usage_path):
+            try:
+                with open(self.usage_path) as f:
+                    self.usage.update({tuple(json.loads(key)): count for key, count in json.load(f).items()})
+            except (OSError, ValueError) as e:
+                print(f"Ignoring unreadable bucket usage file: {e}")
+
+    def snap(self, height, width):
+        """Smallest bucket that contains the requested size, else the size rounded up to the multiple"""
+        for bucket_height, bucket_width in self.buckets:
+            if bucket_height >= height and bucket_width >= width:
+                return bucket_height, bucket_width
+        return round_up(height, self.multiple), round_up(width, self.multiple)
+
+    def record(self, bucket):
+        """Count a generation at a bucket (persisted for the next startup's warmup)"""
+        with self.lock:
+            self.usage[tuple(bucket)] += 1
+            if not self.usage_path:
+                return
+            try:
+                tmp_path = f"{self.usage_path}.tmp{threading.get_ident()}"
+                with open(tmp_path, "w") as f:
+                    json.dump({json.dumps(list(key)): count for key, count in self.usage.items()}, f)
+                os.replace(tmp_path, self.usage_path)
+            except OSError as e:
+                print(f"Could not save bucket usage: {e}")
+
+    def most_requested(self, count):
+        """The `count` most used buckets so far, topped up with the configured ones in order"""
+        with self.lock:
+            ranked = [bucket for bucket, _ in self.usage.most_common()]
+        for bucket in self.buckets:
+            if bucket not in ranked:
+                ranked.append(bucket)
+        return ranked[:count]
+
+
+def warm_buckets(pipe, prompt_cache, buckets, steps=COMPILE_WARMUP_STEPS):
+    """
+    Run a short generation per bucket so its blocks are compiled before the first job
+
+    Returns:
+        dict: Seconds per bucket, keyed "WIDTHxHEIGHT"
+    """
+    prompt_embeds, pooled_prompt_embeds = prompt_cache.encode(["warmup"])
+    timings = {}
+    for height, width in buckets:
+        start = time.perf_counter()
+        pipe(
+            prompt_embeds=prompt_embeds,
+            pooled_prompt_embeds=pooled_prompt_embeds,
+            height=height,
+            width=width,
+            num_inference_steps=steps,
+            guidance_scale=3.5,
+            output_type="latent"
+        )
+        if torch.cuda.is_available():
+            torch.cuda.synchronize()
+        timings[f"{width}x{height}"] = time.perf_counter() - start
+        print(f"Compiled bucket {width}x{height} in {timings[f'{width}x{height}']:.1f}s")
+    return timings
@@ -6,30 +6,79 @@ This runs during Docker image build to cache the models
 
 import torch
 from diffusers import FluxPipeline
-from huggingface_hub import snapshot_download, login
+from huggingface_hub import login
+import json
 import os
+from hub_download import RangeDownloader, download_snapshot
+from lora_cache import adapter_nbytes
+from quantization import QUANTIZATION_MODES, QUANTIZE_GROUP_SIZE, save_quantized
+from startup import (
+    BASE_MODEL_ID, BASE_MODEL_DIR, BASE_MODEL_PATTERNS, UNCENSORED_LORA_ID, UNCENSORED_LORA_DIR,
+    FUSED_MODEL_DIR, FUSED_MANIFEST, WEIGHTS_MANIFEST, MODEL_VARIANT, QUANTIZED_MODEL_DIR, QUANTIZED_MANIFEST,
+    QUANTIZABLE_MODELS, select_variant, fused_checkpoint, model_variant, weight_variant, weights_manifest
+)
+
+
+# Fuse the always-on uncensored LoRA into the base weights at build time
+FUSE_UNCENSORED_LORA = os.environ.get("FUSE_UNCENSORED_LORA", "1") == "1"
+FUSED_ADAPTER = "fused"
+# Delete the base weights of fused components so the transformer is not baked into the image twice
+PRUNE_FUSED_SOURCES = os.environ.get("PRUNE_FUSED_SOURCES", "1") == "1"
+# Pipeline components a LoRA can touch; the others are not loaded for fusing
+LORA_COMPONENTS = ("transformer", "text_encoder")
+
+# Weight-only quantization applied once here, per component: int8, int4 or empty (keep bfloat16)
+QUANTIZE_TRANSFORMER = os.environ.get("QUANTIZE_TRANSFORMER", "")
+QUANTIZE_TEXT_ENCODER_2 = os.environ.get("QUANTIZE_TEXT_ENCODER_2", "")
+# Delete the bfloat16 weights of quantized components so they are not baked into the image
+PRUNE_QUANTIZED_SOURCES = os.environ.get("PRUNE_QUANTIZED_SOURCES", "1") == "1"
+
+# Revision of the base model to bake (resolved to a commit recorded in the manifest)
+BASE_MODEL_REVISION = os.environ.get("BASE_MODEL_REVISION") or None
+# Parallel Range requests, their size, and files downloaded at once
+MODEL_DOWNLOAD_STREAMS = int(os.environ.get("MODEL_DOWNLOAD_STREAMS", "8"))
+MODEL_DOWNLOAD_CHUNK_MB = float(os.environ.get("MODEL_DOWNLOAD_CHUNK_MB", "64"))
+MODEL_DOWNLOAD_FILES = int(os.environ.get("MODEL_DOWNLOAD_FILES", "4"))
+
+
+def make_downloader():
+    return RangeDownloader(
+        streams=MODEL_DOWNLOAD_STREAMS,
+        chunk_bytes=int(MODEL_DOWNLOAD_CHUNK_MB * 1024 * 1024),
+        timeout=120,
+        thread_name_prefix="model-chunk"
+    )
 
 
 def download_base_model():
-    """Download FLUX.1-dev base model"""
+    """
+    Download the FLUX.1-dev files the runtime loads (no model is instantiated)
+
+    Only the diffusers components' configs and safetensors weights of
+    MODEL_VARIANT are fetched, and the weights manifest lets the worker start
+    without contacting the hub.
+    """
     print("=" * 80)
     print("Downloading FLUX.1-dev base model...")
     print("=" * 80)
     
-    cache_dir = "/workspace/models"
-    os.makedirs(cache_dir, exist_ok=True)
-    
     try:
-        # Download the base model
-        pipe = FluxPipeline.from_pretrained(
-            "black-forest-labs/FLUX.1-dev",
-            cache_dir=cache_dir,
-            torch_dtype=torch.bfloat16
-        )
-        print("✓ FLUX.1-dev base model downloaded successfully!")
-        
-        # Clean up to save memory
-        del pipe
+        downloader = make_downloader()
+        try:
+            download_snapshot(
+                BASE_MODEL_ID,
+                BASE_MODEL_DIR,
+                allow_patterns=BASE_MODEL_PATTERNS,
+                select=select_variant(MODEL_VARIANT),
+                revision=BASE_MODEL_REVISION,
+                downloader=downloader,
+                max_files=MODEL_DOWNLOAD_FILES,
+                manifest_name=WEIGHTS_MANIFEST,
+                extra={"variant": MODEL_VARIANT}
+            )
+        finally:
+            downloader.shutdown()
+        print(f"✓ FLUX.1-dev base model downloaded to {BASE_MODEL_DIR}")
         
     except Exception as e:
         print(f"✗ Error downloading base model: {e}")
@@ -42,17 +91,19 @@ def download_uncensored_lora():
     print("Downloading Flux-uncensored LoRA weights...")
     print("=" * 80)
     
-    cache_dir = "/workspace/models"
-    os.makedirs(cache_dir, exist_ok=True)
-    
     try:
-        # Download the uncensored LoRA
-        snapshot_download(
-            repo_id="enhanceaiteam/Flux-uncensored",
-            cache_dir=cache_dir,
-            local_dir=f"{cache_dir}/enhanceaiteam--Flux-uncensored",
-            local_dir_use_symlinks=False
-        )
+        # Only the weights: the LoRA is loaded from the directory
+        downloader = make_downloader()
+        try:
+            download_snapshot(
+                UNCENSORED_LORA_ID,
+                UNCENSORED_LORA_DIR,
+                allow_patterns=["*.safetensors"],
+                downloader=downloader,
+                manifest_name=WEIGHTS_MANIFEST
+            )
+        finally:
+            downloader.shutdown()
         print("✓ Flux-uncensored LoRA weights downloaded successfully!")
         
     except Exception as e:
@@ -60,6 +111,176 @@ def download_uncensored_lora():
         raise
 
 
+def fuse_lora_into_pipeline(pipe, lora_source, lora_scale=1.0):
+    """
+    Fuse a LoRA into the pipeline weights and remove the adapter layers
+
+    Returns the names of the components whose weights changed.
+    """
+    pipe.load_lora_weights(lora_source, adapter_name=FUSED_ADAPTER)
+    components = sorted(adapter_nbytes(pipe, FUSED_ADAPTER))
+    pipe.fuse_lora(components=components, lora_scale=lora_scale, adapter_names=[FUSED_ADAPTER])
+    pipe.unload_lora_weights()
+    return components
+
+
+def save_fused_checkpoint(pipe, components, output_dir, lora, lora_scale=1.0):
+    """Save the fused components and a manifest the handler uses to find them"""
+    os.makedirs(output_dir, exist_ok=True)
+    for name in components:
+        getattr(pipe, name).save_pretrained(os.path.join(output_dir, name), safe_serialization=True)
+
+    with open(os.path.join(output_dir, FUSED_MANIFEST), "w") as f:
+        json.dump({
+            "base_model": BASE_MODEL_ID,
+            "lora": lora,
+            "lora_scale": lora_scale,
+            "components": components,
+            "dtype": str(pipe.transformer.dtype),
+        }, f, indent=2)
+
+
+def lora_components(lora_source):
+    """Pipeline components a LoRA has weights for"""
+    state_dict = FluxPipeline.lora_state_dict(lora_source)
+    return sorted({key.split(".")[0] for key in state_dict} & set(LORA_COMPONENTS))
+
+
+def build_fused_checkpoint():
+    """Fuse the uncensored LoRA into FLUX.1-dev and save the fused checkpoint"""
+    print("=" * 80)
+    print("Fusing Flux-uncensored LoRA into FLUX.1-dev...")
+    print("=" * 80)
+    
+    try:
+        # Only the components the LoRA touches are loaded (not T5-XXL or the VAE)
+        touched = lora_components(UNCENSORED_LORA_DIR)
+        skipped = {name: None for name in ("text_encoder", "text_encoder_2", "vae", "tokenizer", "tokenizer_2")
+                   if name not in touched}
+        pipe = FluxPipeline.from_pretrained(
+            BASE_MODEL_DIR,
+            torch_dtype=torch.bfloat16,
+            variant=model_variant(BASE_MODEL_DIR),
+            **skipped
+        )
+        components = fuse_lora_into_pipeline(pipe, UNCENSORED_LORA_DIR)
+        save_fused_checkpoint(pipe, components, FUSED_MODEL_DIR, lora=UNCENSORED_LORA_ID)
+        print(f"✓ Fused checkpoint ({', '.join(components)}) saved to {FUSED_MODEL_DIR}")
+        
+        # Clean up to save memory
+        del pipe
+
+        if PRUNE_FUSED_SOURCES:
+            deleted = prune_replaced_weights(components, BASE_MODEL_DIR)
+            print(f"✓ Removed {deleted / 1024 ** 3:.2f}GB of base weights replaced by the fused checkpoint")
+        
+    except Exception as e:
+        print(f"✗ Error building fused checkpoint: {e}")
+        raise
+
+
+def quantize_checkpoint(model_dir, output_dir, modes, fused=None, dtype=torch.bfloat16,
+                        group_size=QUANTIZE_GROUP_SIZE):
+    """
+    Quantize components and save them with a manifest the handler uses to find them
+
+    Args:
+        model_dir: Base model directory
+        output_dir: Quantized checkpoint directory
+        modes: Component name -> "int8" or "int4"
+        fused: Fused checkpoint manifest; its components are quantized from the fused weights
+        dtype: Dtype of the scales, biases and unquantized layers
+
+    Returns:
+        dict: Manifest entry of every quantized component
+    """
+    for name, mode in modes.items():
+        if name not in QUANTIZABLE_MODELS or mode not in QUANTIZATION_MODES:
+            raise ValueError(f"Cannot quantize {name} to {mode!r} (modes: {', '.join(QUANTIZATION_MODES)})")
+    os.makedirs(output_dir, exist_ok=True)
+    components = {}
+    for name, mode in modes.items():
+        fused_lora = fused["lora"] if fused and name in fused["components"] else None
+        path = fused["path"] if fused_lora else model_dir
+        model = QUANTIZABLE_MODELS[name].from_pretrained(
+            path,
+            subfolder=name,
+            torch_dtype=dtype,
+            low_cpu_mem_usage=True,
+            # The fused checkpoint is saved without a variant suffix
+            variant=None if fused_lora else model_variant(model_dir)
+        )
+        spec = save_quantized(model, os.path.join(output_dir, name), name, mode, group_size)
+        spec["fused_lora"] = fused_lora
+        components[name] = spec
+        print(f"✓ Quantized {name} to {mode}: {spec['layers']} layers, {spec['bytes'] / 1024 ** 3:.2f}GB")
+        del model
+
+    with open(os.path.join(output_dir, QUANTIZED_MANIFEST), "w") as f:
+        json.dump({"base_model": BASE_MODEL_ID, "components": components, "dtype": str(dtype)}, f, indent=2)
+    return components
+
+
+def prune_replaced_weights(names, model_dir, fused=None):
+    """
+    Delete the weights of components replaced by a build-time checkpoint and drop them from the weights manifest
+
+    Args:
+        names: Replaced components
+        model_dir: Base model directory
+        fused: Fused checkpoint manifest; its copies of the components are deleted too
+
+    Returns:
+        int: Bytes deleted
+    """
+    manifest = weights_manifest(model_dir)
+    deleted = 0
+    for name in names:
+        directories = [(os.path.join(model_dir, name), manifest)]
+        if fused and name in fused["components"]:
+            directories.append((os.path.join(fused["path"], name), None))
+        for directory, directory_manifest in directories:
+            if not os.path.isdir(directory):
+                continue
+            for filename in os.listdir(directory):
+                # Configs stay, weights and weight indexes go
+                if weight_variant(filename) is False:
+                    continue
+                path = os.path.join(directory, filename)
+                deleted += os.path.getsize(path)
+                os.remove(path)
+                if directory_manifest is not None:
+                    directory_manifest["files"].pop(f"{name}/{filename}", None)
+    if manifest is not None:
+        with open(os.path.join(model_dir, WEIGHTS_MANIFEST), "w") as f:
+            json.dump(manifest, f, indent=2)
+    return deleted
+
+
+def build_quantized_checkpoint():
+    """Quantize the transformer and/or T5 encoder (from the fused weights where built) and save them"""
+    modes = {
+        name: mode
+        for name, mode in (("transformer", QUANTIZE_TRANSFORMER), ("text_encoder_2", QUANTIZE_TEXT_ENCODER_2))
+        if mode
+    }
+    print("=" * 80)
+    print(f"Quantizing {', '.join(f'{name} to {mode}' for name, mode in modes.items())}...")
+    print("=" * 80)
+
+    try:
+        fused = fused_checkpoint()
+        quantize_checkpoint(BASE_MODEL_DIR, QUANTIZED_MODEL_DIR, modes, fused=fused)
+        print(f"✓ Quantized checkpoint saved to {QUANTIZED_MODEL_DIR}")
+        if PRUNE_QUANTIZED_SOURCES:
+            deleted = prune_replaced_weights(list(modes), BASE_MODEL_DIR, fused=fused)
+            print(f"✓ Removed {deleted / 1024 ** 3:.2f}GB of bfloat16 weights replaced by the quantized checkpoint")
+
+    except Exception as e:
+        print(f"✗ Error building quantized checkpoint: {e}")
+        raise
+
+
 def main():
     """Main download function"""
     print("\n")
@@ -100,6 +321,17 @@ def main():
     download_uncensored_lora()
     
     print("\n")
+    
+    # Fuse the uncensored LoRA into the base weights
+    if FUSE_UNCENSORED_LORA:
+        build_fused_checkpoint()
+        print("\n")
+
+    # Quantize after fusing, so the quantized weights include the fused LoRA
+    if QUANTIZE_TRANSFORMER or QUANTIZE_TEXT_ENCODER_2:
+        build_quantized_checkpoint()
+        print("\n")
+    
     print("╔" + "=" * 78 + "╗")
     print("║" + " " * 25 + "Download Complete!" + " " * 32 + "║")
     print("╚" + "=" * 78 + "╝")
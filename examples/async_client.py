@@ -0,0 +1,383 @@
+#!/usr/bin/env python3
+"""
+Asyncio client for the FLUX Custom Faces RunPod Worker, built for many jobs at once
+
+- One pooled aiohttp session: TCP/TLS connections are reused across requests
+  instead of being set up per call.
+- At most max_concurrency requests in flight however many jobs are submitted,
+  and optionally at most max_jobs jobs (see generate_many).
+- Status polls are scheduled from observed job latency: the first check waits
+  for about the median latency of recent jobs, then polls back off from
+  min_poll towards max_poll, capped at a quarter of the median, so a job is
+  neither polled pointlessly nor picked up late.
+- Outputs are decoded while the response streams in: with output_dir set,
+  base64 data URIs are written straight to image files and the result holds
+  their paths, so a multi-megabyte response is never held in memory.
+- Connection errors, timeouts, 429 and 5xx responses are retried with
+  jittered backoff. Status and cancel requests are idempotent by nature. A job
+  input is pinned to a seed before its first /run, so a /run retried after an
+  ambiguous failure asks for exactly the same image, which the worker can
+  serve from its result cache or in-flight deduplication.
+
+Requires aiohttp: pip install aiohttp
+"""
+
+import asyncio
+import base64
+import hashlib
+import json
+import os
+import random
+import statistics
+import time
+from collections import Counter, deque
+
+import aiohttp
+
+
+FINAL_STATUSES = ("COMPLETED", "FAILED", "CANCELLED", "TIMED_OUT")
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+DATA_URI_MARKER = b'"data:image/'
+CHUNK_BYTES = 64 * 1024
+
+
+class RetryableStatus(Exception):
+    """A response status worth retrying (rate limit or server error)"""
+
+
+class LatencyTracker:
+    """Recent job latencies (submit to completion), used to schedule status polls"""
+
+    def __init__(self, window=100, initial=None):
+        """
+        Args:
+            window: Latencies kept
+            initial: Expected latency in seconds before any job has finished (None = unknown)
+        """
+        self.samples = deque(maxlen=window)
+        self.initial = initial
+
+    def record(self, seconds):
+        self.samples.append(seconds)
+
+    def expected(self):
+        """Median recent latency, or the initial guess"""
+        return statistics.median(self.samples) if self.samples else self.initial
+
+
+class DataUriWriter:
+    """
+    Incrementally parses a JSON response, writing base64 image data URIs to files
+
+    Everything outside the data URIs is kept and parsed at the end, with each
+    data URI replaced by the path of its file. A data URI repeating an earlier
+    one (image_url is images[0]) reuses its file.
+    """
+
+    def __init__(self, directory, prefix):
+        self.directory = directory
+        self.prefix = prefix
+        self.text = bytearray()
+        self.paths = []
+        self._pending = b""
+        self._file = None
+        self._path = None
+        self._digest = None
+        self._remainder = b""
+        self._written = {}
+
+    def feed(self, chunk):
+        data = self._pending + chunk
+        self._pending = b""
+        while data:
+            if self._file is None:
+                start = data.find(DATA_URI_MARKER)
+                if start < 0:
+                    # Keep a tail that may be the beginning of the next marker
+                    keep = min(len(data), len(DATA_URI_MARKER) - 1)
+                    self.text += data[:len(data) - keep]
+                    self._pending = data[len(data) - keep:]
+                    return
+                comma = data.find(b",", start)
+                if comma < 0:
+                    self.text += data[:start]
+                    self._pending = data[start:]
+                    return
+                self.text += data[:start]
+                media_type = data[start + 1:comma].split(b";")[0].decode()
+                self._open(media_type.split("/")[-1])
+                data = data[comma + 1:]
+            else:
+                end = data.find(b'"')
+                # JSON may escape "/" as "\/"
+                self._write((data if end < 0 else data[:end]).replace(b"\\", b""))
+                if end < 0:
+                    return
+                self.text += json.dumps(self._close()).encode()
+                data = data[end + 1:]
+
+    def _open(self, extension):
+        os.makedirs(self.directory, exist_ok=True)
+        self._path = os.path.join(self.directory, f"{self.prefix}_{len(self.paths)}.{extension}")
+        self._file = open(self._path, "wb")
+        self._digest = hashlib.sha256()
+        self._remainder = b""
+
+    def _write(self, encoded):
+        encoded = self._remainder + encoded
+        usable = len(encoded) - len(encoded) % 4
+        self._remainder = encoded[usable:]
+        decoded = base64.b64decode(encoded[:usable])
+        self._digest.update(decoded)
+        self._file.write(decoded)
+
+    def _close(self):
+        self._file.close()
+        self._file = None
+        digest = self._digest.hexdigest()
+        if digest in self._written:
+            os.remove(self._path)
+            return self._written[digest]
+        self._written[digest] = self._path
+        self.paths.append(self._path)
+        return self._path
+
+    def result(self):
+        """The parsed response, data URIs replaced by file paths"""
+        if self._file is not None:
+            self._file.close()
+            raise ValueError("Response ended inside a data URI")
+        return json.loads(bytes(self.text + self._pending))
+
+    def discard(self):
+        """Remove the files of an interrupted response"""
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+            os.remove(self._path)
+        for path in self.paths:
+            if os.path.exists(path):
+                os.remove(path)
+
+
+class AsyncFluxCustomFacesClient:
+    """Asyncio client for FLUX Custom Faces RunPod Worker"""
+
+    def __init__(self, endpoint_id: str, api_key: str, base_url=None, max_concurrency=32, max_connections=None,
+                 retries=4, retry_backoff=0.5, min_poll=0.25, max_poll=10.0, request_timeout=120.0,
+                 output_dir=None):
+        """
+        Initialize the client
+
+        Args:
+            endpoint_id: Your RunPod endpoint ID
+            api_key: Your RunPod API key
+            base_url: Endpoint URL (defaults to https://api.runpod.ai/v2/{endpoint_id})
+            max_concurrency: Most HTTP requests in flight
+            max_connections: Size of the connection pool (defaults to max_concurrency)
+            retries: Retries per request after a connection error, timeout, 429 or 5xx
+            retry_backoff: First retry delay in seconds, doubled per retry
+            min_poll: Shortest interval between status polls in seconds
+            max_poll: Longest interval between status polls in seconds
+            request_timeout: Timeout of one request in seconds
+            output_dir: Write images here while responses stream in (None = keep base64 in the result)
+        """
+        self.base_url = base_url or f"https://api.runpod.ai/v2/{endpoint_id}"
+        self.headers = {
+            "Authorization": f"Bearer {api_key}",
+            "Content-Type": "application/json"
+        }
+        self.max_concurrency = max_concurrency
+        self.max_connections = max_connections or max_concurrency
+        self.retries = retries
+        self.retry_backoff = retry_backoff
+        self.min_poll = min_poll
+        self.max_poll = max_poll
+        self.request_timeout = request_timeout
+        self.output_dir = output_dir
+        self.latency = LatencyTracker()
+        self.requests = Counter()
+        self.retried = 0
+        self._session = None
+        self._semaphore = None
+
+    async def __aenter__(self):
+        await self.open()
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.close()
+
+    async def open(self):
+        """Create the pooled session (done by `async with`)"""
+        if self._session is None:
+            connector = aiohttp.TCPConnector(limit=self.max_connections, ttl_dns_cache=300, keepalive_timeout=60)
+            self._session = aiohttp.ClientSession(
+                headers=self.headers,
+                connector=connector,
+                timeout=aiohttp.ClientTimeout(total=self.request_timeout)
+            )
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+
+    async def close(self):
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+    async def _request(self, method, route, payload=None, output_prefix=None):
+        """Send one request with retries, decoding a streamed response when output_prefix is given"""
+        url = f"{self.base_url}/{route}"
+        for attempt in range(self.retries + 1):
+            writer = None
+            if output_prefix is not None and self.output_dir is not None:
+                writer = DataUriWriter(self.output_dir, output_prefix)
+            try:
+                async with self._semaphore:
+                    self.requests[route.split("/")[0]] += 1
+                    async with self._session.request(method, url, json=payload) as response:
+                        if response.status in RETRY_STATUSES:
+                            raise RetryableStatus(f"HTTP {response.status} from {route}")
+                        response.raise_for_status()
+                        if writer is None:
+                            return await response.json()
+                        async for chunk in response.content.iter_chunked(CHUNK_BYTES):
+                            writer.feed(chunk)
+                        return writer.result()
+            except (aiohttp.ClientConnectionError, aiohttp.ClientPayloadError, asyncio.TimeoutError, RetryableStatus):
+                if writer is not None:
+                    writer.discard()
+                if attempt == self.retries:
+                    raise
+                self.retried += 1
+                await asyncio.sleep(self.retry_backoff * 2 ** attempt * random.uniform(0.5, 1.0))
+
+    @staticmethod
+    def pin_seed(job_input):
+        """Give the job a seed if it has none, so a resubmission asks for the same image"""
+        if job_input.get("seed") is None:
+            job_input = {**job_input, "seed": random.randrange(2 ** 31)}
+        return job_input
+
+    async def submit(self, **kwargs):
+        """
+        Queue a job (POST /run)
+
+        Args: Same as FluxCustomFacesClient.generate_sync()
+
+        Returns:
+            str: Job ID
+        """
+        response = await self._request("POST", "run", {"input": self.pin_seed(kwargs)})
+        return response["id"]
+
+    async def status(self, job_id: str):
+        """Check status of a job, writing its images to output_dir if it has completed"""
+        return await self._request("GET", f"status/{job_id}", output_prefix=job_id)
+
+    async def cancel(self, job_id: str):
+        """Cancel a queued or running job"""
+        return await self._request("POST", f"cancel/{job_id}")
+
+    async def wait(self, job_id: str, submitted=None):
+        """
+        Poll a job until it reaches a final status
+
+        Args:
+            job_id: Job ID from submit()
+            submitted: time.monotonic() of the submission (defaults to now)
+
+        Returns:
+            dict: Final status, with output if completed
+        """
+        submitted = submitted if submitted is not None else time.monotonic()
+        expected = self.latency.expected()
+        delay = self.min_poll
+        if expected is not None:
+            # Check back around when recent jobs finished
+            delay = max(self.min_poll, expected - (time.monotonic() - submitted))
+        backoff = self.min_poll
+        while True:
+            await asyncio.sleep(delay)
+            result = await self.status(job_id)
+            if result["status"] in FINAL_STATUSES:
+                if result["status"] == "COMPLETED":
+                    self.latency.record(time.monotonic() - submitted)
+                return result
+            # Overshoot a finished job by at most a quarter of the latency seen so far (jobs finishing
+            # meanwhile refine it)
+            expected = self.latency.expected()
+            max_poll = self.max_poll if expected is None else min(self.max_poll, max(self.min_poll, expected / 4))
+            delay, backoff = min(backoff, max_poll), min(max_poll, backoff * 1.5)
+
+    async def generate(self, **kwargs):
+        """Submit a job and wait for it (POST /run, then GET /status)"""
+        submitted = time.monotonic()
+        job_id = await self.submit(**kwargs)
+        return await self.wait(job_id, submitted)
+
+    async def generate_sync(self, **kwargs):
+        """
+        Run a job with POST /runsync, polling only if it outlasts the synchronous wait
+
+        Args: Same as FluxCustomFacesClient.generate_sync()
+        """
+        submitted = time.monotonic()
+        job_input = self.pin_seed(kwargs)
+        result = await self._request("POST", "runsync", {"input": job_input},
+                                     output_prefix=f"sync_{job_input['seed']}")
+        if result["status"] in FINAL_STATUSES:
+            if result["status"] == "COMPLETED":
+                self.latency.record(time.monotonic() - submitted)
+            return result
+        return await self.wait(result["id"], submitted)
+
+    async def generate_many(self, inputs, max_jobs=None):
+        """
+        Run many jobs concurrently
+
+        Args:
+            inputs: Job inputs (dicts of generate_sync() arguments)
+            max_jobs: Most jobs submitted but unfinished at once (None = all)
+
+        Returns:
+            list: Final status per input, in order, or the exception that job raised
+        """
+        limit = asyncio.Semaphore(max_jobs) if max_jobs else None
+
+        async def run(job_input):
+            if limit is None:
+                return await self.generate(**job_input)
+            async with limit:
+                return await self.generate(**job_input)
+
+        return await asyncio.gather(*(run(job_input) for job_input in inputs), return_exceptions=True)
+
+    def stats(self):
+        """Requests by route, retries and the current latency estimate"""
+        return {"requests": dict(self.requests), "retried": self.retried, "expected_latency": self.latency.expected()}
+
+
+async def example_many():
+    """Generate a batch of portraits concurrently, writing the images to disk"""
+
+    ENDPOINT_ID = os.getenv("RUNPOD_ENDPOINT_ID")
+    API_KEY = os.getenv("RUNPOD_API_KEY")
+    HF_TOKEN = os.getenv("HF_TOKEN")
+
+    prompts = [f"Portrait of a person, {style}, professional lighting"
+               for style in ("studio", "outdoors", "golden hour", "black and white")]
+    async with AsyncFluxCustomFacesClient(ENDPOINT_ID, API_KEY, output_dir="outputs") as client:
+        results = await client.generate_many([
+            {"prompt": prompt, "hf_token": HF_TOKEN, "custom_lora_repo": "ladbhupesh/flux.1-dev-custom-faces"}
+            for prompt in prompts
+        ])
+        for prompt, result in zip(prompts, results):
+            if isinstance(result, Exception) or result["status"] != "COMPLETED":
+                print(f"✗ {prompt}: {result}")
+            else:
+                print(f"✓ {prompt}: {', '.join(result['output']['images'])}")
+        print(client.stats())
+
+
+if __name__ == "__main__":
+    asyncio.run(example_many())
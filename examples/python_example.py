@@ -13,21 +13,25 @@ from datetime import datetime
 class FluxCustomFacesClient:
     """Client for FLUX Custom Faces RunPod Worker"""
     
-    def __init__(self, endpoint_id: str, api_key: str):
+    def __init__(self, endpoint_id: str, api_key: str, base_url: str = None):
         """
         Initialize the client
         
         Args:
             endpoint_id: Your RunPod endpoint ID
             api_key: Your RunPod API key
+            base_url: Endpoint URL (defaults to https://api.runpod.ai/v2/{endpoint_id})
         """
         self.endpoint_id = endpoint_id
         self.api_key = api_key
-        self.base_url = f"https://api.runpod.ai/v2/{endpoint_id}"
+        self.base_url = base_url or f"https://api.runpod.ai/v2/{endpoint_id}"
         self.headers = {
             "Authorization": f"Bearer {api_key}",
             "Content-Type": "application/json"
         }
+        # Reuses connections across calls instead of a new TCP/TLS handshake per request
+        self.session = requests.Session()
+        self.session.headers.update(self.headers)
     
     def generate_sync(self, **kwargs):
         """
@@ -57,7 +61,7 @@ class FluxCustomFacesClient:
         url = f"{self.base_url}/runsync"
         payload = {"input": kwargs}
         
-        response = requests.post(url, headers=self.headers, json=payload)
+        response = self.session.post(url, json=payload)
         response.raise_for_status()
         
         return response.json()
@@ -74,7 +78,7 @@ class FluxCustomFacesClient:
         url = f"{self.base_url}/run"
         payload = {"input": kwargs}
         
-        response = requests.post(url, headers=self.headers, json=payload)
+        response = self.session.post(url, json=payload)
         response.raise_for_status()
         
         return response.json()
@@ -91,7 +95,7 @@ class FluxCustomFacesClient:
         """
         url = f"{self.base_url}/status/{job_id}"
         
-        response = requests.get(url, headers=self.headers)
+        response = self.session.get(url)
         response.raise_for_status()
         
         return response.json()
@@ -108,7 +112,7 @@ class FluxCustomFacesClient:
         """
         url = f"{self.base_url}/cancel/{job_id}"
         
-        response = requests.post(url, headers=self.headers)
+        response = self.session.post(url)
         response.raise_for_status()
         
         return response.json()
@@ -242,7 +246,7 @@ def example_async():
     job_id = job['id']
     print(f"Job ID: {job_id}")
     
-    # Poll for completion
+    # Poll for completion (see async_client.py for many jobs with latency-based polling)
     import time
     while True:
         status = client.check_status(job_id)
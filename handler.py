@@ -1,181 +1,1274 @@
 import runpod
 import torch
-from diffusers import FluxPipeline
-import boto3
+import asyncio
 import base64
-import io
+import functools
+import inspect
 import os
+import queue
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
-from schemas import INPUT_SCHEMA
+from diffusers import FluxPipeline
+from validation import InputValidator, ValidationError, job_cost
 from huggingface_hub import login
+from lora_cache import LoraCache, UNCENSORED_ADAPTER
+from lora_store import LoraStore, LORA_STORE_ENABLED
+from lora_pack import LoraPack, LORA_PACK_DIR
+from prompt_cache import PromptEmbeddingCache
+from batching import MicroBatcher, BATCHING_ENABLED, BATCH_CONCURRENCY
+from output_stage import OutputStage, gather, PIPELINED_OUTPUT, PIPELINE_CONCURRENCY
+from s3_pool import S3ClientPool, upload_bytes, object_url
+from image_encoding import encode_image, to_uint8, content_type, file_extension, TENSOR_OUTPUT
+from memory_planner import MemoryPlanner
+from quantization import match_adapter_dtype
+from metrics import JobMetrics, MetricsRegistry, MetricsExporter, timed
+from result_cache import ResultCache, InFlight, result_key, RESULT_CACHE_ENABLED
+from compilation import (
+    ResolutionBuckets, configure_cache, compile_blocks, center_crop, warm_buckets,
+    COMPILE_TRANSFORMER, COMPILE_WARMUP_BUCKETS
+)
+from step_cache import first_block_cache, FAST_MODE_THRESHOLD
+from batch_items import resolve_items, plan_chunks, summarize_items, ITEMS_MAX_CHUNK
+from latency_model import LatencyModel, job_shape, LATENCY_MODEL_ENABLED
+from replica_pool import ReplicaPool, replica_devices, REPLICA_DEVICES
+from previews import LatentPreviewer, ProgressReporter, encode_preview, STREAMING_ENABLED, PREVIEW_EVERY_N_STEPS
+from startup import (
+    PhaseTimer, load_base_pipeline, fused_checkpoint, quantized_checkpoint, uncensored_lora_source, warmup,
+    BASE_MODEL_ID, UNCENSORED_LORA_ID, EAGER_INIT
+)
+
 
+# INPUT_SCHEMA compiled once; checks every job before any other work
+input_validator = InputValidator(
+    defaults={"fast_mode_threshold": FAST_MODE_THRESHOLD, "preview_every": PREVIEW_EVERY_N_STEPS}
+)
 
 # Global pipeline variable
 pipe = None
 
+# Global LoRA adapter cache (created with the pipeline)
+lora_cache = None
+
+# Custom LoRA files on local disk, downloaded (and prefetched) in parallel chunks
+lora_store = LoraStore() if LORA_STORE_ENABLED else None
+
+# Memory-mapped pack of prebuilt customer LoRAs, checked before the hub
+lora_pack = LoraPack() if LORA_PACK_DIR else None
+
+# Global prompt embedding cache (created with the pipeline)
+prompt_cache = None
+
+# Global memory planner (created with the pipeline)
+memory_planner = None
+
+# Compiled resolution buckets (only created when the transformer is compiled)
+resolution_buckets = None
+
+# Latent-to-RGB preview projection (only created in streaming mode)
+latent_previewer = None
+
+# Encoded outputs of seeded jobs, keyed by their inputs
+result_cache = ResultCache() if RESULT_CACHE_ENABLED else None
+
+# Generations in progress, so identical concurrent jobs run once
+in_flight = InFlight()
+
+# Models baked into the pipeline (part of the result cache key)
+model_identity = None
+
+# Stage latencies learned from finished jobs, for predictions and ETAs
+latency_model = LatencyModel() if LATENCY_MODEL_ENABLED else None
+
+# Global micro-batcher (only used in batching mode)
+batcher = None
+
+# Background pool for image encoding and S3 uploads
+output_stage = OutputStage()
+
+# Reusable S3 clients keyed by credentials, region and endpoint
+s3_pool = S3ClientPool()
+
+# Cumulative worker metrics, exported in Prometheus text format
+metrics_registry = MetricsRegistry()
+metrics_exporter = MetricsExporter(metrics_registry)
+
+# Single thread that owns the GPU in pipelined output and streaming modes
+gpu_executor = None
+
+# Replica processes, one pipeline per device (only used in multi-replica mode)
+replica_pool = None
+
+# Per-phase breakdown of the last pipeline initialization (seconds)
+startup_timings = {}
+
+# Guards pipeline initialization when jobs arrive concurrently
+_init_lock = threading.Lock()
+
 
 def initialize_pipeline():
     """Initialize the Flux pipeline with base model and uncensored LoRA"""
-    global pipe
-    
-    if pipe is not None:
+    global pipe, lora_cache, prompt_cache, memory_planner, latent_previewer, resolution_buckets, model_identity
+    global startup_timings
+
+    with _init_lock:
+        if pipe is not None:
+            return pipe
+
+        print("Initializing Flux pipeline...")
+        timer = PhaseTimer()
+        device = torch.device("cuda") if torch.cuda.is_available() else torch.device("cpu")
+
+        # Load base model from cache (components in parallel, memory-mapped safetensors)
+        fused = fused_checkpoint()
+        quantized = quantized_checkpoint(fused)
+        if quantized:
+            print("Using quantized " + ", ".join(
+                f"{name} ({spec['mode']})" for name, spec in quantized["components"].items()))
+        flux_pipe = load_base_pipeline(device, timer, fused=fused, quantized=quantized)
+
+        if fused:
+            # The uncensored LoRA is already fused into the weights, so no adapter is pinned
+            print(f"Using fused checkpoint ({', '.join(fused['components'])}) with {fused['lora']} baked in")
+            pinned_adapters = []
+        else:
+            # Load uncensored LoRA (pre-downloaded into the image)
+            print("Loading uncensored LoRA weights...")
+            with timer.phase("uncensored_lora"):
+                flux_pipe.load_lora_weights(uncensored_lora_source(), adapter_name=UNCENSORED_ADAPTER)
+                match_adapter_dtype(flux_pipe, UNCENSORED_ADAPTER)
+            pinned_adapters = [UNCENSORED_ADAPTER]
+
+        model_identity = {
+            "base": BASE_MODEL_ID,
+            "fused": {name: value for name, value in fused.items() if name != "path"} if fused else None,
+            "uncensored_lora": None if fused else UNCENSORED_LORA_ID,
+            "quantized": {name: spec["mode"] for name, spec in quantized["components"].items()} if quantized else None,
+        }
+
+        with timer.phase("caches"):
+            # Custom faces LoRAs are cached as named adapters on top of the pinned uncensored LoRA
+            lora_cache = LoraCache(
+                flux_pipe,
+                pinned_adapters=pinned_adapters,
+                fetch=lora_store.fetch if lora_store else None,
+                pack=lora_pack
+            )
+
+            # Text encoders only run on prompt cache misses
+            prompt_cache = PromptEmbeddingCache(flux_pipe, device=device, fused=fused, quantized=quantized)
+
+            # Picks VAE slicing/tiling or CPU offload per job when the job would not fit resident
+            memory_planner = MemoryPlanner(
+                flux_pipe,
+                device,
+                keep_on_cpu=["text_encoder_2"] if prompt_cache.offload_t5 else []
+            )
+
+        if STREAMING_ENABLED:
+            with timer.phase("previews"):
+                latent_previewer = LatentPreviewer(flux_pipe)
+
+        if COMPILE_TRANSFORMER:
+            # Per-block compilation, served at a few bucketed shapes from a persistent cache
+            with timer.phase("compile"):
+                configure_cache()
+                blocks = compile_blocks(flux_pipe.transformer)
+                resolution_buckets = ResolutionBuckets()
+            print(f"Compiled {blocks} transformer blocks")
+            with timer.phase("compile_warmup"):
+                warm_buckets(flux_pipe, prompt_cache, resolution_buckets.most_requested(COMPILE_WARMUP_BUCKETS))
+
+        warmup(flux_pipe, prompt_cache, timer)
+        pipe = flux_pipe
+
+        startup_timings = timer.report()
+        timer.print_report("Pipeline initialization")
+        for phase, seconds in startup_timings.items():
+            metrics_registry.set_gauge("startup_seconds", "Duration of each pipeline initialization phase", seconds,
+                                       phase=phase)
+        print("Pipeline initialized successfully!")
         return pipe
-    
-    print("Initializing Flux pipeline...")
-    device = torch.device("cuda") if torch.cuda.is_available() else torch.device("cpu")
-    
-    # Load base model from cache
-    pipe = FluxPipeline.from_pretrained(
-        "black-forest-labs/FLUX.1-dev",
-        cache_dir='/workspace/models',
-        torch_dtype=torch.bfloat16
-    ).to(device)
-    
-    # Load uncensored LoRA (pre-downloaded)
-    print("Loading uncensored LoRA weights...")
-    pipe.load_lora_weights("enhanceaiteam/Flux-uncensored")
-    
-    print("Pipeline initialized successfully!")
-    return pipe
+
+
+def read_job_input(job_input, job_metrics):
+    """
+    Validate the job input and apply defaults, before any other work of the job
+
+    Raises:
+        ValidationError: Listing every invalid field, with nothing loaded or run yet
+    """
+    params = input_validator.validate(job_input)
+    # Fields the installed pipeline cannot honour are dropped (so they stay out of the
+    # result cache and batching keys) and reported back in the result as "ignored"
+    params['ignored'] = []
+    if params['negative_prompt'] and "negative_prompt" not in pipeline_parameters(FluxPipeline):
+        print("Ignoring negative_prompt: the installed FluxPipeline has no true CFG")
+        params['negative_prompt'] = None
+        params['ignored'].append("negative_prompt")
+    # With a negative prompt (true CFG) the transformer runs a conditional and an unconditional
+    # pass per step, whose residuals the single first-block cache state cannot tell apart
+    if params['fast_mode'] and params['negative_prompt']:
+        print("Ignoring fast_mode: first-block caching does not support a negative prompt")
+        params['fast_mode'] = False
+        params['ignored'].append("fast_mode")
+    job_metrics.set("cost_megapixel_steps", round(job_cost(params), 1))
+    if params['items'] is not None:
+        params['items'] = resolve_items(params['items'], params)
+    return params
+
+
+def prepare_pipeline(params, job_metrics):
+    """
+    Log in to Hugging Face if a token is provided and return the initialized pipeline
+
+    The job's latency is predicted once the pipeline is up (its prediction is
+    compared with the measured latency when the job finishes).
+    """
+    if params['hf_token']:
+        print("Logging in to Hugging Face...")
+        with job_metrics.stage("login"):
+            login(token=params['hf_token'], add_to_git_credential=False)
+
+    with job_metrics.stage("init"):
+        flux_pipe = initialize_pipeline()
+
+    prediction = latency_prediction(params)
+    if prediction is not None and prediction["seconds"] is not None:
+        job_metrics.set("predicted_seconds", prediction["seconds"])
+    return flux_pipe
+
+
+def prefetch_custom_lora(params):
+    """Start downloading the job's custom LoRA so it is on disk by the time the GPU thread needs it"""
+    key = (params['custom_lora_repo'], params['custom_lora_weight_name'], params['custom_lora_revision'])
+    if lora_store is not None and key[0] and key not in lora_cache and not (lora_pack and key in lora_pack):
+        lora_store.prefetch(*key)
+
+
+def activate_custom_lora(params, *job_metrics):
+    """Activate the job's custom faces LoRA (loaded once, then switched from the adapter cache)"""
+    custom_lora_repo = params['custom_lora_repo']
+    with timed("lora_load", *job_metrics):
+        lora_state = lora_cache.activate(
+            custom_lora_repo,
+            weight_name=params['custom_lora_weight_name'],
+            revision=params['custom_lora_revision'],
+            scale=params['custom_lora_scale']
+        )
+    if custom_lora_repo:
+        status = "cache hit" if lora_state["hit"] else "loaded"
+        print(f"Custom faces LoRA {custom_lora_repo} {status} in {lora_state['seconds'] * 1000:.1f}ms")
+        for metrics in job_metrics:
+            metrics.set("lora_cache_hit", lora_state["hit"])
+        if not lora_state["hit"] and lora_store is not None:
+            print(f"LoRA store stats: {lora_store.stats()}")
+    return lora_state
+
+
+def lora_key(params):
+    """Adapter cache key of the job's custom faces LoRA, or None"""
+    if not params['custom_lora_repo']:
+        return None
+    return (params['custom_lora_repo'], params['custom_lora_weight_name'], params['custom_lora_revision'])
+
+
+def loaded_loras():
+    """Adapter cache keys of the custom LoRAs loaded in this process"""
+    return lora_cache.keys() if lora_cache is not None else []
+
+
+def lora_state(params):
+    """Custom LoRA state of a job for the latency model: none, warm (in the adapter cache) or cold"""
+    key = lora_key(params)
+    if key is None:
+        return "none"
+    return "warm" if key in lora_cache else "cold"
+
+
+def job_images(params):
+    """Images a job generates (one per item for a batch job)"""
+    return len(params['items']) if params['items'] is not None else params['num_images']
+
+
+def latency_prediction(params):
+    """Predicted latency of a job on this worker (excluding initialization), or None when not learning"""
+    if latency_model is None:
+        return None
+    height, width = generation_size(params)
+    return latency_model.predict(
+        job_shape(height, width, params['num_inference_steps'], job_images(params), lora_state(params))
+    )
+
+
+def learn_latency(params, job_metrics):
+    """Fold a generated job into the latency model and record the error of its prediction"""
+    counters = dict(job_metrics.counters)
+    # Cached and deduplicated jobs never ran the pipeline
+    if latency_model is None or counters.get("result_cache_hit") or counters.get("deduplicated"):
+        return
+    lora = "none"
+    if params['custom_lora_repo']:
+        lora = "warm" if counters.get("lora_cache_hit") else "cold"
+    height, width = generation_size(params)
+    job_metrics.finish()
+    error = latency_model.observe(
+        job_shape(height, width, params['num_inference_steps'], job_images(params), lora),
+        dict(job_metrics.stages),
+        job_metrics.finished - job_metrics.started,
+        predicted=counters.get("predicted_seconds")
+    )
+    if error is not None:
+        job_metrics.set("prediction_error_pct", round(error * 100, 1))
+
+
+def encode_prompts(prompts, *job_metrics):
+    """Look up (or compute) prompt embeddings, one row per image"""
+    with timed("text_encoding", *job_metrics):
+        prompt_embeds, pooled_prompt_embeds = prompt_cache.encode(
+            prompts,
+            extra_identity=lora_cache.text_encoder_identity()
+        )
+    stats = prompt_cache.stats()
+    print(f"Prompt cache hit rate {stats['hit_rate']:.0%}, encoder time saved {stats['seconds_saved']:.2f}s")
+    return prompt_embeds, pooled_prompt_embeds
+
+
+def generation_size(params):
+    """(height, width) the pipeline runs at: the requested size, or its bucket when the transformer is compiled"""
+    if resolution_buckets is None:
+        return params['height'], params['width']
+    return resolution_buckets.snap(params['height'], params['width'])
+
+
+def crop_to_request(images, params):
+    """Crop images generated at a bucket size back to the job's requested size"""
+    if resolution_buckets is None:
+        return images
+    return [center_crop(image, params['height'], params['width']) for image in images]
+
+
+def step_cache_threshold(params):
+    """Step cache threshold of a job, or None when fast_mode is off"""
+    return params['fast_mode_threshold'] if params['fast_mode'] else None
+
+
+def plan_memory(height, width, num_images, *job_metrics):
+    """Pick and apply the memory plan for one pipeline call"""
+    with timed("memory_plan", *job_metrics):
+        plan = memory_planner.choose(
+            height,
+            width,
+            num_images,
+            text_encoder_2_resident=not prompt_cache.offload_t5
+        )
+        memory_planner.apply(plan["plan"])
+    print(f"Memory plan: {plan['plan']} (estimated peak {plan['estimated_peak_gb']}GB, budget {plan['budget_gb']}GB)")
+    if not plan["fits"]:
+        print("Warning: estimated peak exceeds the device memory budget even with sequential offload")
+    return plan
+
+
+@functools.lru_cache(maxsize=None)
+def pipeline_parameters(pipeline_class):
+    """Keyword arguments a pipeline class's __call__ accepts"""
+    return frozenset(inspect.signature(pipeline_class.__call__).parameters)
+
+
+def call_pipeline(job_metrics, step_callback=None, fast_mode_threshold=None, **kwargs):
+    """
+    Run the pipeline, recording denoising and VAE decode time separately
+
+    With a fast_mode_threshold the transformer runs with first-block caching
+    and the skip counters are returned alongside the images. With
+    TENSOR_OUTPUT the images are one uint8 [B, H, W, 3] array, otherwise a
+    list of PIL images.
+    """
+    marks = {}
+    if TENSOR_OUTPUT:
+        kwargs["output_type"] = "pt"
+    # FluxPipeline only takes a negative prompt in diffusers releases with true CFG
+    # (read_job_input has already cleared and reported one it cannot take)
+    if "negative_prompt" not in pipeline_parameters(type(pipe)):
+        kwargs.pop("negative_prompt", None)
+
+    def on_step_end(pipeline, step, timestep, callback_kwargs):
+        if step_callback is not None:
+            callback_kwargs = step_callback(pipeline, step, timestep, callback_kwargs)
+        # Sync once after the last step so queued GPU work is counted as denoising
+        if step == pipeline.num_timesteps - 1:
+            if torch.cuda.is_available():
+                torch.cuda.synchronize()
+            marks['denoised'] = time.perf_counter()
+        return callback_kwargs
+
+    start = time.perf_counter()
+    if fast_mode_threshold is None:
+        output = pipe(callback_on_step_end=on_step_end, **kwargs)
+        fast_mode = None
+    else:
+        with first_block_cache(pipe.transformer, fast_mode_threshold) as cache_state:
+            output = pipe(callback_on_step_end=on_step_end, **kwargs)
+        fast_mode = cache_state.report()
+        print(f"Fast mode skipped {fast_mode['skipped_steps']}/{fast_mode['steps']} steps")
+    # Quantizing and copying the pixels to the host is part of decoding, as in the PIL path
+    images = to_uint8(output.images) if TENSOR_OUTPUT else output.images
+    end = time.perf_counter()
+
+    denoised = marks.get('denoised', end)
+    for metrics in job_metrics:
+        metrics.add("denoise", denoised - start)
+        metrics.add("vae_decode", end - denoised)
+        if fast_mode is not None:
+            metrics.set("skipped_steps", fast_mode["skipped_steps"])
+    return images, fast_mode
+
+
+def make_s3_client(params):
+    """Get a pooled S3 client if credentials and a bucket were provided (and uploads are wanted)"""
+    if params['return_mode'] == 'inline':
+        return None
+    if not (params['aws_access_key_id'] and params['aws_secret_access_key'] and params['s3_bucket']):
+        return None
+
+    return s3_pool.get(
+        params['aws_access_key_id'],
+        params['aws_secret_access_key'],
+        params['aws_region'],
+        endpoint_url=params['s3_endpoint_url']
+    )
+
+
+def encode_and_upload(idx, image, s3_client, params, timestamp, job_metrics):
+    """Encode one image, upload it to S3 if configured and build its data URI unless URLs only"""
+    try:
+        with job_metrics.stage("image_encoding"):
+            encoded = encode_image(
+                image,
+                params['output_format'],
+                quality=params['output_quality'],
+                compress_level=params['png_compress_level']
+            )
+        return publish_image(idx, encoded, s3_client, params, timestamp, job_metrics)
+
+    except Exception as e:
+        raise RuntimeError(f"Failed to process image {idx + 1}: {e}") from e
+
+
+def publish_image(idx, encoded, s3_client, params, timestamp, job_metrics, s3_key=None):
+    """
+    Build the data URI of an encoded image (unless URLs only) and upload it to S3
+
+    If s3_key is given the image is already in the job's bucket under that key
+    (a result cache hit) and is not uploaded again.
+    """
+    try:
+        output_format = params['output_format']
+
+        # Convert image to base64 (skipped when only S3 URLs are returned)
+        image_url = None
+        if params['return_mode'] != 's3_only':
+            with job_metrics.stage("image_encoding"):
+                img_str = base64.b64encode(encoded).decode()
+                image_url = f"data:{content_type(output_format)};base64,{img_str}"
+
+        # Upload to S3 if configured
+        s3_url = None
+        if s3_client:
+            s3_bucket = params['s3_bucket']
+            if s3_key is None:
+                filename = f"{timestamp}_{idx}.{file_extension(output_format)}"
+                s3_key = f"{params['s3_prefix']}/{filename}"
+
+                print(f"Uploading image {idx + 1} to S3...")
+                with job_metrics.stage("upload"):
+                    upload_bytes(s3_client, s3_bucket, s3_key, encoded, content_type(output_format))
+                job_metrics.count("uploaded_bytes", len(encoded))
+
+            s3_url = object_url(s3_bucket, s3_key, params['aws_region'], params['s3_endpoint_url'])
+            print(f"Image uploaded to: {s3_url}")
+        else:
+            s3_key = None
+
+        return {"image_url": image_url, "s3_url": s3_url, "s3_key": s3_key, "encoded": encoded}
+
+    except Exception as e:
+        raise RuntimeError(f"Failed to process image {idx + 1}: {e}") from e
+
+
+def submit_outputs(images, params, job_metrics, start=0):
+    """Queue encoding and upload of every image on the output stage (numbered from start)"""
+    s3_client = make_s3_client(params)
+    timestamp = datetime.now().strftime('%Y-%m-%d_%H-%M-%S')
+    job_metrics.count("images", len(images))
+    return [
+        output_stage.submit(encode_and_upload, idx, image, s3_client, params, timestamp, job_metrics)
+        for idx, image in enumerate(images, start)
+    ]
+
+
+def build_result(outputs, seed, params, extras=None):
+    """Build the job result from the per-image outputs according to return_mode"""
+    image_urls = [output["image_url"] for output in outputs if output["image_url"]]
+    s3_urls = [output["s3_url"] for output in outputs if output["s3_url"]]
+
+    # Prepare response
+    result = {
+        "seed": seed,
+        "num_images": len(outputs)
+    }
+
+    if params['return_mode'] != 's3_only':
+        result["images"] = image_urls
+
+    if s3_urls:
+        result["s3_urls"] = s3_urls
+
+    # Add the first image as legacy 'image_url' field: the S3 URL in URL-only mode,
+    # otherwise a reference to the first data URI (no second encode or copy)
+    if params['return_mode'] == 's3_only':
+        result["image_url"] = s3_urls[0] if s3_urls else None
+    elif image_urls:
+        result["image_url"] = image_urls[0]
+
+    if params.get('ignored'):
+        result["ignored"] = params['ignored']
+
+    # Per-job details such as the memory plan
+    if extras:
+        result.update(extras)
+
+    return result
+
+
+def process_images(images, seed, params, job_metrics, extras=None, key=None):
+    """Encode and upload images in parallel on the output stage and build the job result"""
+    outputs = gather(submit_outputs(images, params, job_metrics))
+    store_result(key, params, outputs, seed)
+    return build_result(outputs, seed, params, extras)
+
+
+def result_cache_key(params):
+    """Result cache key of a job, or None when its output is not reproducible (no seed) or caching is off"""
+    # Batch jobs return per-item results, which the cache does not hold
+    if result_cache is None or params['seed'] is None or params['items'] is not None:
+        return None
+    return result_key({
+        "models": model_identity,
+        "prompt": params['prompt'],
+        "negative_prompt": params['negative_prompt'],
+        "height": params['height'],
+        "width": params['width'],
+        # Compiled mode generates at the bucket size and crops
+        "generation_size": generation_size(params),
+        "num_inference_steps": params['num_inference_steps'],
+        "guidance_scale": params['guidance_scale'],
+        "num_images": params['num_images'],
+        "seed": params['seed'],
+        "fast_mode_threshold": step_cache_threshold(params),
+        # Batching seeds the images of a multi-image job seed, seed + 1, ...
+        "multi_image_seeding": "per_image" if BATCHING_ENABLED else "shared",
+        "custom_lora": [
+            params['custom_lora_repo'],
+            params['custom_lora_weight_name'],
+            params['custom_lora_revision'],
+            params['custom_lora_scale'],
+        ] if params['custom_lora_repo'] else None,
+        "output_format": params['output_format'],
+        "output_quality": params['output_quality'],
+        "png_compress_level": params['png_compress_level'],
+    })
+
+
+def s3_destination(params):
+    """Bucket, key prefix, region and endpoint a job uploads to"""
+    return {
+        "bucket": params['s3_bucket'],
+        "prefix": params['s3_prefix'],
+        "region": params['aws_region'],
+        "endpoint_url": params['s3_endpoint_url'],
+    }
+
+
+def store_result(key, params, outputs, seed):
+    """Keep a finished job's encoded images (and their S3 keys) in the result cache"""
+    if key is None:
+        return
+    s3 = None
+    if all(output["s3_key"] for output in outputs):
+        s3 = {**s3_destination(params), "keys": [output["s3_key"] for output in outputs]}
+    result_cache.put(
+        key,
+        [output["encoded"] for output in outputs],
+        file_extension(params['output_format']),
+        seed,
+        s3=s3
+    )
+
+
+def serve_cached(key, params, job_metrics):
+    """Build the job result from the result cache, or return None on a miss"""
+    if key is None:
+        return None
+    with job_metrics.stage("result_cache"):
+        entry = result_cache.get(key)
+    job_metrics.set("result_cache_hit", entry is not None)
+    if entry is None:
+        return None
+
+    print(f"Result cache hit ({len(entry['images'])} image(s), seed {entry['seed']})")
+    s3_client = make_s3_client(params)
+
+    # Repeats uploading to the same bucket and prefix get the existing objects back
+    uploaded = entry["s3"]
+    if uploaded and any(uploaded.get(field) != value for field, value in s3_destination(params).items()):
+        uploaded = None
+
+    timestamp = datetime.now().strftime('%Y-%m-%d_%H-%M-%S')
+    outputs = gather([
+        output_stage.submit(
+            publish_image, idx, encoded, s3_client, params, timestamp, job_metrics,
+            s3_key=uploaded["keys"][idx] if uploaded else None
+        )
+        for idx, encoded in enumerate(entry["images"])
+    ])
+    if s3_client and not uploaded:
+        result_cache.record_s3(key, {**s3_destination(params), "keys": [output["s3_key"] for output in outputs]})
+
+    return build_result(outputs, entry["seed"], params, {"cached": True})
+
+
+async def generate_once(key, params, job_metrics, generate):
+    """
+    Serve a job from the result cache, or wait for an identical job already in
+    flight, or run generate() (a coroutine function returning the result)
+    """
+    if key is None:
+        return await generate()
+
+    loop = asyncio.get_running_loop()
+    result = await loop.run_in_executor(None, serve_cached, key, params, job_metrics)
+    if result is not None:
+        return result
+
+    future, leader = in_flight.claim(key)
+    if not leader:
+        print("Identical job in flight, waiting for its result")
+        job_metrics.set("deduplicated", True)
+        await asyncio.wrap_future(future)
+        result = await loop.run_in_executor(None, serve_cached, key, params, job_metrics)
+        # The leader failed or its entry was not stored: generate independently
+        return result if result is not None else await generate()
+
+    try:
+        # An identical job may have finished between the lookup and the claim
+        result = await loop.run_in_executor(None, serve_cached, key, params, job_metrics)
+        return result if result is not None else await generate()
+    finally:
+        in_flight.release(key)
+
+
+def record_job(job_metrics, status):
+    """Fold a finished job into the exported metrics"""
+    metrics_registry.observe_job(job_metrics, status)
+    try:
+        metrics_exporter.write()
+    except OSError as e:
+        print(f"Failed to write metrics: {e}")
+
+
+def job_error(e, job_metrics):
+    """Record a failed job and build its error result (with the field errors of invalid input)"""
+    if isinstance(e, ValidationError):
+        print(f"Rejected job input: {e}")
+        record_job(job_metrics, "invalid")
+        return {"error": str(e), "validation_errors": e.errors}
+    print(f"Error during image generation: {str(e)}")
+    import traceback
+    traceback.print_exc()
+    record_job(job_metrics, "error")
+    return {"error": str(e)}
+
+
+def finish_job(result, params, job_metrics):
+    """Record a successful job and attach its metrics to the result if requested"""
+    learn_latency(params, job_metrics)
+    record_job(job_metrics, "success")
+    if params['return_metrics']:
+        result["metrics"] = job_metrics.report()
+    return result
+
+
+def dry_run_result(params, job_metrics):
+    """Predicted latency and memory plan of a job, without activating its LoRA or generating"""
+    height, width = generation_size(params)
+    images = job_images(params)
+    if params['items'] is not None:
+        # Batch jobs run in chunks; the plan is the one of the largest chunk
+        images = min(images, memory_planner.max_images(
+            height,
+            width,
+            ITEMS_MAX_CHUNK,
+            text_encoder_2_resident=not prompt_cache.offload_t5
+        ))
+    result = {
+        "dry_run": True,
+        "prediction": latency_prediction(params),
+        "memory_plan": memory_planner.choose(
+            height,
+            width,
+            images,
+            text_encoder_2_resident=not prompt_cache.offload_t5
+        ),
+        "cost_megapixel_steps": job_metrics.counters["cost_megapixel_steps"],
+        "latency_model": latency_model.stats() if latency_model is not None else None,
+    }
+    record_job(job_metrics, "dry_run")
+    if params['return_metrics']:
+        result["metrics"] = job_metrics.report()
+    return result
+
+
+async def await_outputs(futures):
+    """Wait for output stage futures without blocking the event loop"""
+    return await asyncio.gather(*(asyncio.wrap_future(future) for future in futures))
+
+
+def run_generation(params, job_metrics, step_callback=None):
+    """Activate the job's LoRA and run the pipeline, returning (images, seed, extras)"""
+    seed = params['seed']
+
+    activate_custom_lora(params, job_metrics)
+
+    # Set seed for reproducibility (drawn at random when missing, so the returned seed reproduces the image)
+    if seed is None:
+        seed = torch.randint(0, 2**32, (1,)).item()
+    generator = torch.Generator(device=pipe._execution_device).manual_seed(seed)
+
+    # Clear CUDA cache
+    if torch.cuda.is_available():
+        torch.cuda.empty_cache()
+
+    height, width = generation_size(params)
+
+    # Slice, tile or offload only if the job would not fit on the device otherwise
+    memory_plan = plan_memory(height, width, params['num_images'], job_metrics)
+
+    print(f"Generating {params['num_images']} image(s) with prompt: '{params['prompt']}'")
+
+    # Encode the prompt once per image (served from the prompt cache on repeats)
+    prompt_embeds, pooled_prompt_embeds = encode_prompts([params['prompt']] * params['num_images'], job_metrics)
+
+    # Generate images
+    images, fast_mode = call_pipeline(
+        [job_metrics],
+        step_callback=step_callback,
+        fast_mode_threshold=step_cache_threshold(params),
+        prompt_embeds=prompt_embeds,
+        pooled_prompt_embeds=pooled_prompt_embeds,
+        negative_prompt=params['negative_prompt'],
+        height=height,
+        width=width,
+        num_inference_steps=params['num_inference_steps'],
+        guidance_scale=params['guidance_scale'],
+        num_images_per_prompt=1,
+        generator=generator
+    )
+
+    extras = {"memory_plan": memory_plan}
+    if fast_mode is not None:
+        extras["fast_mode"] = fast_mode
+    if resolution_buckets is not None:
+        resolution_buckets.record((height, width))
+        extras["compile_bucket"] = {"height": height, "width": width}
+    return crop_to_request(images, params), seed, extras
+
+
+def generate_and_submit(params, job_metrics):
+    """Run generation on the GPU thread and hand the images to the output stage"""
+    images, seed, extras = run_generation(params, job_metrics)
+    return submit_outputs(images, params, job_metrics), seed, extras
+
+
+def generate_with_progress(params, job_metrics, reporter):
+    """Run generation on the GPU thread, reporting every step to the streaming handler"""
+    try:
+        return run_generation(params, job_metrics, step_callback=reporter)
+    finally:
+        reporter.finish()
+
+
+def run_chunk(params, indices, prompt_embeds, pooled_prompt_embeds, job_metrics, on_item):
+    """Generate one chunk of batch items in a single pipeline call and hand each image to the output stage"""
+    items = params['items']
+    seeds = []
+    generators = []
+    for index in indices:
+        seed = items[index]['seed']
+        if seed is None:
+            seed = torch.randint(0, 2**32, (1,)).item()
+        seeds.append(seed)
+        generators.append(torch.Generator(device=pipe._execution_device).manual_seed(seed))
+
+    height, width = generation_size(params)
+    memory_plan = plan_memory(height, width, len(indices), job_metrics)
+
+    images, fast_mode = call_pipeline(
+        [job_metrics],
+        fast_mode_threshold=step_cache_threshold(params),
+        prompt_embeds=prompt_embeds,
+        pooled_prompt_embeds=pooled_prompt_embeds,
+        negative_prompt=params['negative_prompt'],
+        height=height,
+        width=width,
+        num_inference_steps=params['num_inference_steps'],
+        guidance_scale=params['guidance_scale'],
+        num_images_per_prompt=1,
+        generator=generators
+    )
+
+    extras = {}
+    if fast_mode is not None:
+        extras["fast_mode"] = fast_mode
+    if resolution_buckets is not None:
+        resolution_buckets.record((height, width))
+        extras["compile_bucket"] = {"height": height, "width": width}
+
+    # Item index doubles as the image number, so S3 keys stay unique across chunks
+    for index, image, seed in zip(indices, crop_to_request(images, params), seeds):
+        on_item((index, submit_outputs([image], params, job_metrics, start=index), seed, extras, None))
+    return memory_plan
+
+
+def run_items(params, job_metrics, on_item):
+    """
+    Generate every item of a batch job on the GPU thread, chunk by chunk
+
+    on_item receives (index, output futures, seed, extras, error) for each item as
+    soon as its image is queued on the output stage, or with the error if it failed.
+
+    Returns:
+        dict: Job-level extras (chunking and the largest chunk's memory plan)
+    """
+    items = params['items']
+    height, width = generation_size(params)
+    chunk_size = memory_planner.max_images(
+        height,
+        width,
+        ITEMS_MAX_CHUNK,
+        text_encoder_2_resident=not prompt_cache.offload_t5
+    )
+    groups = plan_chunks(items, chunk_size)
+    chunks = sum(len(group_chunks) for _, group_chunks in groups)
+    print(f"Generating {len(items)} item(s) in {chunks} chunk(s) of up to {chunk_size} image(s)")
+
+    if torch.cuda.is_available():
+        torch.cuda.empty_cache()
+
+    memory_plan = None
+    for scale, group_chunks in groups:
+        group_params = {**params, 'custom_lora_scale': scale}
+        activate_custom_lora(group_params, job_metrics)
+
+        # One encoder call per LoRA scale (the scale can change text encoder LoRA outputs)
+        indices = [index for chunk in group_chunks for index in chunk]
+        prompt_embeds, pooled_prompt_embeds = encode_prompts([items[index]['prompt'] for index in indices], job_metrics)
+
+        row = 0
+        for chunk in group_chunks:
+            rows = slice(row, row + len(chunk))
+            row += len(chunk)
+            try:
+                plan = run_chunk(group_params, chunk, prompt_embeds[rows], pooled_prompt_embeds[rows],
+                                 job_metrics, on_item)
+                memory_plan = memory_plan or plan
+                continue
+            except Exception as e:
+                if len(chunk) == 1:
+                    on_item((chunk[0], None, None, None, e))
+                    continue
+                print(f"Chunk of {len(chunk)} item(s) failed ({e}), retrying them one at a time")
+            if torch.cuda.is_available():
+                torch.cuda.empty_cache()
+
+            for offset, index in enumerate(chunk, rows.start):
+                try:
+                    run_chunk(group_params, [index], prompt_embeds[offset:offset + 1],
+                              pooled_prompt_embeds[offset:offset + 1], job_metrics, on_item)
+                except Exception as e:
+                    on_item((index, None, None, None, e))
+
+    return {"memory_plan": memory_plan, "chunk_size": chunk_size, "chunks": chunks}
+
+
+def finish_item(pending, params):
+    """Wait for one batch item's outputs and build its result entry (or its error)"""
+    index, futures, seed, extras, error = pending
+    if error is None:
+        try:
+            outputs = gather(futures)
+        except Exception as e:
+            error = e
+    if error is not None:
+        print(f"Item {index + 1} failed: {error}")
+        return {"index": index, "error": str(error)}
+    return {"index": index, **build_result(outputs, seed, params, extras)}
+
+
+def items_result(entries, extras, job_metrics):
+    """Job result of a batch job from its per-item entries"""
+    result = summarize_items(entries)
+    job_metrics.set("failed_items", result["failed_items"])
+    result.update(extras)
+    return result
+
+
+def finish_items(done, extras, params, job_metrics):
+    """Gather every item of a batch job into the job result"""
+    return items_result([finish_item(pending, params) for pending in done], extras, job_metrics)
+
+
+def generate_items_streamed(params, job_metrics, events):
+    """Run a batch job on the GPU thread, putting every item on the event queue as it is ready"""
+    try:
+        return run_items(params, job_metrics, events.put)
+    finally:
+        events.put(None)
 
 
 def generate_image(job):
     """
     Main handler function for RunPod worker
     """
+    job_metrics = JobMetrics()
     try:
-        job_input = job['input']
-        
-        # Extract AWS credentials
-        aws_access_key_id = job_input.get('aws_access_key_id')
-        aws_secret_access_key = job_input.get('aws_secret_access_key')
-        aws_region = job_input.get('aws_region', 'ap-south-1')
-        s3_bucket = job_input.get('s3_bucket')
-        s3_prefix = job_input.get('s3_prefix', 'runpods_custom_faces')
-        
-        # Extract Hugging Face credentials
-        hf_token = job_input.get('hf_token')
-        
-        # Extract custom faces LoRA details
-        custom_lora_repo = job_input.get('custom_lora_repo')
-        custom_lora_weight_name = job_input.get('custom_lora_weight_name', 'lora.safetensors')
-        
-        # Extract image generation parameters
-        prompt = job_input['prompt']
-        negative_prompt = job_input.get('negative_prompt', None)
-        height = job_input.get('height', 1024)
-        width = job_input.get('width', 1024)
-        num_inference_steps = job_input.get('num_inference_steps', 28)
-        guidance_scale = job_input.get('guidance_scale', 3.5)
-        num_images = job_input.get('num_images', 1)
-        seed = job_input.get('seed', None)
-        
-        # Login to Hugging Face if token provided
-        if hf_token:
-            print("Logging in to Hugging Face...")
-            login(token=hf_token, add_to_git_credential=False)
-        
+        params = read_job_input(job['input'], job_metrics)
+
         # Initialize pipeline
         global pipe
-        pipe = initialize_pipeline()
-        
-        # Load custom faces LoRA if provided
-        if custom_lora_repo:
-            print(f"Loading custom faces LoRA from {custom_lora_repo}...")
-            pipe.load_lora_weights(custom_lora_repo, weight_name=custom_lora_weight_name)
-        
-        # Set seed for reproducibility
-        if seed is not None:
-            generator = torch.Generator(device=pipe.device).manual_seed(seed)
-        else:
-            generator = None
+        pipe = prepare_pipeline(params, job_metrics)
+        if params['dry_run']:
+            return dry_run_result(params, job_metrics)
+
+        key = result_cache_key(params)
+        result = serve_cached(key, params, job_metrics)
+        if result is None and params['items'] is not None:
+            done = []
+            extras = run_items(params, job_metrics, done.append)
+            result = finish_items(done, extras, params, job_metrics)
+        elif result is None:
+            images, seed, extras = run_generation(params, job_metrics)
+            result = process_images(images, seed, params, job_metrics, extras, key=key)
+        finish_job(result, params, job_metrics)
+
+        print("Image generation completed successfully!")
+        return result
+
+    except Exception as e:
+        return job_error(e, job_metrics)
+
+
+def batch_key(params):
+    """Parameters that must match for jobs to share one pipeline call"""
+    # Jobs of different sizes in one compile bucket share a call and are cropped apart
+    return (
+        *generation_size(params),
+        params['num_inference_steps'],
+        params['guidance_scale'],
+        params['negative_prompt'],
+        params['custom_lora_repo'],
+        params['custom_lora_weight_name'],
+        params['custom_lora_revision'],
+        params['custom_lora_scale'],
+        step_cache_threshold(params),
+    )
+
+
+def run_batch(batch):
+    """
+    Run one pipeline call for a group of compatible jobs
+
+    Every job gets its own prompt and its own seeded generator per image, so a
+    single-image job renders the same image batched or not. Images of a
+    multi-image job use seeds seed, seed + 1, ...
+
+    Each request is a (params, job_metrics) pair; the shared stages are
+    recorded on every job of the batch.
+    """
+    params = batch[0][0]
+    job_metrics = [metrics for _, metrics in batch]
+    activate_custom_lora(params, *job_metrics)
+
+    prompts = []
+    generators = []
+    seeds = []
+    for item, _ in batch:
+        seed = item['seed']
+        if seed is None:
             seed = torch.randint(0, 2**32, (1,)).item()
-        
-        # Clear CUDA cache
-        if torch.cuda.is_available():
-            torch.cuda.empty_cache()
-        
-        print(f"Generating {num_images} image(s) with prompt: '{prompt}'")
-        
-        # Generate images
-        output = pipe(
-            prompt=prompt,
-            negative_prompt=negative_prompt,
-            height=height,
-            width=width,
-            num_inference_steps=num_inference_steps,
-            guidance_scale=guidance_scale,
-            num_images_per_prompt=num_images,
-            generator=generator
-        )
-        
-        images = output.images
-        image_urls = []
-        s3_urls = []
-        
-        # Initialize S3 client if credentials provided
-        s3_client = None
-        if aws_access_key_id and aws_secret_access_key and s3_bucket:
-            print("Initializing S3 client...")
-            s3_client = boto3.client(
-                's3',
-                aws_access_key_id=aws_access_key_id,
-                aws_secret_access_key=aws_secret_access_key,
-                region_name=aws_region
-            )
-        
-        # Process each generated image
-        for idx, image in enumerate(images):
-            # Convert image to base64
-            buffered = io.BytesIO()
-            image.save(buffered, format="PNG")
-            img_str = base64.b64encode(buffered.getvalue()).decode()
-            image_url = f"data:image/png;base64,{img_str}"
-            image_urls.append(image_url)
-            
-            # Upload to S3 if configured
-            if s3_client:
-                timestamp = datetime.now().strftime('%Y-%m-%d_%H-%M-%S')
-                filename = f"{timestamp}_{idx}.png"
-                s3_key = f"{s3_prefix}/{filename}"
-                
-                print(f"Uploading image {idx + 1} to S3...")
-                buffered.seek(0)
-                s3_client.put_object(
-                    Bucket=s3_bucket,
-                    Key=s3_key,
-                    Body=buffered.getvalue(),
-                    ContentType='image/png'
-                )
-                
-                s3_url = f"https://{s3_bucket}.s3.{aws_region}.amazonaws.com/{s3_key}"
-                s3_urls.append(s3_url)
-                print(f"Image uploaded to: {s3_url}")
-        
-        # Prepare response
-        result = {
-            "images": image_urls,
-            "seed": seed,
-            "num_images": len(images)
-        }
-        
-        if s3_urls:
-            result["s3_urls"] = s3_urls
-        
-        # Add the first image as legacy 'image_url' field
-        if image_urls:
-            result["image_url"] = image_urls[0]
-        
+        seeds.append(seed)
+        for offset in range(item['num_images']):
+            prompts.append(item['prompt'])
+            generators.append(torch.Generator(device=pipe._execution_device).manual_seed(seed + offset))
+
+    height, width = generation_size(params)
+    memory_plan = plan_memory(height, width, len(prompts), *job_metrics)
+    for metrics in job_metrics:
+        metrics.set("batched_jobs", len(batch))
+
+    print(f"Generating {len(prompts)} image(s) for {len(batch)} batched job(s)")
+    prompt_embeds, pooled_prompt_embeds = encode_prompts(prompts, *job_metrics)
+
+    images, fast_mode = call_pipeline(
+        job_metrics,
+        fast_mode_threshold=step_cache_threshold(params),
+        prompt_embeds=prompt_embeds,
+        pooled_prompt_embeds=pooled_prompt_embeds,
+        negative_prompt=params['negative_prompt'],
+        height=height,
+        width=width,
+        num_inference_steps=params['num_inference_steps'],
+        guidance_scale=params['guidance_scale'],
+        num_images_per_prompt=1,
+        generator=generators
+    )
+
+    extras = {"memory_plan": memory_plan}
+    if fast_mode is not None:
+        extras["fast_mode"] = fast_mode
+    if resolution_buckets is not None:
+        resolution_buckets.record((height, width))
+        extras["compile_bucket"] = {"height": height, "width": width}
+
+    # Fan the images back out to their jobs and queue their outputs
+    results = []
+    offset = 0
+    for (item, metrics), seed in zip(batch, seeds):
+        item_images = crop_to_request(images[offset:offset + item['num_images']], item)
+        results.append((submit_outputs(item_images, item, metrics), seed, extras))
+        offset += item['num_images']
+    return results
+
+
+async def generate_image_batched(job):
+    """
+    Handler for batching mode: merges compatible concurrent jobs into one pipeline call
+    """
+    job_metrics = JobMetrics()
+    try:
+        params = read_job_input(job['input'], job_metrics)
+        loop = asyncio.get_running_loop()
+
+        global pipe
+        pipe = await loop.run_in_executor(None, prepare_pipeline, params, job_metrics)
+        if params['dry_run']:
+            return dry_run_result(params, job_metrics)
+
+        key = result_cache_key(params)
+
+        async def generate():
+            # Download while earlier jobs are still on the GPU
+            prefetch_custom_lora(params)
+            if params['items'] is not None:
+                # A batch job is already a batch: it runs on its own between merged batches
+                done = []
+                extras = await batcher.run_alone(run_items, params, job_metrics, done.append,
+                                                 num_images=len(params['items']))
+                return await loop.run_in_executor(None, finish_items, done, extras, params, job_metrics)
+            futures, seed, extras = await batcher.submit(batch_key(params), (params, job_metrics), params['num_images'])
+            outputs = await await_outputs(futures)
+            # Sharing a call with other jobs changes the memory plan and fast_mode's skipped steps,
+            # so only jobs that ran on their own are cached
+            if job_metrics.counters.get("batched_jobs") == 1:
+                await loop.run_in_executor(None, store_result, key, params, outputs, seed)
+            return build_result(outputs, seed, params, extras)
+
+        result = await generate_once(key, params, job_metrics, generate)
+        finish_job(result, params, job_metrics)
+
+        print(f"Image generation completed successfully! Batching stats: {batcher.stats()}")
+        return result
+
+    except Exception as e:
+        return job_error(e, job_metrics)
+
+
+async def generate_image_pipelined(job):
+    """
+    Handler for pipelined output mode: the next job denoises while this one encodes and uploads
+    """
+    job_metrics = JobMetrics()
+    try:
+        params = read_job_input(job['input'], job_metrics)
+        loop = asyncio.get_running_loop()
+
+        global pipe
+        pipe = await loop.run_in_executor(None, prepare_pipeline, params, job_metrics)
+        if params['dry_run']:
+            return dry_run_result(params, job_metrics)
+
+        key = result_cache_key(params)
+
+        async def generate():
+            # Download while earlier jobs are still on the GPU
+            prefetch_custom_lora(params)
+            if params['items'] is not None:
+                done = []
+                extras = await loop.run_in_executor(gpu_executor, run_items, params, job_metrics, done.append)
+                return await loop.run_in_executor(None, finish_items, done, extras, params, job_metrics)
+            futures, seed, extras = await loop.run_in_executor(gpu_executor, generate_and_submit, params, job_metrics)
+            outputs = await await_outputs(futures)
+            await loop.run_in_executor(None, store_result, key, params, outputs, seed)
+            return build_result(outputs, seed, params, extras)
+
+        result = await generate_once(key, params, job_metrics, generate)
+        finish_job(result, params, job_metrics)
+
         print("Image generation completed successfully!")
         return result
-        
+
     except Exception as e:
-        print(f"Error during image generation: {str(e)}")
-        import traceback
-        traceback.print_exc()
-        return {"error": str(e)}
+        return job_error(e, job_metrics)
+
+
+def generate_image_stream(job):
+    """
+    Handler for streaming mode: yields step progress and latent previews, then the result
+    """
+    job_metrics = JobMetrics()
+    try:
+        params = read_job_input(job['input'], job_metrics)
+
+        global pipe
+        pipe = prepare_pipeline(params, job_metrics)
+        if params['dry_run']:
+            yield dry_run_result(params, job_metrics)
+            return
+
+        # Repeats of a seeded job are served from the result cache without progress events
+        key = result_cache_key(params)
+        result = serve_cached(key, params, job_metrics)
+        if result is not None:
+            finish_job(result, params, job_metrics)
+            yield result
+            return
+
+        prefetch_custom_lora(params)
+
+        if params['items'] is not None:
+            # One event per finished item; the final result lists the items without their images
+            events = queue.Queue()
+            generation = gpu_executor.submit(generate_items_streamed, params, job_metrics, events)
+            entries = []
+            for pending in iter(events.get, None):
+                entries.append(finish_item(pending, params))
+                yield {"status": "item", **entries[-1]}
+            result = items_result(entries, generation.result(), job_metrics)
+            result["items"] = [
+                {field: value for field, value in entry.items() if field not in ("images", "image_url")}
+                for entry in result["items"]
+            ]
+            finish_job(result, params, job_metrics)
+            yield result
+            return
+
+        # ETAs start from the predicted step and finishing times, then follow the measured steps
+        prediction = latency_prediction(params)
+        stages = prediction["stages"] if prediction is not None else {}
+        reporter = ProgressReporter(
+            latent_previewer,
+            *generation_size(params),
+            every=params['preview_every'],
+            expected_step_seconds=stages["denoise"] / params['num_inference_steps'] if "denoise" in stages else None,
+            finish_seconds=sum(stages.get(stage, 0.0) for stage in ("vae_decode", "image_encoding", "upload"))
+        )
+        if prediction is not None and prediction["seconds"] is not None:
+            yield {
+                "status": "progress",
+                "step": 0,
+                "total_steps": params['num_inference_steps'],
+                "elapsed": 0.0,
+                "eta_seconds": prediction["seconds"],
+            }
+        generation = gpu_executor.submit(generate_with_progress, params, job_metrics, reporter)
+
+        # Thumbnails are encoded here, off the GPU thread
+        for event in iter(reporter.events.get, None):
+            if "preview" in event:
+                start = time.perf_counter()
+                event["preview"] = encode_preview(event["preview"])
+                event["preview_encode_ms"] = round((time.perf_counter() - start) * 1000, 2)
+            yield {"status": "progress", **event}
+
+        images, seed, extras = generation.result()
+        result = process_images(images, seed, params, job_metrics, extras, key=key)
+        result["streaming"] = reporter.stats()
+        finish_job(result, params, job_metrics)
+
+        print(f"Image generation completed successfully! Preview stats: {result['streaming']}")
+        yield result
+
+    except Exception as e:
+        yield job_error(e, job_metrics)
+
+
+async def generate_image_replicated(job):
+    """
+    Handler for multi-replica mode: validate here, then run on the replica picked by LoRA affinity
+    """
+    job_metrics = JobMetrics()
+    try:
+        params = read_job_input(job['input'], job_metrics)
+        return await asyncio.wrap_future(replica_pool.submit(job, key=lora_key(params)))
+
+    except Exception as e:
+        return job_error(e, job_metrics)
+
 
+if __name__ == "__main__":
+    metrics_exporter.start()
 
-print("Starting RunPod Serverless Worker...")
-runpod.serverless.start({"handler": generate_image})
+    if EAGER_INIT and not REPLICA_DEVICES:
+        # Load the model before accepting jobs so the first job doesn't pay the cold start
+        initialize_pipeline()
 
+    print("Starting RunPod Serverless Worker...")
+    if REPLICA_DEVICES:
+        # Every replica loads its own pipeline; this process only validates and dispatches
+        replica_pool = ReplicaPool(
+            replica_devices(),
+            setup=initialize_pipeline,
+            handle=generate_image,
+            loaded=loaded_loras,
+            registry=metrics_registry
+        ).start()
+        print(f"Multi-replica mode enabled ({len(replica_pool.replicas)} replicas, "
+              f"concurrency {replica_pool.concurrency})")
+        runpod.serverless.start({
+            "handler": generate_image_replicated,
+            "concurrency_modifier": lambda current_concurrency: replica_pool.concurrency
+        })
+    elif STREAMING_ENABLED:
+        print("Streaming mode enabled (progress and latent previews)")
+        gpu_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="gpu")
+        runpod.serverless.start({
+            "handler": generate_image_stream,
+            "return_aggregate_stream": True
+        })
+    elif BATCHING_ENABLED:
+        print(f"Batching mode enabled (concurrency {BATCH_CONCURRENCY})")
+        batcher = MicroBatcher(run_batch)
+        runpod.serverless.start({
+            "handler": generate_image_batched,
+            "concurrency_modifier": lambda current_concurrency: BATCH_CONCURRENCY
+        })
+    elif PIPELINED_OUTPUT:
+        print(f"Pipelined output mode enabled (concurrency {PIPELINE_CONCURRENCY})")
+        gpu_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="gpu")
+        runpod.serverless.start({
+            "handler": generate_image_pipelined,
+            "concurrency_modifier": lambda current_concurrency: PIPELINE_CONCURRENCY
+        })
+    else:
+        runpod.serverless.start({"handler": generate_image})
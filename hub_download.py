@@ -0,0 +1,268 @@
+"""
+Parallel, resumable, checksum-verified downloads of hub files
+
+Used by the LoRA store for custom LoRAs and by download_weights.py for the
+base model. A file is fetched with parallel HTTP Range requests written in
+place into a partial file; finished chunks are recorded next to it, so an
+interrupted download resumes where it stopped. Every file is checked against
+the hub's content hash (the LFS sha256, or the git blob sha1 of small files)
+before it replaces the destination.
+"""
+
+import fnmatch
+import hashlib
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from urllib.parse import urlparse
+
+import requests
+from requests.adapters import HTTPAdapter
+from huggingface_hub import HfApi, get_hf_file_metadata, hf_hub_url
+from huggingface_hub.utils import build_hf_headers
+
+
+BLOCK_SIZE = 1024 * 1024
+
+
+def file_matches_etag(path, etag):
+    """
+    Check a file against a hub ETag
+
+    Returns:
+        bool or None: Whether the content hash matches, or None if the ETag is not a content hash
+    """
+    if len(etag) == 64:
+        digest = hashlib.sha256()
+    elif len(etag) == 40:
+        # Regular (non-LFS) files are tagged with their git blob id
+        digest = hashlib.sha1(f"blob {os.path.getsize(path)}\0".encode())
+    else:
+        return None
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(8 * BLOCK_SIZE), b""):
+            digest.update(block)
+    return digest.hexdigest() == etag
+
+
+def file_metadata(repo, filename, revision=None, endpoint=None):
+    """
+    Content hash, size, commit and download URL of a hub file
+
+    Returns:
+        dict: etag, size, commit, url and whether the URL takes hub credentials
+    """
+    url = hf_hub_url(repo, filename, revision=revision, endpoint=endpoint)
+    metadata = get_hf_file_metadata(url)
+    if not metadata.etag or metadata.size is None:
+        raise ValueError(f"The hub returned no ETag or size for {repo}/{filename}")
+    return {
+        "etag": metadata.etag,
+        "size": metadata.size,
+        "commit": metadata.commit_hash,
+        "url": metadata.location,
+        # Credentials only go to the hub itself, not to the CDN it redirects to
+        "authenticated": urlparse(metadata.location).netloc == urlparse(url).netloc,
+    }
+
+
+class RangeDownloader:
+    """Downloads single files with parallel Range requests over a shared connection pool"""
+
+    def __init__(self, streams=4, chunk_bytes=16 * 1024 * 1024, timeout=60.0, thread_name_prefix="download"):
+        """
+        Initialize the downloader
+
+        Args:
+            streams: Parallel Range requests across all downloads
+            chunk_bytes: Bytes per Range request
+            timeout: Connect/read timeout of each request in seconds
+            thread_name_prefix: Name prefix of the request threads
+        """
+        self.chunk_bytes = chunk_bytes
+        self.timeout = timeout
+        self.lock = threading.Lock()
+        self._session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=streams)
+        self._session.mount("http://", adapter)
+        self._session.mount("https://", adapter)
+        self._pool = ThreadPoolExecutor(max_workers=streams, thread_name_prefix=thread_name_prefix)
+        self.resumed = 0
+        self.bytes_downloaded = 0
+
+    def download(self, url, path, size, etag, authenticated=False):
+        """Download url to path, resuming a previous partial download, and verify it against etag"""
+        part_path = f"{path}.part"
+        progress_path = f"{part_path}.json"
+        label = os.path.basename(path)
+        headers = build_hf_headers() if authenticated else {}
+
+        done = set()
+        try:
+            with open(progress_path) as f:
+                progress = json.load(f)
+            if progress["etag"] == etag and progress["chunk_bytes"] == self.chunk_bytes:
+                done = set(progress["done"])
+        except (OSError, ValueError, KeyError):
+            pass
+        if done and os.path.exists(part_path):
+            with self.lock:
+                self.resumed += 1
+            print(f"Resuming download of {label} ({len(done)} chunks already on disk)")
+        else:
+            done = set()
+            with open(part_path, "wb") as f:
+                f.truncate(size)
+
+        chunks = [(offset, min(offset + self.chunk_bytes, size) - 1) for offset in range(0, size, self.chunk_bytes)]
+        errors = []
+        fd = os.open(part_path, os.O_WRONLY)
+        try:
+            futures = {
+                self._pool.submit(self._get_range, url, headers, fd, first, last): first
+                for first, last in chunks if first not in done
+            }
+            for future in as_completed(futures):
+                try:
+                    future.result()
+                except Exception as e:
+                    errors.append(e)
+                    continue
+                done.add(futures[future])
+                with open(progress_path, "w") as f:
+                    json.dump({"etag": etag, "chunk_bytes": self.chunk_bytes, "done": sorted(done)}, f)
+        finally:
+            os.close(fd)
+        if errors:
+            raise IOError(
+                f"Download of {label} failed with {len(done)}/{len(chunks)} chunks kept for resuming: {errors[0]}"
+            ) from errors[0]
+
+        matches = file_matches_etag(part_path, etag)
+        if matches is False:
+            os.remove(part_path)
+            os.remove(progress_path)
+            raise ValueError(f"Checksum mismatch for {label}, discarded the download")
+        if matches is None:
+            print(f"ETag of {label} is not a content hash, stored without verification")
+        os.replace(part_path, path)
+        if os.path.exists(progress_path):
+            os.remove(progress_path)
+
+    def _get_range(self, url, headers, fd, first, last):
+        """Write bytes first..last of url at the same offsets of fd"""
+        offset = first
+        with self._session.get(url, headers={**headers, "Range": f"bytes={first}-{last}"}, stream=True,
+                               timeout=self.timeout) as response:
+            response.raise_for_status()
+            if response.status_code != 206:
+                raise IOError(f"Server ignored the Range request (HTTP {response.status_code})")
+            for block in response.iter_content(BLOCK_SIZE):
+                os.pwrite(fd, block, offset)
+                offset += len(block)
+        if offset != last + 1:
+            raise IOError(f"Short read: got {offset - first} of {last + 1 - first} bytes")
+        with self.lock:
+            self.bytes_downloaded += offset - first
+
+    def shutdown(self):
+        self._pool.shutdown(wait=True)
+
+
+def download_snapshot(repo, local_dir, allow_patterns=None, select=None, revision=None, endpoint=None,
+                      downloader=None, max_files=4, manifest_name="weights.json", extra=None):
+    """
+    Download the matching files of a hub repository into a plain directory and write its manifest
+
+    Files already in local_dir with the size and ETag recorded in a previous
+    manifest (or, after an interrupted run, a matching content hash) are not
+    downloaded again, so a rerun only fetches what is missing or changed.
+
+    Args:
+        repo: Repository ID
+        local_dir: Destination directory (same layout as the repository)
+        allow_patterns: fnmatch patterns of the files to fetch (None = all)
+        select: Optional callable filtering the matching file names further
+        revision: Branch, tag or commit (resolved to a commit once, so every file is from the same one)
+        endpoint: Hub endpoint (defaults to HF_ENDPOINT / huggingface.co)
+        downloader: RangeDownloader to use (a default one otherwise)
+        max_files: Files resolved and downloaded concurrently
+        manifest_name: Manifest file written into local_dir
+        extra: Additional manifest fields
+
+    Returns:
+        dict: The manifest (repository, commit, and size and ETag of every file)
+    """
+    start = time.perf_counter()
+    info = HfApi(endpoint=endpoint).model_info(repo, revision=revision)
+    commit = info.sha
+    files = sorted(
+        sibling.rfilename for sibling in info.siblings
+        if allow_patterns is None or any(fnmatch.fnmatch(sibling.rfilename, pattern) for pattern in allow_patterns)
+    )
+    if select is not None:
+        files = [name for name in files if select(name)]
+    if not files:
+        raise ValueError(f"No files of {repo} match {allow_patterns}")
+
+    manifest_path = os.path.join(local_dir, manifest_name)
+    previous = {}
+    try:
+        with open(manifest_path) as f:
+            previous = json.load(f).get("files", {})
+    except (OSError, ValueError):
+        pass
+
+    own_downloader = downloader is None
+    downloader = downloader or RangeDownloader()
+    bytes_before = downloader.bytes_downloaded
+
+    def fetch(name):
+        entry = file_metadata(repo, name, revision=commit, endpoint=endpoint)
+        path = os.path.join(local_dir, name)
+        if os.path.isfile(path) and os.path.getsize(path) == entry["size"]:
+            known = previous.get(name)
+            # Files finished by an interrupted run have no manifest entry yet: hashing beats downloading
+            if (known and known["etag"] == entry["etag"]) or file_matches_etag(path, entry["etag"]):
+                return entry, False
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        downloader.download(entry["url"], path, entry["size"], entry["etag"], authenticated=entry["authenticated"])
+        print(f"  {name} ({entry['size'] / 1024 / 1024:.1f}MB)")
+        return entry, True
+
+    try:
+        # Every file is attempted even if one fails, so a rerun has as little left as possible
+        with ThreadPoolExecutor(max_workers=max_files, thread_name_prefix="snapshot") as pool:
+            futures = {name: pool.submit(fetch, name) for name in files}
+    finally:
+        if own_downloader:
+            downloader.shutdown()
+    results = {}
+    errors = []
+    for name, future in futures.items():
+        try:
+            results[name] = future.result()
+        except Exception as e:
+            errors.append((name, e))
+    if errors:
+        name, error = errors[0]
+        raise IOError(f"{len(errors)} of {len(files)} files of {repo} failed, rerun to resume ({name}: {error})") from error
+
+    manifest = {
+        "repo": repo,
+        "revision": revision,
+        "commit": commit,
+        **(extra or {}),
+        "files": {name: {"size": entry["size"], "etag": entry["etag"]} for name, (entry, _) in results.items()},
+    }
+    os.makedirs(local_dir, exist_ok=True)
+    with open(manifest_path, "w") as f:
+        json.dump(manifest, f, indent=2)
+
+    fetched = sum(1 for _, downloaded in results.values() if downloaded)
+    total = sum(entry["size"] for entry, _ in results.values())
+    print(f"{repo}@{commit[:10]}: {len(files)} files ({total / 1024 ** 3:.2f}GB), {fetched} downloaded "
+          f"({(downloader.bytes_downloaded - bytes_before) / 1024 ** 3:.2f}GB) in {time.perf_counter() - start:.1f}s")
+    return manifest
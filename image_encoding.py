@@ -0,0 +1,81 @@
+"""
+Output image formats supported by the worker
+
+With TENSOR_OUTPUT the pipeline returns its decoded images as one tensor, and
+to_uint8 scales, rounds and reorders the whole batch in a few device ops. Only
+the uint8 pixels reach the host, as one contiguous [B, H, W, 3] array. The
+output stage then encodes each image straight from its frame of that array,
+in parallel. The previous path converted the batch to float32 on the host,
+quantized it with numpy and built a PIL image per frame before encoding.
+"""
+
+import io
+import os
+
+import numpy as np
+import torch
+from PIL import Image
+
+
+# Quantize decoded images as one batch and encode from uint8 frames instead of PIL images
+TENSOR_OUTPUT = os.environ.get("TENSOR_OUTPUT", "1") == "1"
+
+# output_format -> (PIL format, content type, file extension)
+IMAGE_FORMATS = {
+    "png": ("PNG", "image/png", "png"),
+    "webp": ("WEBP", "image/webp", "webp"),
+    "jpeg": ("JPEG", "image/jpeg", "jpg"),
+}
+
+RETURN_MODES = ("inline", "s3_only", "both")
+
+
+def to_uint8(images):
+    """
+    Quantize decoded images to one contiguous uint8 array on the host
+
+    Rounds exactly like the pipeline's PIL conversion, so both paths encode
+    identical pixels.
+
+    Args:
+        images: [B, 3, H, W] tensor in [0, 1] (the pipeline's output_type="pt")
+
+    Returns:
+        np.ndarray: [B, H, W, 3] uint8 pixels
+    """
+    pixels = (images.float() * 255).round_().to(torch.uint8)
+    return pixels.permute(0, 2, 3, 1).contiguous().cpu().numpy()
+
+
+def encode_image(image, output_format="png", quality=90, compress_level=6):
+    """
+    Encode an image to bytes
+
+    Args:
+        image: PIL image or [H, W, 3] uint8 array (a frame of to_uint8's output)
+        output_format: One of IMAGE_FORMATS
+        quality: Quality for lossy formats (webp, jpeg)
+        compress_level: zlib level for PNG (0 = fastest, 9 = smallest)
+
+    Returns:
+        bytes: Encoded image
+    """
+    if isinstance(image, np.ndarray):
+        image = Image.fromarray(image)
+    pil_format = IMAGE_FORMATS[output_format][0]
+    buffered = io.BytesIO()
+    if output_format == "png":
+        image.save(buffered, format=pil_format, compress_level=compress_level)
+    elif output_format == "webp":
+        image.save(buffered, format=pil_format, quality=quality, method=4)
+    else:
+        image.save(buffered, format=pil_format, quality=quality)
+    return buffered.getvalue()
+
+
+def content_type(output_format):
+    return IMAGE_FORMATS[output_format][1]
+
+
+def file_extension(output_format):
+    return IMAGE_FORMATS[output_format][2]
@@ -0,0 +1,302 @@
+"""
+Online job latency model, learned from the worker's own finished jobs
+
+Jobs are keyed by their shape: the generation size rounded up to a
+LATENCY_BUCKET_MULTIPLE bucket, the number of steps, the number of images and
+the state of the custom LoRA (none, warm = already in the adapter cache,
+cold = loaded by the job). For every key the model keeps an exponentially
+weighted average of each stage and of the job total (excluding login and
+pipeline initialization). Shapes seen fewer than LATENCY_MODEL_MIN_SAMPLES
+times are predicted from a per-stage linear fit of seconds against the
+stage's work:
+
+    denoise, total                 megapixels x steps x images
+    vae_decode, image_encoding,    megapixels x images
+    upload
+    text_encoding                  images
+    lora_load                      one per job
+
+The fits are least squares with exponentially decayed weights, so the model
+follows the device and configuration it currently runs on. Every prediction is
+compared with the job's measured latency, and the absolute and signed errors
+are kept alongside the model. The model is a few KB of JSON, saved after every
+job to LATENCY_MODEL_FILE and loaded at startup.
+"""
+
+import json
+import os
+import threading
+from collections import OrderedDict
+
+from startup import MODEL_CACHE_DIR
+
+
+# Learn job latencies and answer dry runs with predictions
+LATENCY_MODEL_ENABLED = os.environ.get("LATENCY_MODEL_ENABLED", "1") == "1"
+# Kept across worker restarts (empty = in memory only)
+LATENCY_MODEL_FILE = os.environ.get("LATENCY_MODEL_FILE", os.path.join(MODEL_CACHE_DIR, "latency_model.json"))
+# Height and width are rounded up to a multiple of this to form the key
+LATENCY_BUCKET_MULTIPLE = int(os.environ.get("LATENCY_BUCKET_MULTIPLE", "256"))
+# Weight of the newest job in the per-key averages
+LATENCY_MODEL_ALPHA = float(os.environ.get("LATENCY_MODEL_ALPHA", "0.2"))
+# Jobs of a key before its own averages are trusted over the linear fits
+LATENCY_MODEL_MIN_SAMPLES = int(os.environ.get("LATENCY_MODEL_MIN_SAMPLES", "3"))
+# Keys kept, least recently seen dropped first
+LATENCY_MODEL_MAX_KEYS = int(os.environ.get("LATENCY_MODEL_MAX_KEYS", "512"))
+
+# Replicas (multi-replica mode) each learn and save their own model
+if LATENCY_MODEL_FILE and os.environ.get("REPLICA_INDEX"):
+    _root, _ext = os.path.splitext(LATENCY_MODEL_FILE)
+    LATENCY_MODEL_FILE = f"{_root}.replica{os.environ['REPLICA_INDEX']}{_ext}"
+
+STAGES = ("lora_load", "text_encoding", "denoise", "vae_decode", "image_encoding", "upload")
+# Stages outside the prediction: they only happen on a cold worker
+EXCLUDED_STAGES = ("login", "init")
+LORA_STATES = ("none", "warm", "cold")
+# Per-job decay of the linear fits' weights (about the last 200 jobs count)
+FIT_DECAY = 0.995
+FORMAT_VERSION = 1
+
+
+def round_up(value, multiple):
+    return -(-value // multiple) * multiple
+
+
+def job_shape(height, width, steps, images, lora):
+    """
+    Features of a job the model predicts from
+
+    Args:
+        height: Generation height (the compile bucket when compiled)
+        width: Generation width
+        steps: Denoising steps
+        images: Images generated by the job (items of a batch job)
+        lora: Custom LoRA state, "none", "warm" or "cold"
+    """
+    if lora not in LORA_STATES:
+        raise ValueError(f"LoRA state must be one of {', '.join(LORA_STATES)}, got {lora}")
+    return {
+        "height": round_up(height, LATENCY_BUCKET_MULTIPLE),
+        "width": round_up(width, LATENCY_BUCKET_MULTIPLE),
+        "steps": steps,
+        "images": images,
+        "lora": lora,
+    }
+
+
+def shape_key(shape):
+    """"WIDTHxHEIGHT/steps/images/lora" key of a job shape"""
+    return f"{shape['width']}x{shape['height']}/{shape['steps']}/{shape['images']}/{shape['lora']}"
+
+
+def stage_work(stage, shape):
+    """Work units a stage's latency is fitted against"""
+    megapixels = shape["height"] * shape["width"] / 1e6 * shape["images"]
+    if stage in ("denoise", "total"):
+        return megapixels * shape["steps"]
+    if stage == "text_encoding":
+        return shape["images"]
+    if stage == "lora_load":
+        return 1.0
+    return megapixels
+
+
+class DecayedFit:
+    """Weighted least squares of seconds = intercept + slope x work, older jobs weighing less"""
+
+    FIELDS = ("n", "x", "y", "xx", "xy")
+
+    def __init__(self, sums=None):
+        self.sums = dict.fromkeys(self.FIELDS, 0.0)
+        if sums:
+            self.sums.update({field: float(sums[field]) for field in self.FIELDS})
+
+    def add(self, work, seconds, decay=FIT_DECAY):
+        sums = self.sums
+        for field in self.FIELDS:
+            sums[field] *= decay
+        sums["n"] += 1
+        sums["x"] += work
+        sums["y"] += seconds
+        sums["xx"] += work * work
+        sums["xy"] += work * seconds
+
+    def predict(self, work):
+        """Seconds for `work` units, or None before the first job"""
+        n, x, y, xx, xy = (self.sums[field] for field in self.FIELDS)
+        if n <= 0:
+            return None
+        variance = xx - x * x / n
+        if variance > 1e-9 * max(xx, 1e-12):
+            slope = (xy - x * y / n) / variance
+            intercept = (y - slope * x) / n
+            # A negative slope or intercept is noise from too few distinct shapes
+            if slope >= 0 and intercept >= 0:
+                return intercept + slope * work
+        # All jobs had (nearly) the same work: scale their mean by the work
+        if x > 0:
+            return y / x * work
+        return y / n
+
+
+class LatencyModel:
+    """Per-shape stage latency averages with linear fallbacks, and the error of its own predictions"""
+
+    def __init__(self, path=LATENCY_MODEL_FILE, alpha=LATENCY_MODEL_ALPHA, min_samples=LATENCY_MODEL_MIN_SAMPLES,
+                 max_keys=LATENCY_MODEL_MAX_KEYS):
+        """
+        Initialize the model, loading the saved one if there is one
+
+        Args:
+            path: JSON file the model is saved to after every job (None = in memory only)
+            alpha: Weight of the newest job in the per-key averages
+            min_samples: Jobs of a key before its averages are used
+            max_keys: Keys kept (least recently seen dropped first)
+        """
+        self.path = path or None
+        self.alpha = alpha
+        self.min_samples = min_samples
+        self.max_keys = max_keys
+        self.lock = threading.Lock()
+        # key -> {"samples", "stages": {stage: seconds}, "total"}
+        self.keys = OrderedDict()
+        # "stage/lora" -> DecayedFit
+        self.fits = {}
+        self.errors = {"predictions": 0, "abs_pct_sum": 0.0, "pct_sum": 0.0, "recent_abs_pct": None}
+        if self.path and os.path.exists(self.path):
+            try:
+                self._load()
+                print(f"Loaded latency model ({len(self.keys)} job shapes) from {self.path}")
+            except (OSError, ValueError, KeyError, TypeError) as e:
+                print(f"Ignoring unreadable latency model file: {e}")
+                self.keys.clear()
+                self.fits.clear()
+
+    def _load(self):
+        with open(self.path) as f:
+            state = json.load(f)
+        if state.get("version") != FORMAT_VERSION:
+            raise ValueError(f"unsupported version {state.get('version')}")
+        self.keys.update(state["keys"])
+        self.fits.update({name: DecayedFit(sums) for name, sums in state["fits"].items()})
+        self.errors.update(state["errors"])
+
+    def _save(self):
+        state = {
+            "version": FORMAT_VERSION,
+            "keys": self.keys,
+            "fits": {name: fit.sums for name, fit in self.fits.items()},
+            "errors": self.errors,
+        }
+        try:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            tmp_path = f"{self.path}.tmp{threading.get_ident()}"
+            with open(tmp_path, "w") as f:
+                json.dump(state, f)
+            os.replace(tmp_path, self.path)
+        except OSError as e:
+            print(f"Could not save latency model: {e}")
+
+    def predict(self, shape):
+        """
+        Predict a job's latency from its shape
+
+        Returns:
+            dict: {"seconds", "stages", "basis", "samples", "key"}; basis is
+            "observed" (the key's own averages), "model" (the linear fits) or
+            "none" (nothing learned yet, seconds is None)
+        """
+        key = shape_key(shape)
+        with self.lock:
+            entry = self.keys.get(key)
+            samples = entry["samples"] if entry else 0
+            if entry and samples >= self.min_samples:
+                return {
+                    "seconds": round(entry["total"], 3),
+                    "stages": {stage: round(seconds, 3) for stage, seconds in entry["stages"].items()},
+                    "basis": "observed",
+                    "samples": samples,
+                    "key": key,
+                }
+            total_fit = self.fits.get(f"total/{shape['lora']}")
+            if total_fit is None:
+                return {"seconds": None, "stages": {}, "basis": "none", "samples": samples, "key": key}
+            stages = {}
+            for stage in STAGES:
+                fit = self.fits.get(f"{stage}/{shape['lora']}")
+                if fit is not None:
+                    stages[stage] = round(fit.predict(stage_work(stage, shape)), 3)
+            return {
+                "seconds": round(total_fit.predict(stage_work("total", shape)), 3),
+                "stages": stages,
+                "basis": "model",
+                "samples": samples,
+                "key": key,
+            }
+
+    def observe(self, shape, stages, total, predicted=None):
+        """
+        Learn from a finished job
+
+        Args:
+            shape: The job's shape (job_shape), with the LoRA state it actually had
+            stages: Seconds per stage of the job
+            total: Job wall-clock in seconds, including the excluded stages
+            predicted: Seconds predicted for the job before it ran, if any
+
+        Returns:
+            float: Signed relative error of the prediction ((predicted - actual) / actual), or None
+        """
+        total = max(0.0, total - sum(stages.get(stage, 0.0) for stage in EXCLUDED_STAGES))
+        observed = {stage: stages[stage] for stage in STAGES if stage in stages}
+        key = shape_key(shape)
+        error = None
+        with self.lock:
+            entry = self.keys.pop(key, None)
+            if entry is None:
+                entry = {"samples": 0, "stages": dict(observed), "total": total}
+            else:
+                # Faster on the first jobs of a key, then a moving average
+                weight = max(self.alpha, 1.0 / (entry["samples"] + 1))
+                entry["total"] += weight * (total - entry["total"])
+                for stage, seconds in observed.items():
+                    previous = entry["stages"].get(stage, seconds)
+                    entry["stages"][stage] = previous + weight * (seconds - previous)
+            entry["samples"] += 1
+            self.keys[key] = entry
+            while len(self.keys) > self.max_keys:
+                self.keys.popitem(last=False)
+
+            for stage, seconds in [*observed.items(), ("total", total)]:
+                name = f"{stage}/{shape['lora']}"
+                self.fits.setdefault(name, DecayedFit()).add(stage_work(stage, shape), seconds)
+
+            if predicted is not None and total > 0:
+                error = (predicted - total) / total
+                errors = self.errors
+                errors["predictions"] += 1
+                errors["abs_pct_sum"] += abs(error) * 100
+                errors["pct_sum"] += error * 100
+                recent = errors["recent_abs_pct"]
+                errors["recent_abs_pct"] = abs(error) * 100 if recent is None else (
+                    recent + self.alpha * (abs(error) * 100 - recent))
+
+            if self.path:
+                self._save()
+        return error
+
+    def stats(self):
+        """Size of the model and the error of its predictions so far"""
+        with self.lock:
+            errors = self.errors
+            predictions = errors["predictions"]
+            return {
+                "shapes": len(self.keys),
+                "jobs": sum(entry["samples"] for entry in self.keys.values()),
+                "predictions": predictions,
+                "mean_abs_error_pct": round(errors["abs_pct_sum"] / predictions, 1) if predictions else None,
+                # Positive when jobs finish faster than predicted
+                "bias_pct": round(errors["pct_sum"] / predictions, 1) if predictions else None,
+                "recent_abs_error_pct": round(errors["recent_abs_pct"], 1)
+                if errors["recent_abs_pct"] is not None else None,
+            }
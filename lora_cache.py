@@ -0,0 +1,212 @@
+"""
+LRU cache of named LoRA adapters kept resident on the Flux pipeline
+
+Each custom faces LoRA is loaded once under its own adapter name and later
+requests only switch the active adapter set, so warm switches skip the
+download/parse/inject cost of load_lora_weights. Cold loads look in a LoRA
+pack first (zero-copy views of a memory-mapped file) and otherwise delegate
+the download to a fetch callable (the LoraStore) that returns a local file.
+"""
+
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from quantization import match_adapter_dtype
+
+
+# Adapter name used for the baked-in enhanceaiteam/Flux-uncensored LoRA
+UNCENSORED_ADAPTER = "uncensored"
+
+# Eviction limits (either one triggers eviction of the least recently used adapter)
+LORA_CACHE_MAX_ADAPTERS = int(os.environ.get("LORA_CACHE_MAX_ADAPTERS", "32"))
+LORA_CACHE_MAX_MB = float(os.environ.get("LORA_CACHE_MAX_MB", "4096"))
+
+
+def adapter_name_for(key):
+    """Derive a stable, PEFT-safe adapter name from a (repo, weight_name, revision) key"""
+    digest = hashlib.sha1("|".join(str(part) for part in key).encode()).hexdigest()[:16]
+    return f"face_{digest}"
+
+
+def adapter_nbytes(pipe, adapter_name):
+    """Size of the LoRA parameters injected for the given adapter, per pipeline component"""
+    marker = f".{adapter_name}."
+    sizes = {}
+    for component_name in ("transformer", "text_encoder", "text_encoder_2"):
+        component = getattr(pipe, component_name, None)
+        if component is None:
+            continue
+        for name, param in component.named_parameters():
+            if marker in name:
+                sizes[component_name] = sizes.get(component_name, 0) + param.numel() * param.element_size()
+    return sizes
+
+
+class LoraCache:
+    """Keeps custom faces LoRAs loaded as named adapters and evicts them LRU"""
+
+    def __init__(self, pipe, pinned_adapters=(UNCENSORED_ADAPTER,),
+                 max_adapters=LORA_CACHE_MAX_ADAPTERS, max_bytes=None, fetch=None, pack=None):
+        """
+        Initialize the cache
+
+        Args:
+            pipe: Flux pipeline the adapters are injected into
+            pinned_adapters: Adapter names that are always active and never evicted
+            max_adapters: Maximum number of cached (non-pinned) adapters
+            max_bytes: Memory budget for cached adapters (defaults to LORA_CACHE_MAX_MB)
+            fetch: Optional callable (repo, weight_name, revision) -> local file path, used
+                instead of letting load_lora_weights download from the hub
+            pack: Optional LoraPack consulted before fetching
+        """
+        self.pipe = pipe
+        self.pinned_adapters = list(pinned_adapters)
+        self.max_adapters = max_adapters
+        self.max_bytes = max_bytes if max_bytes is not None else int(LORA_CACHE_MAX_MB * 1024 * 1024)
+        self.fetch = fetch
+        self.pack = pack
+        self.lock = threading.RLock()
+        self._entries = OrderedDict()
+        self.active_key = None
+        self.active_scale = None
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @property
+    def total_bytes(self):
+        return sum(entry["bytes"] for entry in self._entries.values())
+
+    def __contains__(self, key):
+        return key in self._entries
+
+    def activate(self, repo=None, weight_name="lora.safetensors", revision=None, scale=1.0):
+        """
+        Make the given custom LoRA (or none) active on top of the pinned adapters
+
+        Args:
+            repo: Hugging Face repository ID (or local directory) of the custom LoRA
+            weight_name: Filename of the LoRA weights
+            revision: Optional repository revision
+            scale: Adapter weight for the custom LoRA
+
+        Returns:
+            dict: Cache key, adapter name, whether it was a hit and the switch time
+        """
+        with self.lock:
+            start = time.perf_counter()
+            names = list(self.pinned_adapters)
+            weights = [1.0] * len(names)
+            key = None
+            hit = None
+
+            if repo:
+                key = (repo, weight_name, revision)
+                entry = self._entries.get(key)
+                if entry is not None:
+                    hit = True
+                    self.hits += 1
+                    self._entries.move_to_end(key)
+                else:
+                    hit = False
+                    self.misses += 1
+                    entry = self._load(key)
+                names.append(entry["name"])
+                weights.append(scale)
+
+            self._set_active(names, weights)
+            self.active_key = key
+            self.active_scale = scale if key else None
+            self._evict()
+
+            return {
+                "key": key,
+                "adapter_name": names[-1] if key else None,
+                "hit": hit,
+                "seconds": time.perf_counter() - start,
+            }
+
+    def _load(self, key):
+        """Load a LoRA into the pipeline under its own adapter name"""
+        repo, weight_name, revision = key
+        name = adapter_name_for(key)
+        print(f"Loading custom faces LoRA from {repo} as adapter '{name}'...")
+        state_dict = self.pack.state_dict(repo, weight_name, revision) if self.pack is not None else None
+        if state_dict is not None:
+            print(f"Using packed weights for {repo}")
+            repo, weight_name, revision = state_dict, None, None
+        elif self.fetch is not None:
+            # Load from the local copy (wherever the LoRA came from, the key stays the same)
+            path = self.fetch(repo, weight_name, revision)
+            repo, weight_name, revision = os.path.dirname(path), os.path.basename(path), None
+        try:
+            self.pipe.load_lora_weights(repo, weight_name=weight_name, revision=revision, adapter_name=name)
+        except Exception:
+            # Drop any partially injected layers so the adapter name can be reused
+            try:
+                self.pipe.delete_adapters(name)
+            except Exception:
+                pass
+            raise
+        match_adapter_dtype(self.pipe, name)
+        sizes = adapter_nbytes(self.pipe, name)
+        entry = {
+            "name": name,
+            "bytes": sum(sizes.values()),
+            "text_encoder": any(component != "transformer" for component in sizes),
+        }
+        self._entries[key] = entry
+        return entry
+
+    def _set_active(self, names, weights):
+        """Activate exactly the given adapters with the given weights"""
+        if names:
+            self.pipe.enable_lora()
+            self.pipe.set_adapters(names, adapter_weights=weights)
+        elif self._entries:
+            # Nothing pinned (e.g. the uncensored LoRA is fused into the weights): turn cached adapters off
+            self.pipe.disable_lora()
+
+    def _evict(self):
+        """Evict least recently used adapters until the count and memory budgets hold"""
+        while self._entries and (
+            len(self._entries) > self.max_adapters or self.total_bytes > self.max_bytes
+        ):
+            key, entry = next(iter(self._entries.items()))
+            if key == self.active_key:
+                # Never evict the adapter the current job is about to use
+                if len(self._entries) == 1:
+                    break
+                self._entries.move_to_end(key)
+                key, entry = next(iter(self._entries.items()))
+            print(f"Evicting LoRA adapter '{entry['name']}' ({key[0]})")
+            self.pipe.delete_adapters(entry["name"])
+            del self._entries[key]
+            self.evictions += 1
+
+    def keys(self):
+        """Keys of the cached custom LoRAs, least recently used first"""
+        with self.lock:
+            return list(self._entries)
+
+    def text_encoder_identity(self):
+        """Active custom adapter and scale if it patches the text encoders, else None"""
+        entry = self._entries.get(self.active_key)
+        if entry is None or not entry["text_encoder"]:
+            return None
+        return [entry["name"], self.active_scale]
+
+    def stats(self):
+        """Return cache counters"""
+        lookups = self.hits + self.misses
+        return {
+            "adapters": len(self._entries),
+            "bytes": self.total_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+        }
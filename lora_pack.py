@@ -0,0 +1,286 @@
+#!/usr/bin/env python3
+"""
+Packed, memory-mapped store of many LoRA adapters
+
+Loading a customer LoRA from its own lora.safetensors means opening, parsing
+and copying one file per adapter. A pack directory instead holds a few large
+append-only files with the raw tensor bytes of many adapters back to back,
+plus index.json mapping (repo, weight_name) to each tensor's dtype, shape and
+offset. Pack files are memory-mapped once and an adapter's state dict is a
+set of torch.frombuffer views into them, so no bytes are read or copied until
+the adapter is injected into the pipeline.
+
+Build or extend a pack with the CLI (sources are REPO[:WEIGHT_NAME][@REVISION]
+or local directories; HF_TOKEN and HF_ENDPOINT apply to hub downloads):
+
+    python lora_pack.py build  /workspace/lora-pack user/face-a user/face-b:custom.safetensors@v2
+    python lora_pack.py append /workspace/lora-pack ./faces/customer-123
+    python lora_pack.py list   /workspace/lora-pack
+
+Appending writes a new pack file and then swaps in the new index, so a running
+worker picks up the additions on its next lookup.
+"""
+
+import argparse
+import json
+import mmap
+import os
+import struct
+import threading
+
+import torch
+from huggingface_hub import hf_hub_download
+
+
+# Pack directory consulted before downloading a custom LoRA (default: disabled)
+LORA_PACK_DIR = os.environ.get("LORA_PACK_DIR") or None
+
+INDEX_FILE = "index.json"
+INDEX_FORMAT = 1
+# Byte alignment of every tensor in a pack file
+ALIGNMENT = 64
+
+# safetensors dtype names
+DTYPES = {
+    "F64": torch.float64,
+    "F32": torch.float32,
+    "F16": torch.float16,
+    "BF16": torch.bfloat16,
+    "F8_E4M3": torch.float8_e4m3fn,
+    "F8_E5M2": torch.float8_e5m2,
+    "I64": torch.int64,
+    "I32": torch.int32,
+    "I16": torch.int16,
+    "I8": torch.int8,
+    "U8": torch.uint8,
+    "BOOL": torch.bool,
+}
+
+
+def pack_key(repo, weight_name):
+    return json.dumps([repo, weight_name])
+
+
+def read_index(pack_dir):
+    try:
+        with open(os.path.join(pack_dir, INDEX_FILE)) as f:
+            index = json.load(f)
+    except FileNotFoundError:
+        return {"format": INDEX_FORMAT, "packs": [], "adapters": {}}
+    if index.get("format") != INDEX_FORMAT:
+        raise ValueError(f"Unsupported LoRA pack format {index.get('format')} in {pack_dir}")
+    return index
+
+
+def write_index(pack_dir, index):
+    path = os.path.join(pack_dir, INDEX_FILE)
+    tmp_path = f"{path}.tmp{os.getpid()}"
+    with open(tmp_path, "w") as f:
+        json.dump(index, f)
+    os.replace(tmp_path, path)
+
+
+def read_safetensors_header(path):
+    """
+    Parse a safetensors header without loading any tensors
+
+    Returns:
+        tuple: ({tensor name: {"dtype", "shape", "data_offsets"}}, metadata dict, offset of the data section)
+    """
+    with open(path, "rb") as f:
+        (length,) = struct.unpack("<Q", f.read(8))
+        header = json.loads(f.read(length))
+    metadata = header.pop("__metadata__", None) or {}
+    return header, metadata, 8 + length
+
+
+def parse_source(spec):
+    """Split REPO[:WEIGHT_NAME][@REVISION] into (repo, weight_name, revision)"""
+    revision = None
+    if "@" in spec:
+        spec, revision = spec.rsplit("@", 1)
+    weight_name = "lora.safetensors"
+    if ":" in spec:
+        spec, weight_name = spec.split(":", 1)
+    return spec, weight_name, revision
+
+
+def append_to_pack(pack_dir, sources, replace=False):
+    """
+    Copy LoRA safetensors files into a new pack file and add them to the index
+
+    Args:
+        pack_dir: Pack directory (created if needed)
+        sources: (repo, weight_name, revision) tuples; repo may be a local directory
+        replace: Pack adapters that are already indexed again (their old bytes stay unused in the old pack)
+
+    Returns:
+        list: (repo, weight_name) of the adapters added
+    """
+    os.makedirs(pack_dir, exist_ok=True)
+    index = read_index(pack_dir)
+    pack_name = f"pack-{len(index['packs']):04d}.bin"
+    tmp_path = os.path.join(pack_dir, f"{pack_name}.tmp")
+    added = []
+
+    with open(tmp_path, "wb") as out:
+        for repo, weight_name, revision in sources:
+            key = pack_key(repo, weight_name)
+            if key in index["adapters"] and not replace:
+                print(f"Skipping {repo}:{weight_name} (already packed)")
+                continue
+            if not weight_name.endswith(".safetensors"):
+                raise ValueError(f"Only safetensors LoRAs can be packed, got {weight_name}")
+            if os.path.isdir(repo):
+                path = os.path.join(repo, weight_name)
+            else:
+                path = hf_hub_download(repo, weight_name, revision=revision)
+
+            header, metadata, data_start = read_safetensors_header(path)
+            tensors = {}
+            with open(path, "rb") as f:
+                for name, info in header.items():
+                    begin, end = info["data_offsets"]
+                    out.write(b"\0" * (-out.tell() % ALIGNMENT))
+                    tensors[name] = {
+                        "dtype": info["dtype"],
+                        "shape": info["shape"],
+                        "offset": out.tell(),
+                        "nbytes": end - begin,
+                    }
+                    f.seek(data_start + begin)
+                    out.write(f.read(end - begin))
+
+            index["adapters"][key] = {
+                "pack": pack_name,
+                "repo": repo,
+                "weight_name": weight_name,
+                "revision": revision,
+                "metadata": metadata,
+                "bytes": sum(tensor["nbytes"] for tensor in tensors.values()),
+                "tensors": tensors,
+            }
+            added.append((repo, weight_name))
+            print(f"Packed {repo}:{weight_name} ({len(tensors)} tensors) into {pack_name}")
+
+    if not added:
+        os.remove(tmp_path)
+        return added
+    # The pack file must exist before the index that points into it
+    os.replace(tmp_path, os.path.join(pack_dir, pack_name))
+    index["packs"].append(pack_name)
+    write_index(pack_dir, index)
+    return added
+
+
+class LoraPack:
+    """Memory-mapped pack directory serving zero-copy adapter state dicts"""
+
+    def __init__(self, pack_dir=LORA_PACK_DIR):
+        """
+        Initialize the reader
+
+        Args:
+            pack_dir: Directory written by append_to_pack
+        """
+        self.pack_dir = pack_dir
+        self.lock = threading.Lock()
+        self._index = {"adapters": {}}
+        self._index_mtime = None
+        self._maps = {}
+        self.hits = 0
+        self.misses = 0
+        self.refresh()
+
+    def refresh(self):
+        """Re-read the index if it changed (e.g. after an append)"""
+        try:
+            mtime = os.path.getmtime(os.path.join(self.pack_dir, INDEX_FILE))
+        except OSError:
+            return
+        with self.lock:
+            if mtime != self._index_mtime:
+                self._index = read_index(self.pack_dir)
+                self._index_mtime = mtime
+
+    def _entry(self, repo, weight_name, revision):
+        entry = self._index["adapters"].get(pack_key(repo, weight_name))
+        if entry is None or (revision and revision != entry["revision"]):
+            # A pinned revision other than the packed one comes from the hub
+            return None
+        return entry
+
+    def __contains__(self, key):
+        self.refresh()
+        return self._entry(*key) is not None
+
+    def _map(self, pack_name):
+        with self.lock:
+            if pack_name not in self._maps:
+                with open(os.path.join(self.pack_dir, pack_name), "rb") as f:
+                    # Copy-on-write, so torch.frombuffer gets a writable buffer while pages stay shared
+                    self._maps[pack_name] = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_COPY)
+            return self._maps[pack_name]
+
+    def state_dict(self, repo, weight_name="lora.safetensors", revision=None):
+        """
+        State dict of a packed adapter as views into the memory-mapped pack
+
+        Returns:
+            dict or None: {tensor name: tensor}, or None if the adapter is not packed
+        """
+        self.refresh()
+        entry = self._entry(repo, weight_name, revision)
+        if entry is None:
+            self.misses += 1
+            return None
+        buffer = self._map(entry["pack"])
+        state_dict = {}
+        for name, info in entry["tensors"].items():
+            dtype = DTYPES[info["dtype"]]
+            count = info["nbytes"] // dtype.itemsize
+            if count:
+                tensor = torch.frombuffer(buffer, dtype=dtype, count=count, offset=info["offset"])
+            else:
+                tensor = torch.empty(0, dtype=dtype)
+            state_dict[name] = tensor.view(info["shape"])
+        self.hits += 1
+        return state_dict
+
+    def stats(self):
+        return {
+            "adapters": len(self._index["adapters"]),
+            "packs": len(self._maps),
+            "hits": self.hits,
+            "misses": self.misses,
+        }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest="command", required=True)
+    for name, help_text in (("build", "Create a pack directory"), ("append", "Add LoRAs to a pack directory")):
+        command = commands.add_parser(name, help=help_text)
+        command.add_argument("pack_dir")
+        command.add_argument("sources", nargs="+", help="REPO[:WEIGHT_NAME][@REVISION] or a local directory")
+        command.add_argument("--replace", action="store_true", help="Re-pack adapters that are already indexed")
+    commands.add_parser("list", help="List packed adapters").add_argument("pack_dir")
+    args = parser.parse_args()
+
+    if args.command == "list":
+        index = read_index(args.pack_dir)
+        for entry in index["adapters"].values():
+            revision = f"@{entry['revision']}" if entry["revision"] else ""
+            print(f"{entry['repo']}:{entry['weight_name']}{revision}  {entry['bytes'] / 1024 / 1024:.1f}MB  "
+                  f"{entry['pack']}")
+        print(f"{len(index['adapters'])} adapters in {len(index['packs'])} pack files")
+        return
+
+    if args.command == "build" and os.path.exists(os.path.join(args.pack_dir, INDEX_FILE)):
+        parser.error(f"{args.pack_dir} already holds a pack, use append")
+    added = append_to_pack(args.pack_dir, [parse_source(spec) for spec in args.sources], replace=args.replace)
+    print(f"Added {len(added)} adapters to {args.pack_dir}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,297 @@
+"""
+Bounded on-disk store of custom LoRA files with prefetching downloads
+
+Custom faces LoRAs are downloaded from the hub (or HF_ENDPOINT) into a local
+store rather than the huggingface_hub cache, so disk use stays under
+LORA_STORE_MAX_MB with least recently used files deleted first. Files larger
+than one chunk are fetched with parallel HTTP Range requests and resumed
+after an interruption, and every file is checked against the hub's content
+hash before it is used (see hub_download.py).
+
+In the concurrent modes a job's LoRA is prefetched as soon as the job arrives,
+so it downloads while earlier jobs are still denoising instead of stalling the
+GPU thread when the job's turn comes.
+"""
+
+import json
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+
+from hub_download import RangeDownloader, file_metadata
+
+
+LORA_STORE_ENABLED = os.environ.get("LORA_STORE_ENABLED", "1") == "1"
+LORA_STORE_DIR = os.environ.get("LORA_STORE_DIR", "/tmp/flux-lora-store")
+LORA_STORE_MAX_MB = float(os.environ.get("LORA_STORE_MAX_MB", "8192"))
+# Parallel Range requests (shared by all downloads) and the size of each
+LORA_DOWNLOAD_STREAMS = int(os.environ.get("LORA_DOWNLOAD_STREAMS", "4"))
+LORA_DOWNLOAD_CHUNK_MB = float(os.environ.get("LORA_DOWNLOAD_CHUNK_MB", "16"))
+LORA_DOWNLOAD_TIMEOUT = float(os.environ.get("LORA_DOWNLOAD_TIMEOUT", "60"))
+# Background downloads for LoRAs of queued jobs
+LORA_PREFETCH_WORKERS = int(os.environ.get("LORA_PREFETCH_WORKERS", "2"))
+# How long a branch/tag resolution is trusted before the hub is asked again
+LORA_STORE_REVALIDATE_SECONDS = float(os.environ.get("LORA_STORE_REVALIDATE_SECONDS", "300"))
+
+INDEX_FILE = "index.json"
+
+COMMIT_HASH = re.compile(r"^[0-9a-f]{40}$")
+
+
+class LoraStore:
+    """Disk LRU of LoRA files, bounded by total size, filled by resumable parallel downloads"""
+
+    def __init__(self, root=LORA_STORE_DIR, max_bytes=None, endpoint=None, streams=LORA_DOWNLOAD_STREAMS,
+                 chunk_bytes=None, prefetch_workers=LORA_PREFETCH_WORKERS,
+                 revalidate_seconds=LORA_STORE_REVALIDATE_SECONDS):
+        """
+        Initialize the store, indexing files already on disk
+
+        Args:
+            root: Directory holding the index, complete files and partial downloads
+            max_bytes: Size budget (defaults to LORA_STORE_MAX_MB)
+            endpoint: Hub endpoint (defaults to HF_ENDPOINT / huggingface.co)
+            streams: Parallel Range requests across all downloads
+            chunk_bytes: Bytes per Range request (defaults to LORA_DOWNLOAD_CHUNK_MB)
+            prefetch_workers: Concurrent background downloads
+            revalidate_seconds: Age after which a branch or tag is resolved again
+        """
+        self.root = root
+        self.blob_dir = os.path.join(root, "blobs")
+        self.max_bytes = max_bytes if max_bytes is not None else int(LORA_STORE_MAX_MB * 1024 * 1024)
+        self.endpoint = endpoint
+        self.revalidate_seconds = revalidate_seconds
+        self.lock = threading.RLock()
+        self._pending = {}
+        # Blob name -> Future of its download, shared by every key resolving to the same content
+        self._downloads = {}
+        self._blobs = OrderedDict()
+
+        self._downloader = RangeDownloader(
+            streams=streams,
+            chunk_bytes=chunk_bytes or int(LORA_DOWNLOAD_CHUNK_MB * 1024 * 1024),
+            timeout=LORA_DOWNLOAD_TIMEOUT,
+            thread_name_prefix="lora-chunk"
+        )
+        self._prefetch_pool = ThreadPoolExecutor(max_workers=prefetch_workers, thread_name_prefix="lora-prefetch")
+
+        self.hits = 0
+        self.downloads = 0
+        self.evictions = 0
+        self.prefetches = 0
+        self.download_seconds = 0.0
+        self.wait_seconds = 0.0
+
+        os.makedirs(self.blob_dir, exist_ok=True)
+        self._index = self._read_index()
+        existing = []
+        for name in os.listdir(self.blob_dir):
+            path = os.path.join(self.blob_dir, name)
+            # Partial downloads (and their progress files) are kept for resuming
+            if ".part" not in name:
+                existing.append((os.path.getmtime(path), name, os.path.getsize(path)))
+        for _, name, size in sorted(existing):
+            self._blobs[name] = size
+        self._evict()
+
+    @property
+    def total_bytes(self):
+        return sum(self._blobs.values())
+
+    def _read_index(self):
+        try:
+            with open(os.path.join(self.root, INDEX_FILE)) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def _write_index(self):
+        path = os.path.join(self.root, INDEX_FILE)
+        tmp_path = f"{path}.tmp{threading.get_ident()}"
+        with open(tmp_path, "w") as f:
+            json.dump(self._index, f)
+        os.replace(tmp_path, path)
+
+    def fetch(self, repo, weight_name="lora.safetensors", revision=None):
+        """
+        Local path of a LoRA file, downloading it unless it is already stored
+
+        Joins a prefetch of the same file that is already running instead of starting another.
+        """
+        key = (repo, weight_name, revision)
+        start = time.perf_counter()
+        with self.lock:
+            future = self._pending.get(key)
+            leader = future is None
+            if leader:
+                future = Future()
+                self._pending[key] = future
+        if leader:
+            # The caller needs the file now, so it downloads on its own thread rather than queueing behind prefetches
+            self._run(key, future)
+        try:
+            return future.result()
+        finally:
+            with self.lock:
+                self.wait_seconds += time.perf_counter() - start
+
+    def prefetch(self, repo, weight_name="lora.safetensors", revision=None):
+        """
+        Start fetching a LoRA file in the background
+
+        Returns:
+            Future: Resolves to the local path (a failed prefetch is retried, and resumed, by fetch)
+        """
+        key = (repo, weight_name, revision)
+        with self.lock:
+            future = self._pending.get(key)
+            if future is not None:
+                return future
+            future = Future()
+            self._pending[key] = future
+            self.prefetches += 1
+        self._prefetch_pool.submit(self._run, key, future)
+        return future
+
+    def _run(self, key, future):
+        try:
+            path = self._fetch(key)
+        except Exception as e:
+            with self.lock:
+                self._pending.pop(key, None)
+            future.set_exception(e)
+        else:
+            with self.lock:
+                self._pending.pop(key, None)
+            future.set_result(path)
+
+    def _fetch(self, key):
+        repo, weight_name, revision = key
+        if os.path.isdir(repo):
+            # Local LoRA directories are used in place
+            return os.path.join(repo, weight_name)
+
+        entry = self._resolve(key)
+        path = os.path.join(self.blob_dir, entry["file"])
+        with self.lock:
+            stored = entry["file"] in self._blobs
+            if stored:
+                self.hits += 1
+                self._blobs.move_to_end(entry["file"])
+        if stored:
+            try:
+                os.utime(path)
+                return path
+            except OSError:
+                # Deleted behind our back: download again
+                with self.lock:
+                    self._blobs.pop(entry["file"], None)
+
+        # Different keys (a branch and its commit, a mirror URL) can name the same blob
+        with self.lock:
+            download = self._downloads.get(entry["file"])
+            leader = download is None
+            if leader:
+                download = Future()
+                self._downloads[entry["file"]] = download
+        if not leader:
+            download.result()
+            return path
+        try:
+            self._download(entry, path)
+        except Exception as e:
+            download.set_exception(e)
+            raise
+        else:
+            download.set_result(path)
+        finally:
+            with self.lock:
+                self._downloads.pop(entry["file"], None)
+        return path
+
+    def _resolve(self, key):
+        """Hub metadata (content hash, size, download URL) of a file, cached for pinned commits and fresh lookups"""
+        repo, weight_name, revision = key
+        key_id = json.dumps(key)
+        with self.lock:
+            entry = self._index.get(key_id)
+            stored = entry is not None and entry["file"] in self._blobs
+        if stored and (
+            (revision and COMMIT_HASH.match(revision))
+            or time.time() - entry["resolved"] < self.revalidate_seconds
+        ):
+            return entry
+
+        try:
+            metadata = file_metadata(repo, weight_name, revision=revision, endpoint=self.endpoint)
+        except Exception as e:
+            if stored:
+                print(f"Could not revalidate {repo}/{weight_name} ({e}), using the stored copy")
+                return entry
+            raise
+
+        entry = {
+            "file": metadata["etag"] + os.path.splitext(weight_name)[1],
+            **metadata,
+            "resolved": time.time(),
+        }
+        with self.lock:
+            self._index[key_id] = entry
+            self._write_index()
+        return entry
+
+    def _download(self, entry, path):
+        """Download a file with parallel Range requests, resuming a previous partial download"""
+        start = time.perf_counter()
+        size = entry["size"]
+        self._downloader.download(entry["url"], path, size, entry["etag"], authenticated=entry["authenticated"])
+
+        elapsed = time.perf_counter() - start
+        with self.lock:
+            self._blobs[entry["file"]] = size
+            self._blobs.move_to_end(entry["file"])
+            self.downloads += 1
+            self.download_seconds += elapsed
+        print(f"Downloaded {entry['file']} ({size / 1024 / 1024:.1f}MB) in {elapsed:.2f}s")
+        self._evict(keep=entry["file"])
+
+    def _evict(self, keep=None):
+        """Delete least recently used files until the store fits its budget"""
+        while True:
+            with self.lock:
+                if self.total_bytes <= self.max_bytes:
+                    return
+                candidates = [name for name in self._blobs if name != keep]
+                if not candidates:
+                    return
+                name = candidates[0]
+                del self._blobs[name]
+                self.evictions += 1
+                # Every key resolved to the blob is resolved again next time
+                stale = [key_id for key_id, entry in self._index.items() if entry["file"] == name]
+                for key_id in stale:
+                    del self._index[key_id]
+                if stale:
+                    self._write_index()
+            print(f"Evicting stored LoRA file {name}")
+            try:
+                os.remove(os.path.join(self.blob_dir, name))
+            except OSError:
+                pass
+
+    def stats(self):
+        return {
+            "files": len(self._blobs),
+            "bytes": self.total_bytes,
+            "hits": self.hits,
+            "downloads": self.downloads,
+            "resumed": self._downloader.resumed,
+            "evictions": self.evictions,
+            "prefetches": self.prefetches,
+            "bytes_downloaded": self._downloader.bytes_downloaded,
+            "download_seconds": round(self.download_seconds, 3),
+            "wait_seconds": round(self.wait_seconds, 3),
+        }
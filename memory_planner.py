@@ -0,0 +1,218 @@
+"""
+Resolution-aware memory planner
+
+Estimates the peak device footprint of a job from its resolution, batch size
+and the resident weights (including LoRA adapters), then picks the least
+intrusive execution plan that fits the device memory budget:
+
+    resident                everything on the device
+    vae_slicing             decode one image at a time
+    vae_tiling              decode in tiles (plus slicing)
+    model_cpu_offload       keep only the active model on the device (plus tiling)
+    sequential_cpu_offload  stream submodules to the device one at a time (plus tiling)
+"""
+
+import os
+
+import torch
+
+
+PLANS = ("resident", "vae_slicing", "vae_tiling", "model_cpu_offload", "sequential_cpu_offload")
+OFFLOAD_PLANS = ("model_cpu_offload", "sequential_cpu_offload")
+
+# Device memory budget; defaults to MEMORY_HEADROOM of the GPU's total memory (unlimited on CPU)
+DEVICE_MEMORY_BUDGET_GB = os.environ.get("DEVICE_MEMORY_BUDGET_GB") or None
+MEMORY_HEADROOM = float(os.environ.get("MEMORY_HEADROOM", "0.9"))
+
+GB = 1024 ** 3
+
+
+def module_bytes(module):
+    """Bytes held by a module's parameters and buffers"""
+    if module is None:
+        return 0
+    tensors = list(module.parameters()) + list(module.buffers())
+    return sum(t.numel() * t.element_size() for t in tensors)
+
+
+def lora_bytes(module):
+    """Bytes held by the LoRA adapter parameters loaded into a module"""
+    if module is None:
+        return 0
+    return sum(
+        p.numel() * p.element_size()
+        for name, p in module.named_parameters()
+        if "lora_" in name
+    )
+
+
+def default_budget(device):
+    """Device memory budget in bytes, or None when there is no limit to plan for"""
+    if DEVICE_MEMORY_BUDGET_GB:
+        return int(float(DEVICE_MEMORY_BUDGET_GB) * GB)
+    if device.type == "cuda" and torch.cuda.is_available():
+        return int(torch.cuda.get_device_properties(device).total_memory * MEMORY_HEADROOM)
+    return None
+
+
+class MemoryPlanner:
+    """Estimates per-job peak memory and applies the matching pipeline memory plan"""
+
+    # Live activation bytes per token per hidden unit in the transformer (attention
+    # via SDPA, so memory is linear in tokens); calibrated on FLUX.1-dev in bf16
+    TRANSFORMER_ACTIVATION_FACTOR = 24
+    # Live bytes per output pixel per channel of the VAE decoder's full-resolution stage
+    VAE_DECODE_FACTOR = 12
+
+    def __init__(self, pipe, device, budget_bytes=None, max_sequence_length=512, keep_on_cpu=()):
+        """
+        Initialize the planner
+
+        Args:
+            pipe: Flux pipeline the plans are applied to
+            device: Device the pipeline runs on
+            budget_bytes: Device memory budget (defaults to default_budget(device))
+            max_sequence_length: T5 tokens appended to the image tokens
+            keep_on_cpu: Components left on the CPU when returning to a resident plan
+        """
+        self.pipe = pipe
+        self.device = device
+        self.budget_bytes = budget_bytes if budget_bytes is not None else default_budget(device)
+        self.max_sequence_length = max_sequence_length
+        self.keep_on_cpu = set(keep_on_cpu)
+        self.current_plan = "resident"
+
+    def weight_bytes(self):
+        """Bytes of each model component (including its loaded adapters), measured from its parameters"""
+        return {
+            name: module_bytes(getattr(self.pipe, name, None))
+            for name in ("transformer", "text_encoder", "text_encoder_2", "vae")
+        }
+
+    def adapter_bytes(self):
+        """Bytes of every LoRA adapter currently loaded into the pipeline"""
+        return sum(
+            lora_bytes(getattr(self.pipe, name, None))
+            for name in ("transformer", "text_encoder")
+        )
+
+    def estimate(self, height, width, num_images, text_encoder_2_resident=True):
+        """
+        Estimate peak device memory for every plan
+
+        Args:
+            height: Output height in pixels
+            width: Output width in pixels
+            num_images: Images generated in one pipeline call
+            text_encoder_2_resident: False when T5 is kept on the CPU
+
+        Returns:
+            dict: Component sizes and the estimated peak (bytes) of each plan
+        """
+        weights = self.weight_bytes()
+        if not text_encoder_2_resident:
+            weights["text_encoder_2"] = 0
+        transformer = self.pipe.transformer
+        vae = self.pipe.vae
+        dtype_bytes = next(transformer.parameters()).element_size()
+
+        hidden = transformer.config.num_attention_heads * transformer.config.attention_head_dim
+        # Latents are packed into 2x2 patches, one token each (1024x1024 -> 4096 tokens on FLUX.1-dev)
+        patch = self.pipe.vae_scale_factor * 2
+        tokens = (height // patch) * (width // patch) + self.max_sequence_length
+        activations = num_images * tokens * hidden * dtype_bytes * self.TRANSFORMER_ACTIVATION_FACTOR
+
+        vae_channels = vae.config.block_out_channels[0]
+        vae_dtype_bytes = next(vae.parameters()).element_size()
+        per_pixel = vae_channels * vae_dtype_bytes * self.VAE_DECODE_FACTOR
+        tile = getattr(vae, "tile_sample_min_size", None) or vae.config.sample_size
+        vae_full = num_images * height * width * per_pixel
+        vae_sliced = height * width * per_pixel
+        vae_tiled = min(height * width, tile * tile) * per_pixel
+
+        # Decoded float images kept until the output stage takes them
+        outputs = num_images * height * width * 3 * 4
+
+        # Adapters are parameters of the components they were loaded into, so they are
+        # already part of the component sizes
+        all_weights = sum(weights.values())
+        largest_block = max(
+            (module_bytes(block) for block in
+             list(transformer.transformer_blocks) + list(transformer.single_transformer_blocks)),
+            default=0
+        )
+
+        peaks = {
+            "resident": all_weights + max(activations, vae_full) + outputs,
+            "vae_slicing": all_weights + max(activations, vae_sliced) + outputs,
+            "vae_tiling": all_weights + max(activations, vae_tiled) + outputs,
+            "model_cpu_offload": max(
+                weights["transformer"] + activations,
+                weights["vae"] + vae_tiled + outputs,
+                weights["text_encoder_2"],
+            ),
+            "sequential_cpu_offload": largest_block + max(activations, vae_tiled) + outputs,
+        }
+        return {
+            "weights": weights,
+            "adapters": self.adapter_bytes(),
+            "activations": activations,
+            "vae_decode": vae_full,
+            "peaks": peaks,
+        }
+
+    def choose(self, height, width, num_images, text_encoder_2_resident=True):
+        """Pick the least intrusive plan whose estimated peak fits the budget"""
+        estimate = self.estimate(height, width, num_images, text_encoder_2_resident)
+        plan = PLANS[-1]
+        if self.budget_bytes is None:
+            plan = "resident"
+        else:
+            for candidate in PLANS:
+                if estimate["peaks"][candidate] <= self.budget_bytes:
+                    plan = candidate
+                    break
+        return {
+            "plan": plan,
+            "estimated_peak_gb": round(estimate["peaks"][plan] / GB, 2),
+            "adapters_gb": round(estimate["adapters"] / GB, 3),
+            "budget_gb": round(self.budget_bytes / GB, 2) if self.budget_bytes is not None else None,
+            "fits": self.budget_bytes is None or estimate["peaks"][plan] <= self.budget_bytes,
+        }
+
+    def max_images(self, height, width, limit, text_encoder_2_resident=True):
+        """Most images (1 to limit) one call can generate without offloading (VAE slicing allowed)"""
+        if self.budget_bytes is None:
+            return limit
+        for num_images in range(limit, 1, -1):
+            estimate = self.estimate(height, width, num_images, text_encoder_2_resident)
+            if estimate["peaks"]["vae_slicing"] <= self.budget_bytes:
+                return num_images
+        return 1
+
+    def apply(self, plan):
+        """Switch the pipeline to a plan (only the settings that differ are changed)"""
+        vae = self.pipe.vae
+        if plan == "resident":
+            vae.disable_slicing()
+        else:
+            vae.enable_slicing()
+        if plan in ("resident", "vae_slicing"):
+            vae.disable_tiling()
+        else:
+            vae.enable_tiling()
+
+        offload = plan if plan in OFFLOAD_PLANS else None
+        current_offload = self.current_plan if self.current_plan in OFFLOAD_PLANS else None
+        if offload != current_offload:
+            print(f"Switching pipeline memory mode: {current_offload or 'resident'} -> {offload or 'resident'}")
+            self.pipe.remove_all_hooks()
+            if offload == "model_cpu_offload":
+                self.pipe.enable_model_cpu_offload(device=self.device)
+            elif offload == "sequential_cpu_offload":
+                self.pipe.enable_sequential_cpu_offload(device=self.device)
+            else:
+                for name, component in self.pipe.components.items():
+                    if isinstance(component, torch.nn.Module) and name not in self.keep_on_cpu:
+                        component.to(self.device)
+        self.current_plan = plan
@@ -0,0 +1,259 @@
+"""
+Per-job stage timings and Prometheus metrics export
+
+Each job carries a JobMetrics that records how long it spent in every stage
+(login, init, LoRA activation, text encoding, denoising, VAE decode, image
+encoding, upload), plus peak device and host memory. Finished jobs are folded
+into process-wide counters and histograms that are exported in the Prometheus
+text format, written to METRICS_FILE (e.g. for node_exporter's textfile
+collector) and/or served on METRICS_PORT at /metrics.
+
+Recording a stage is two perf_counter calls and a locked dict update, so the
+instrumentation stays on in production.
+"""
+
+import os
+import resource
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import torch
+
+
+METRICS_FILE = os.environ.get("METRICS_FILE") or None
+METRICS_PORT = int(os.environ.get("METRICS_PORT", "0"))
+# Interface the /metrics endpoint binds to (0.0.0.0 exposes it beyond the host)
+METRICS_HOST = os.environ.get("METRICS_HOST", "127.0.0.1")
+
+# Histogram buckets (seconds) for stage and job latencies
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+
+MB = 1024 * 1024
+
+
+@contextmanager
+def timed(stage, *jobs):
+    """Add the duration of the block to a stage of every given job (several for a batched call)"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        for job in jobs:
+            job.add(stage, elapsed)
+
+
+class JobMetrics:
+    """Stage timings, counters and peak memory of one job"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.started = time.perf_counter()
+        self.stages = OrderedDict()
+        self.counters = {}
+        self.finished = None
+        if torch.cuda.is_available():
+            # Concurrent jobs (batched or pipelined modes) share the peak
+            torch.cuda.reset_peak_memory_stats()
+
+    def stage(self, name):
+        return timed(name, self)
+
+    def add(self, stage, seconds):
+        with self.lock:
+            self.stages[stage] = self.stages.get(stage, 0.0) + seconds
+
+    def count(self, name, value=1):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def set(self, name, value):
+        with self.lock:
+            self.counters[name] = value
+
+    def finish(self):
+        """Freeze the total wall-clock and memory peaks (idempotent)"""
+        if self.finished is None:
+            self.finished = time.perf_counter()
+            self.peak_device_bytes = torch.cuda.max_memory_allocated() if torch.cuda.is_available() else 0
+            # ru_maxrss is in KB on Linux; this is the process peak, not the job's own
+            self.peak_host_bytes = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+        return self
+
+    def report(self):
+        """JSON-serializable summary for the job result"""
+        self.finish()
+        with self.lock:
+            return {
+                "stages": {stage: round(seconds, 4) for stage, seconds in self.stages.items()},
+                "total_seconds": round(self.finished - self.started, 4),
+                **self.counters,
+                "peak_device_memory_mb": round(self.peak_device_bytes / MB, 1),
+                "peak_host_memory_mb": round(self.peak_host_bytes / MB, 1),
+            }
+
+
+class Histogram:
+    """Cumulative Prometheus histogram"""
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+        self.count += 1
+        self.sum += value
+
+
+class MetricsRegistry:
+    """Process-wide counters, gauges and histograms with Prometheus text rendering"""
+
+    def __init__(self, namespace="flux"):
+        self.namespace = namespace
+        self.lock = threading.Lock()
+        # name -> (type, help, {label tuple: value or Histogram})
+        self._metrics = OrderedDict()
+
+    def _series(self, name, kind, help_text):
+        if name not in self._metrics:
+            self._metrics[name] = (kind, help_text, OrderedDict())
+        return self._metrics[name][2]
+
+    def inc(self, name, help_text, value=1, **labels):
+        with self.lock:
+            series = self._series(name, "counter", help_text)
+            key = tuple(sorted(labels.items()))
+            series[key] = series.get(key, 0) + value
+
+    def set_gauge(self, name, help_text, value, **labels):
+        with self.lock:
+            self._series(name, "gauge", help_text)[tuple(sorted(labels.items()))] = value
+
+    def observe(self, name, help_text, value, **labels):
+        with self.lock:
+            series = self._series(name, "histogram", help_text)
+            key = tuple(sorted(labels.items()))
+            if key not in series:
+                series[key] = Histogram()
+            series[key].observe(value)
+
+    def observe_job(self, job, status):
+        """Fold a finished job into the counters and histograms"""
+        job.finish()
+        self.inc("jobs_total", "Jobs handled, by status", status=status)
+        self.observe("job_seconds", "Job wall-clock in seconds", job.finished - job.started, status=status)
+        for stage, seconds in list(job.stages.items()):
+            self.observe("stage_seconds", "Time spent per stage in seconds", seconds, stage=stage)
+
+        counters = dict(job.counters)
+        if "lora_cache_hit" in counters:
+            result = "hit" if counters["lora_cache_hit"] else "miss"
+            self.inc("lora_cache_requests_total", "Custom LoRA activations, by adapter cache result", result=result)
+        if "result_cache_hit" in counters:
+            result = "hit" if counters["result_cache_hit"] else "miss"
+            self.inc("result_cache_requests_total", "Seeded jobs looked up in the result cache, by result",
+                     result=result)
+        if counters.get("deduplicated"):
+            self.inc("deduplicated_jobs_total", "Jobs that waited for an identical job in flight")
+        self.inc("images_total", "Images generated", counters.get("images", 0))
+        self.inc("uploaded_bytes_total", "Bytes uploaded to S3", counters.get("uploaded_bytes", 0))
+        self.inc("cost_megapixel_steps_total", "Estimated cost of accepted jobs (height x width x steps x images / 1e6)",
+                 counters.get("cost_megapixel_steps", 0))
+        if "prediction_error_pct" in counters:
+            error = counters["prediction_error_pct"] / 100
+            self.observe("latency_prediction_error_ratio", "Absolute error of the predicted job latency, "
+                         "relative to the measured one", abs(error))
+            self.inc("latency_predictions_total", "Jobs whose latency was predicted, by direction of the error",
+                     direction="over" if error > 0 else "under")
+        if job.peak_device_bytes:
+            self.set_gauge("peak_device_memory_bytes", "Peak device memory of the last job", job.peak_device_bytes)
+        self.set_gauge("peak_host_memory_bytes", "Peak resident memory of the worker process", job.peak_host_bytes)
+
+    def render(self):
+        """Prometheus text exposition format"""
+        lines = []
+        with self.lock:
+            for name, (kind, help_text, series) in self._metrics.items():
+                full_name = f"{self.namespace}_{name}"
+                lines.append(f"# HELP {full_name} {help_text}")
+                lines.append(f"# TYPE {full_name} {kind}")
+                for labels, value in series.items():
+                    if kind != "histogram":
+                        lines.append(f"{full_name}{format_labels(labels)} {value}")
+                        continue
+                    for bound, count in zip(value.buckets, value.counts):
+                        lines.append(f"{full_name}_bucket{format_labels(labels + (('le', bound),))} {count}")
+                    lines.append(f"{full_name}_bucket{format_labels(labels + (('le', '+Inf'),))} {value.count}")
+                    lines.append(f"{full_name}_sum{format_labels(labels)} {value.sum}")
+                    lines.append(f"{full_name}_count{format_labels(labels)} {value.count}")
+        return "\n".join(lines) + "\n"
+
+
+def format_labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{key}="{value}"' for key, value in labels) + "}"
+
+
+class MetricsExporter:
+    """Publishes a registry to a file and/or a local HTTP endpoint"""
+
+    def __init__(self, registry, path=METRICS_FILE, port=METRICS_PORT, host=METRICS_HOST):
+        """
+        Initialize the exporter
+
+        Args:
+            registry: MetricsRegistry to export
+            path: File rewritten (atomically) after every job, or None
+            port: Port serving GET /metrics, or 0 to disable
+            host: Interface the endpoint binds to
+        """
+        self.registry = registry
+        self.path = path
+        self.port = port
+        self.host = host
+        self._server = None
+
+    def start(self):
+        """Start the HTTP endpoint if a port is configured"""
+        if not self.port or self._server is not None:
+            return
+        registry = self.registry
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split("?")[0] != "/metrics":
+                    self.send_error(404)
+                    return
+                body = registry.render().encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self._server = ThreadingHTTPServer((self.host, self.port), Handler)
+        threading.Thread(target=self._server.serve_forever, name="metrics", daemon=True).start()
+        print(f"Serving metrics on {self.host}:{self.port}/metrics")
+
+    def write(self):
+        """Rewrite the metrics file if one is configured"""
+        if not self.path:
+            return
+        directory = os.path.dirname(os.path.abspath(self.path))
+        os.makedirs(directory, exist_ok=True)
+        with tempfile.NamedTemporaryFile("w", dir=directory, delete=False, suffix=".tmp") as f:
+            f.write(self.registry.render())
+        os.replace(f.name, self.path)
@@ -0,0 +1,74 @@
+"""
+Bounded background pool for the output stage (image encoding, base64, S3 upload)
+
+Each generated image is encoded and uploaded on its own pool task, so the
+images of a job are processed in parallel. In pipelined mode the GPU thread
+hands its images to the pool and moves on to the next job's denoising. When
+OUTPUT_MAX_PENDING tasks are already queued, submit() blocks the caller,
+which stops the GPU from running ahead of the uploads.
+"""
+
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+
+OUTPUT_WORKERS = int(os.environ.get("OUTPUT_WORKERS", "8"))
+OUTPUT_MAX_PENDING = int(os.environ.get("OUTPUT_MAX_PENDING", "16"))
+# Accept a second job while the first one is still encoding/uploading
+PIPELINED_OUTPUT = os.environ.get("PIPELINED_OUTPUT", "0") == "1"
+PIPELINE_CONCURRENCY = int(os.environ.get("PIPELINE_CONCURRENCY", "2"))
+
+
+class OutputStage:
+    """Thread pool with a bounded number of queued or running tasks"""
+
+    def __init__(self, max_workers=OUTPUT_WORKERS, max_pending=OUTPUT_MAX_PENDING):
+        """
+        Initialize the output stage
+
+        Args:
+            max_workers: Number of encode/upload threads
+            max_pending: Maximum tasks queued or running before submit() blocks
+        """
+        self.max_workers = max_workers
+        self.max_pending = max_pending
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="output")
+        self._slots = threading.BoundedSemaphore(max_pending)
+        self.lock = threading.Lock()
+        self.submitted = 0
+        self.blocked = 0
+
+    def submit(self, fn, *args, **kwargs):
+        """Schedule fn on the pool, blocking while the pool is saturated"""
+        if not self._slots.acquire(blocking=False):
+            with self.lock:
+                self.blocked += 1
+            self._slots.acquire()
+        try:
+            future = self._executor.submit(fn, *args, **kwargs)
+        except Exception:
+            self._slots.release()
+            raise
+        future.add_done_callback(lambda _: self._slots.release())
+        with self.lock:
+            self.submitted += 1
+        return future
+
+    def shutdown(self, wait=True):
+        self._executor.shutdown(wait=wait)
+
+
+def gather(futures):
+    """Wait for all futures and return their results in order, raising the first failure"""
+    results = []
+    error = None
+    for future in futures:
+        try:
+            results.append(future.result())
+        except Exception as e:
+            if error is None:
+                error = e
+    if error is not None:
+        raise error
+    return results
@@ -0,0 +1,198 @@
+"""
+Step progress and cheap latent previews for streaming mode
+
+Instead of running the VAE, a preview is a linear projection of the packed
+latents to RGB at latent resolution (1/8 of the output, 128x128 for 1024x1024),
+encoded as a small JPEG/WebP thumbnail. The projection is fitted once per
+pipeline by least squares against the VAE's own encodings of smooth random
+colour images, so it matches whatever VAE (and latent channel count) is loaded.
+
+The callback only does the projection and a small device-to-host copy on the
+GPU thread; thumbnails are encoded by the consumer of the progress events. If
+a preview costs more than PREVIEW_MAX_STEP_FRACTION of a denoising step, the
+preview interval is doubled.
+"""
+
+import base64
+import io
+import os
+import queue
+import time
+
+import torch
+import torch.nn.functional as F
+from diffusers import FluxPipeline
+from PIL import Image
+
+
+# Serve a generator handler that streams progress and previews (opt-in)
+STREAMING_ENABLED = os.environ.get("STREAMING_ENABLED", "0") == "1"
+# Preview every N steps (0 = progress only)
+PREVIEW_EVERY_N_STEPS = int(os.environ.get("PREVIEW_EVERY_N_STEPS", "4"))
+PREVIEW_FORMAT = os.environ.get("PREVIEW_FORMAT", "jpeg")
+PREVIEW_QUALITY = int(os.environ.get("PREVIEW_QUALITY", "70"))
+PREVIEW_MAX_SIZE = int(os.environ.get("PREVIEW_MAX_SIZE", "256"))
+# Preview cost budget as a fraction of one denoising step
+PREVIEW_MAX_STEP_FRACTION = float(os.environ.get("PREVIEW_MAX_STEP_FRACTION", "0.05"))
+
+PREVIEW_FORMATS = {"jpeg": ("JPEG", "image/jpeg"), "webp": ("WEBP", "image/webp")}
+
+
+def fit_latent_rgb(vae, samples=8, size=256, seed=0):
+    """
+    Fit a linear latent -> RGB projection for a VAE
+
+    Encodes smooth random colour fields, normalizes the latents the way the
+    Flux pipeline does, and solves least squares against the images averaged
+    down to latent resolution.
+
+    Returns:
+        tuple: (weight [latent_channels, 3], bias [3]) float32 tensors in [-1, 1] RGB space
+    """
+    generator = torch.Generator().manual_seed(seed)
+    low = torch.rand(samples, 3, 4, 4, generator=generator)
+    images = F.interpolate(low, size=(size, size), mode="bicubic", align_corners=False).clamp(0, 1) * 2 - 1
+
+    with torch.no_grad():
+        latents = vae.encode(images.to(vae.device, vae.dtype)).latent_dist.mean.float().cpu()
+    latents = (latents - (vae.config.shift_factor or 0.0)) * vae.config.scaling_factor
+
+    channels, height, width = latents.shape[1:]
+    targets = F.adaptive_avg_pool2d(images, (height, width))
+    inputs = latents.permute(0, 2, 3, 1).reshape(-1, channels)
+    inputs = torch.cat([inputs, torch.ones(len(inputs), 1)], dim=1)
+    solution = torch.linalg.lstsq(inputs, targets.permute(0, 2, 3, 1).reshape(-1, 3)).solution
+    return solution[:-1], solution[-1]
+
+
+class LatentPreviewer:
+    """Projects packed Flux latents to small RGB previews"""
+
+    def __init__(self, pipe):
+        self.pipe = pipe
+        start = time.perf_counter()
+        weight, bias = fit_latent_rgb(pipe.vae)
+        self.weight = weight
+        self.bias = bias
+        self._on_device = {}
+        print(f"Fitted latent preview projection in {(time.perf_counter() - start) * 1000:.0f}ms")
+
+    def _projection(self, device):
+        if device not in self._on_device:
+            self._on_device[device] = (self.weight.to(device), self.bias.to(device))
+        return self._on_device[device]
+
+    def preview(self, latents, height, width, index=0):
+        """
+        RGB preview of one image of a packed latent batch
+
+        Returns:
+            numpy.ndarray: uint8 array (latent height, latent width, 3)
+        """
+        unpacked = FluxPipeline._unpack_latents(latents[index:index + 1], height, width, self.pipe.vae_scale_factor)
+        weight, bias = self._projection(unpacked.device)
+        rgb = torch.einsum("bchw,cr->bhwr", unpacked.float(), weight) + bias
+        rgb = ((rgb.clamp(-1, 1) + 1) * 127.5).to(torch.uint8)
+        return rgb[0].cpu().numpy()
+
+
+def encode_preview(rgb, image_format=PREVIEW_FORMAT, quality=PREVIEW_QUALITY, max_size=PREVIEW_MAX_SIZE):
+    """Encode a preview array as a data URI thumbnail"""
+    image = Image.fromarray(rgb)
+    image.thumbnail((max_size, max_size))
+    pil_format, mime = PREVIEW_FORMATS[image_format]
+    buffered = io.BytesIO()
+    image.save(buffered, format=pil_format, quality=quality)
+    return f"data:{mime};base64,{base64.b64encode(buffered.getvalue()).decode()}"
+
+
+class ProgressReporter:
+    """
+    Step-end callback that queues progress events (with periodic previews) for a streaming job
+
+    Events are dicts: {"step", "total_steps", "elapsed"} plus "preview" (an RGB
+    array, encoded by the consumer) and "preview_ms" every `every` steps, and
+    "eta_seconds" once a step time is known: the remaining steps at the mean
+    measured step time (expected_step_seconds until two steps have run) plus
+    finish_seconds for decoding, encoding and upload.
+    """
+
+    def __init__(self, previewer, height, width, every=PREVIEW_EVERY_N_STEPS,
+                 max_step_fraction=PREVIEW_MAX_STEP_FRACTION, expected_step_seconds=None, finish_seconds=0.0):
+        self.previewer = previewer
+        self.height = height
+        self.width = width
+        self.every = every
+        self.max_step_fraction = max_step_fraction
+        self.events = queue.Queue()
+        self.started = time.perf_counter()
+        self.step_seconds = []
+        self.preview_seconds = []
+        self.expected_step_seconds = expected_step_seconds
+        self.finish_seconds = finish_seconds
+        self._last_sync = (0, self.started)
+        # Time of the first step end; steps before it include LoRA activation and text encoding
+        self._first_step = None
+
+    def __call__(self, pipeline, step, timestep, callback_kwargs):
+        done = step + 1
+        now = time.perf_counter()
+        event = {
+            "step": done,
+            "total_steps": pipeline.num_timesteps,
+            "elapsed": round(now - self.started, 3),
+        }
+        if self._first_step is None:
+            self._first_step = (done, now)
+        eta = self._eta(done, pipeline.num_timesteps, now)
+        if eta is not None:
+            event["eta_seconds"] = eta
+        if self.previewer and self.every and done % self.every == 0 and done < pipeline.num_timesteps:
+            event.update(self._preview(callback_kwargs["latents"], done))
+        self.events.put(event)
+        return callback_kwargs
+
+    def _eta(self, done, total_steps, now):
+        first_done, first_time = self._first_step
+        if done > first_done:
+            step_seconds = (now - first_time) / (done - first_done)
+        elif self.expected_step_seconds is not None:
+            step_seconds = self.expected_step_seconds
+        else:
+            return None
+        return round((total_steps - done) * step_seconds + self.finish_seconds, 2)
+
+    def _preview(self, latents, done):
+        # Wait for the queued steps first, so the step time is real and the preview cost is only the preview
+        if latents.is_cuda:
+            torch.cuda.synchronize()
+        synced = time.perf_counter()
+        last_step, last_synced = self._last_sync
+        self.step_seconds.append((synced - last_synced) / (done - last_step))
+
+        rgb = self.previewer.preview(latents, self.height, self.width)
+        finished = time.perf_counter()
+        self.preview_seconds.append(finished - synced)
+        self._last_sync = (done, finished)
+
+        step = sum(self.step_seconds) / len(self.step_seconds)
+        cost = self.preview_seconds[-1]
+        if step and cost > self.max_step_fraction * step:
+            self.every *= 2
+            print(f"Preview took {cost / step:.0%} of a step, previewing every {self.every} steps")
+        return {"preview": rgb, "preview_ms": round(cost * 1000, 2)}
+
+    def finish(self):
+        """Signal the consumer that generation is over"""
+        self.events.put(None)
+
+    def stats(self):
+        step = sum(self.step_seconds) / len(self.step_seconds) if self.step_seconds else None
+        preview = sum(self.preview_seconds) / len(self.preview_seconds) if self.preview_seconds else None
+        return {
+            "previews": len(self.preview_seconds),
+            "preview_ms_mean": round(preview * 1000, 2) if preview is not None else None,
+            "step_ms_mean": round(step * 1000, 2) if step is not None else None,
+            "preview_step_fraction": round(preview / step, 4) if preview and step else None,
+            "preview_every": self.every,
+        }
@@ -0,0 +1,227 @@
+"""
+LRU cache of Flux text-encoder outputs (prompt_embeds / pooled_prompt_embeds)
+
+Our traffic repeats a small set of templated prompts, so the CLIP and T5
+encoders are only run on a miss. Entries are keyed by the prompt text plus
+the identity of the encoders (model, dtype, sequence length, the fused or
+quantized checkpoint their weights come from and any LoRA applied to them). An optional on-disk tier keeps embeddings across worker
+restarts, and T5 can be kept on the CPU and moved to the accelerator only
+for misses.
+"""
+
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+
+import torch
+from safetensors.torch import load_file, save_file
+
+
+PROMPT_CACHE_SIZE = int(os.environ.get("PROMPT_CACHE_SIZE", "128"))
+PROMPT_CACHE_DIR = os.environ.get("PROMPT_CACHE_DIR") or None
+PROMPT_CACHE_DISK_MAX_ENTRIES = int(os.environ.get("PROMPT_CACHE_DISK_MAX_ENTRIES", "4096"))
+# Keep T5-XXL off the accelerator and bring it in only on a cache miss
+T5_OFFLOAD = os.environ.get("T5_OFFLOAD", "0") == "1"
+
+
+def encoder_identity(pipe, max_sequence_length, fused=None, quantized=None):
+    """
+    Describe the text encoders so embeddings from different models never collide
+
+    Args:
+        pipe: Flux pipeline whose encoders produce the embeddings
+        max_sequence_length: T5 sequence length passed to encode_prompt
+        fused: Fused checkpoint manifest the pipeline was loaded with, or None
+        quantized: Quantized checkpoint manifest the pipeline was loaded with, or None
+    """
+    parts = [f"max_sequence_length={max_sequence_length}"]
+    for name in ("text_encoder", "text_encoder_2"):
+        encoder = getattr(pipe, name)
+        parts.append(f"{name}={getattr(encoder.config, '_name_or_path', '')}:{encoder.dtype}")
+        # Rebuilt weights under the same model name must not be served old embeddings from disk
+        if fused and name in fused["components"]:
+            manifest = json.dumps({key: value for key, value in fused.items() if key != "path"}, sort_keys=True)
+            parts.append(f"{name}.fused={hashlib.sha256(manifest.encode()).hexdigest()}")
+        if quantized and name in quantized["components"]:
+            parts.append(f"{name}.quantized={quantized['components'][name]['mode']}")
+    return parts
+
+
+class PromptEmbeddingCache:
+    """Memory (and optional disk) LRU cache of prompt embeddings"""
+
+    def __init__(self, pipe, max_entries=PROMPT_CACHE_SIZE, cache_dir=PROMPT_CACHE_DIR,
+                 offload_t5=T5_OFFLOAD, max_sequence_length=512, device=None, fused=None, quantized=None):
+        """
+        Initialize the cache
+
+        Args:
+            pipe: Flux pipeline whose encoders produce the embeddings
+            max_entries: Number of prompts kept in host memory
+            cache_dir: Directory for the on-disk tier (disabled when None)
+            offload_t5: Keep text_encoder_2 (T5) on the CPU between misses
+            max_sequence_length: T5 sequence length passed to encode_prompt
+            device: Device the pipeline runs on (defaults to pipe.device)
+            fused: Fused checkpoint manifest the pipeline was loaded with, or None
+            quantized: Quantized checkpoint manifest the pipeline was loaded with, or None
+        """
+        self.pipe = pipe
+        self.max_entries = max_entries
+        self.cache_dir = cache_dir
+        self.offload_t5 = offload_t5
+        self.max_sequence_length = max_sequence_length
+        self.device = device if device is not None else pipe.device
+        self.identity = encoder_identity(pipe, max_sequence_length, fused=fused, quantized=quantized)
+        self.lock = threading.Lock()
+        self._entries = OrderedDict()
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.encode_seconds = 0.0
+        self.lookup_seconds = 0.0
+
+        if cache_dir:
+            os.makedirs(cache_dir, exist_ok=True)
+        if offload_t5:
+            print("Keeping T5 text encoder on CPU (moved to the accelerator only on cache misses)")
+            pipe.text_encoder_2.to("cpu")
+            if torch.cuda.is_available():
+                torch.cuda.empty_cache()
+
+    def key_for(self, prompt, extra_identity=None):
+        payload = json.dumps([self.identity, extra_identity, prompt], default=str)
+        return hashlib.sha256(payload.encode()).hexdigest()
+
+    def encode(self, prompts, extra_identity=None):
+        """
+        Return embeddings for a list of prompts, one row per prompt
+
+        Repeated prompts in the list are looked up once. Pass the result to the
+        pipeline with num_images_per_prompt=1.
+
+        Args:
+            prompts: List of prompt strings (repeat a prompt once per image)
+            extra_identity: Anything else the encoder output depends on (e.g. an
+                active LoRA that patches the text encoders)
+
+        Returns:
+            tuple: (prompt_embeds, pooled_prompt_embeds) on the pipeline device
+        """
+        unique = {}
+        for prompt in prompts:
+            if prompt not in unique:
+                unique[prompt] = self._get(prompt, extra_identity)
+
+        prompt_embeds = torch.cat([unique[prompt][0] for prompt in prompts])
+        pooled_prompt_embeds = torch.cat([unique[prompt][1] for prompt in prompts])
+        return prompt_embeds.to(self.device), pooled_prompt_embeds.to(self.device)
+
+    def _get(self, prompt, extra_identity):
+        key = self.key_for(prompt, extra_identity)
+        start = time.perf_counter()
+        with self.lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                self.lookup_seconds += time.perf_counter() - start
+                return entry
+
+        entry = self._load_from_disk(key)
+        if entry is not None:
+            with self.lock:
+                self.disk_hits += 1
+                self.lookup_seconds += time.perf_counter() - start
+        else:
+            entry = self._run_encoders(prompt)
+            with self.lock:
+                self.misses += 1
+                self.encode_seconds += time.perf_counter() - start
+            self._save_to_disk(key, entry)
+
+        with self.lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return entry
+
+    def _run_encoders(self, prompt):
+        """Run CLIP and T5 on a single prompt and keep the result on the CPU"""
+        text_encoder_2 = self.pipe.text_encoder_2
+        if self.offload_t5:
+            text_encoder_2.to(self.device)
+        try:
+            with torch.no_grad():
+                prompt_embeds, pooled_prompt_embeds, _ = self.pipe.encode_prompt(
+                    prompt=prompt,
+                    prompt_2=None,
+                    device=self.device,
+                    num_images_per_prompt=1,
+                    max_sequence_length=self.max_sequence_length
+                )
+        finally:
+            if self.offload_t5:
+                text_encoder_2.to("cpu")
+        return prompt_embeds.cpu(), pooled_prompt_embeds.cpu()
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, f"{key}.safetensors")
+
+    def _load_from_disk(self, key):
+        if not self.cache_dir:
+            return None
+        path = self._path(key)
+        try:
+            tensors = load_file(path)
+            os.utime(path)
+        except (FileNotFoundError, OSError):
+            return None
+        except Exception as e:
+            print(f"Ignoring unreadable prompt cache entry {path}: {e}")
+            return None
+        return tensors["prompt_embeds"], tensors["pooled_prompt_embeds"]
+
+    def _save_to_disk(self, key, entry):
+        if not self.cache_dir:
+            return
+        path = self._path(key)
+        tmp_path = f"{path}.tmp{threading.get_ident()}"
+        try:
+            save_file({
+                "prompt_embeds": entry[0].contiguous(),
+                "pooled_prompt_embeds": entry[1].contiguous(),
+            }, tmp_path)
+            os.replace(tmp_path, path)
+            self._trim_disk()
+        except OSError as e:
+            print(f"Could not write prompt cache entry {path}: {e}")
+
+    def _trim_disk(self):
+        """Drop the least recently used files once the disk tier is over its entry limit"""
+        names = [name for name in os.listdir(self.cache_dir) if name.endswith(".safetensors")]
+        if len(names) <= PROMPT_CACHE_DISK_MAX_ENTRIES:
+            return
+        paths = sorted((os.path.join(self.cache_dir, name) for name in names), key=os.path.getmtime)
+        for path in paths[:len(paths) - PROMPT_CACHE_DISK_MAX_ENTRIES]:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    def stats(self):
+        """Hit rate and the encoder time saved by hits"""
+        lookups = self.hits + self.disk_hits + self.misses
+        mean_encode = self.encode_seconds / self.misses if self.misses else 0.0
+        return {
+            "entries": len(self._entries),
+            "hits": self.hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "hit_rate": (self.hits + self.disk_hits) / lookups if lookups else 0.0,
+            "encode_seconds": self.encode_seconds,
+            "seconds_saved": max(0.0, mean_encode * (self.hits + self.disk_hits) - self.lookup_seconds),
+        }
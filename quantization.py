@@ -0,0 +1,262 @@
+"""
+Weight-only int8/int4 quantization of the transformer and T5 encoder, baked at build time
+
+FLUX.1-dev's transformer (12B parameters) and T5-XXL (4.7B) make up most of
+the image and of the bytes read at startup. download_weights.py can replace
+the nn.Linear layers of their blocks with QuantizedLinear layers and save the
+quantized state dicts next to a manifest:
+
+    int8  one int8 per weight and one scale per output row (about half of bf16)
+    int4  two 4-bit weights per byte and one scale per `group_size` inputs of a
+          row (about a quarter of bf16 plus the scales)
+
+Both are symmetric round-to-nearest. Activations stay in the pipeline dtype:
+each layer dequantizes its weight right before the matmul, so the saving is in
+resident and on-disk weight bytes, paid for with the dequantization per call.
+Embedders, norms and output projections stay unquantized.
+
+The worker never quantizes. It builds the model on the meta device, swaps in
+QuantizedLinear skeletons and assigns the memory-mapped safetensors tensors
+(load_state_dict(assign=True)). QuantizedLinear subclasses nn.Linear, so PEFT
+wraps it like any linear layer and LoRA adapters (the uncensored LoRA, custom
+faces LoRAs) run unquantized on top of it.
+"""
+
+import os
+
+import torch
+import torch.nn as nn
+import torch.nn.functional as F
+from accelerate import init_empty_weights
+from safetensors.torch import load_file, save_file
+
+
+# Inputs of a weight row sharing one int4 scale
+QUANTIZE_GROUP_SIZE = int(os.environ.get("QUANTIZE_GROUP_SIZE", "64"))
+
+QUANTIZATION_MODES = {"int8": 8, "int4": 4}
+# Submodules whose linear layers are quantized, per pipeline component
+QUANTIZED_BLOCKS = {
+    "transformer": ["transformer_blocks", "single_transformer_blocks"],
+    "text_encoder_2": ["encoder.block"],
+}
+WEIGHTS_FILE = "model.safetensors"
+
+
+def quantize_weight(weight, bits, group_size=QUANTIZE_GROUP_SIZE):
+    """
+    Quantize a [out_features, in_features] weight
+
+    Returns:
+        tuple: (int8 tensor, [out, in] for int8 or [out, in / 2] packed int4;
+        float32 scales, [out, 1] for int8 or [out, in / group_size, 1] for int4)
+    """
+    weight = weight.detach().float()
+    out_features, in_features = weight.shape
+    if bits == 8:
+        scale = weight.abs().amax(dim=1, keepdim=True).clamp(min=1e-12) / 127
+        return torch.round(weight / scale).clamp(-127, 127).to(torch.int8), scale
+    groups = weight.reshape(out_features, in_features // group_size, group_size)
+    scale = groups.abs().amax(dim=2, keepdim=True).clamp(min=1e-12) / 7
+    values = torch.round(groups / scale).clamp(-8, 7).to(torch.int8).reshape(out_features, in_features)
+    # Even columns in the low nibble, odd columns in the high one (two's complement)
+    return (values[:, 0::2] & 0x0F) | (values[:, 1::2] << 4), scale
+
+
+def unpack_int4(packed):
+    """Sign-extended int8 values of packed int4 weights, [out, in / 2] -> [out, in]"""
+    low = (packed << 4) >> 4
+    high = packed >> 4
+    return torch.stack((low, high), dim=-1).reshape(packed.shape[0], -1)
+
+
+def quantizable(module, bits, group_size=QUANTIZE_GROUP_SIZE):
+    """Whether a layer is a plain linear layer whose shape the mode can pack"""
+    if type(module) is not nn.Linear:
+        return False
+    return bits == 8 or (module.in_features % group_size == 0 and group_size % 2 == 0)
+
+
+class QuantizedLinear(nn.Linear):
+    """nn.Linear holding int8 or packed int4 weights with per-row or per-group scales"""
+
+    def __init__(self, in_features, out_features, bias=True, bits=8, group_size=QUANTIZE_GROUP_SIZE,
+                 device=None, dtype=None):
+        # nn.Linear.__init__ would allocate a float weight
+        nn.Module.__init__(self)
+        if bits not in QUANTIZATION_MODES.values():
+            raise ValueError(f"Unsupported bit width {bits}")
+        self.in_features = in_features
+        self.out_features = out_features
+        self.bits = bits
+        self.group_size = group_size if bits == 4 else None
+        if bits == 8:
+            weight_shape, scale_shape = (out_features, in_features), (out_features, 1)
+        else:
+            weight_shape, scale_shape = (out_features, in_features // 2), (out_features, in_features // group_size, 1)
+        # Named "weight" like the layer it replaces, so state dict keys and int8 dtype checks carry over
+        self.register_buffer("weight", torch.empty(weight_shape, dtype=torch.int8, device=device))
+        self.register_buffer("weight_scale", torch.empty(scale_shape, dtype=dtype, device=device))
+        if bias:
+            self.bias = nn.Parameter(torch.empty(out_features, dtype=dtype, device=device), requires_grad=False)
+        else:
+            self.register_parameter("bias", None)
+
+    @classmethod
+    def from_linear(cls, linear, bits, group_size=QUANTIZE_GROUP_SIZE):
+        """Quantize a float nn.Linear (scales and bias keep its dtype)"""
+        dtype = linear.weight.dtype
+        layer = cls(linear.in_features, linear.out_features, bias=linear.bias is not None, bits=bits,
+                    group_size=group_size, device=linear.weight.device, dtype=dtype)
+        weight, scale = quantize_weight(linear.weight, bits, group_size)
+        layer.weight.copy_(weight)
+        layer.weight_scale.copy_(scale.to(dtype))
+        if linear.bias is not None:
+            layer.bias.data.copy_(linear.bias.data)
+        return layer
+
+    def dequantize(self, dtype=None):
+        """The float weight, [out_features, in_features]"""
+        dtype = dtype or self.weight_scale.dtype
+        if self.bits == 8:
+            return self.weight.to(dtype) * self.weight_scale.to(dtype)
+        values = unpack_int4(self.weight).to(dtype)
+        groups = values.reshape(self.out_features, -1, self.group_size) * self.weight_scale.to(dtype)
+        return groups.reshape(self.out_features, self.in_features)
+
+    def forward(self, input):
+        bias = self.bias.to(input.dtype) if self.bias is not None else None
+        return F.linear(input, self.dequantize(input.dtype), bias)
+
+    def extra_repr(self):
+        group = f", group_size={self.group_size}" if self.group_size else ""
+        return f"in_features={self.in_features}, out_features={self.out_features}, bias={self.bias is not None}, " \
+               f"bits={self.bits}{group}"
+
+
+def quantize_model(model, blocks, bits, group_size=QUANTIZE_GROUP_SIZE, skeleton=False):
+    """
+    Replace the linear layers under the given submodules with QuantizedLinear, in place
+
+    Args:
+        model: Transformer or text encoder
+        blocks: Dotted names of the submodules to quantize (e.g. "transformer_blocks")
+        bits: 8 or 4
+        group_size: Inputs per int4 scale
+        skeleton: Create empty layers on the meta device instead of quantizing (to load a checkpoint into)
+
+    Returns:
+        int: Number of layers replaced
+    """
+    replaced = 0
+    for block in blocks:
+        root = model.get_submodule(block)
+        targets = [(name, module) for name, module in root.named_modules() if quantizable(module, bits, group_size)]
+        for name, linear in targets:
+            parent_name, _, child = name.rpartition(".")
+            parent = root.get_submodule(parent_name) if parent_name else root
+            if skeleton:
+                layer = QuantizedLinear(linear.in_features, linear.out_features, bias=linear.bias is not None,
+                                        bits=bits, group_size=group_size, device="meta", dtype=linear.weight.dtype)
+            else:
+                layer = QuantizedLinear.from_linear(linear, bits, group_size)
+            setattr(parent, child, layer)
+            replaced += 1
+    return replaced
+
+
+def save_quantized(model, output_dir, name, mode, group_size=QUANTIZE_GROUP_SIZE):
+    """
+    Quantize a pipeline component in place and save its config and quantized weights
+
+    Returns:
+        dict: The component's manifest entry
+    """
+    bits = QUANTIZATION_MODES[mode]
+    blocks = QUANTIZED_BLOCKS[name]
+    layers = quantize_model(model, blocks, bits, group_size)
+    os.makedirs(output_dir, exist_ok=True)
+    if hasattr(model, "save_config"):
+        model.save_config(output_dir)
+    else:
+        model.config.save_pretrained(output_dir)
+
+    # Tied weights (T5's shared embedding) are stored once and re-pointed on load
+    state_dict = {}
+    aliases = {}
+    stored = {}
+    for key, tensor in model.state_dict().items():
+        identity = (tensor.data_ptr(), tensor.shape, tensor.dtype)
+        if identity in stored:
+            aliases[key] = stored[identity]
+            continue
+        stored[identity] = key
+        state_dict[key] = tensor.contiguous()
+    path = os.path.join(output_dir, WEIGHTS_FILE)
+    save_file(state_dict, path, metadata={"format": "pt"})
+    return {
+        "mode": mode,
+        "bits": bits,
+        "group_size": group_size if bits == 4 else None,
+        "blocks": blocks,
+        "layers": layers,
+        "aliases": aliases,
+        "bytes": os.path.getsize(path),
+    }
+
+
+def load_quantized(model_class, component_dir, spec, dtype):
+    """
+    Load a quantized component without materializing or quantizing float weights
+
+    The model is built on the meta device, its layers are swapped for
+    QuantizedLinear skeletons, and the memory-mapped checkpoint tensors are
+    assigned in place.
+    """
+    if hasattr(model_class, "load_config"):
+        config = model_class.load_config(component_dir)
+        build = lambda: model_class.from_config(config)  # noqa: E731
+    else:
+        config = model_class.config_class.from_pretrained(component_dir)
+        build = lambda: model_class(config)  # noqa: E731
+    with init_empty_weights(include_buffers=False):
+        model = build()
+    quantize_model(model, spec["blocks"], spec["bits"], spec["group_size"] or QUANTIZE_GROUP_SIZE, skeleton=True)
+
+    state_dict = load_file(os.path.join(component_dir, WEIGHTS_FILE))
+    for alias, key in spec["aliases"].items():
+        state_dict[alias] = state_dict[key]
+    model.load_state_dict(state_dict, strict=True, assign=True)
+    if hasattr(model, "tie_weights"):
+        model.tie_weights()
+    # Only floating point tensors are cast, the quantized weights stay int8
+    return model.to(dtype=dtype).eval()
+
+
+def quantized_nbytes(model):
+    """Bytes of the quantized weights and their scales in a model"""
+    return sum(
+        module.weight.numel() + module.weight_scale.numel() * module.weight_scale.element_size()
+        for module in model.modules()
+        if isinstance(module, QuantizedLinear)
+    )
+
+
+def match_adapter_dtype(pipe, adapter_name):
+    """
+    Cast a loaded LoRA adapter on quantized layers to the pipeline dtype
+
+    PEFT creates adapters in float32 when the base layer's weight is not a
+    float tensor; this keeps them as small and fast as on float layers.
+    """
+    for component_name in QUANTIZED_BLOCKS:
+        component = getattr(pipe, component_name, None)
+        if component is None:
+            continue
+        for module in component.modules():
+            base_layer = module.get_base_layer() if hasattr(module, "get_base_layer") else None
+            if not isinstance(base_layer, QuantizedLinear) or not hasattr(module, "lora_A"):
+                continue
+            for layers in (module.lora_A, module.lora_B):
+                if adapter_name in layers:
+                    layers[adapter_name].to(dtype=base_layer.weight_scale.dtype)
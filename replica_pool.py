@@ -0,0 +1,444 @@
+"""
+Multi-replica worker: one pipeline process per device behind a local dispatcher
+
+With REPLICA_DEVICES set, the worker process does not load a pipeline itself.
+It starts one replica process per device, each running the regular handler
+with its own initialize_pipeline() (and so its own LoRA adapter cache, prompt
+cache and memory planner) and only its device visible, and routes jobs to
+them:
+
+- a waiting job goes to an idle replica that already has its custom LoRA
+  loaded; otherwise the oldest waiting job goes to the idle replica with the
+  fewest LoRAs loaded
+- only the first AFFINITY_WINDOW waiting jobs are considered for affinity, and
+  a job passed over AFFINITY_MAX_SKIPS times is dispatched next regardless, so
+  a LoRA nobody has loaded never starves
+- a replica that exits fails the job it was running and is restarted after a
+  backoff, at most REPLICA_MAX_RESTARTS times
+
+Replicas are spawned (not forked), so CUDA is never initialized before the
+device is chosen. Each replica reports its loaded LoRAs with every result.
+
+The LoRA store, result cache and prompt cache disk tier keep their index in
+process memory, so each replica gets its own subdirectory and an equal share
+of their disk budgets. A LoRA requested on several replicas is downloaded
+once per replica; affinity dispatch keeps that rare.
+"""
+
+import os
+import threading
+import time
+import traceback
+from collections import deque
+from concurrent.futures import Future
+from multiprocessing import get_context
+from multiprocessing.connection import wait
+
+from lora_store import LORA_STORE_DIR, LORA_STORE_MAX_MB
+from result_cache import RESULT_CACHE_DIR, RESULT_CACHE_MAX_MB
+
+
+# Devices to run one replica on each: GPU indices ("0,1,2,3"), "cpu" entries, or "auto" for every GPU
+REPLICA_DEVICES = os.environ.get("REPLICA_DEVICES", "")
+# Jobs held by the dispatcher beyond one per replica (RunPod concurrency is replicas + this)
+REPLICA_QUEUE_DEPTH = int(os.environ.get("REPLICA_QUEUE_DEPTH", "4"))
+REPLICA_MAX_RESTARTS = int(os.environ.get("REPLICA_MAX_RESTARTS", "5"))
+# First restart delay in seconds, doubled on every further restart (capped at a minute)
+REPLICA_RESTART_BACKOFF = float(os.environ.get("REPLICA_RESTART_BACKOFF", "1.0"))
+AFFINITY_WINDOW = int(os.environ.get("AFFINITY_WINDOW", "8"))
+AFFINITY_MAX_SKIPS = int(os.environ.get("AFFINITY_MAX_SKIPS", "4"))
+
+# On-disk stores whose index and LRU live in process memory; every replica gets its own subdirectory
+REPLICA_STORE_DIRS = {
+    "LORA_STORE_DIR": LORA_STORE_DIR,
+    "RESULT_CACHE_DIR": RESULT_CACHE_DIR,
+    "PROMPT_CACHE_DIR": os.environ.get("PROMPT_CACHE_DIR") or None,
+}
+# Disk budgets of those stores, split evenly between the replicas so the total stays as configured
+REPLICA_STORE_BUDGETS = {
+    "LORA_STORE_MAX_MB": LORA_STORE_MAX_MB,
+    "RESULT_CACHE_MAX_MB": RESULT_CACHE_MAX_MB,
+    "PROMPT_CACHE_DISK_MAX_ENTRIES": int(os.environ.get("PROMPT_CACHE_DISK_MAX_ENTRIES", "4096")),
+}
+
+
+class ReplicaError(RuntimeError):
+    """A replica exited while running a job, or no replica is left to run it"""
+
+
+def replica_devices(spec=REPLICA_DEVICES):
+    """Parse REPLICA_DEVICES into a list of devices ("0", "1", ... or "cpu")"""
+    if spec.strip() == "auto":
+        import torch
+        return [str(index) for index in range(torch.cuda.device_count())] or ["cpu"]
+    return [device.strip() for device in spec.split(",") if device.strip()]
+
+
+def replica_env(index, device, devices):
+    """Environment of one replica process: its device only, a share of the CPU threads and disk budgets, its own metrics file and stores"""
+    env = {"REPLICA_INDEX": str(index)}
+    if device == "cpu":
+        env["CUDA_VISIBLE_DEVICES"] = ""
+        threads = str(max(1, (os.cpu_count() or 1) // devices.count("cpu")))
+        env["OMP_NUM_THREADS"] = threads
+        env["MKL_NUM_THREADS"] = threads
+    else:
+        env["CUDA_VISIBLE_DEVICES"] = device
+    if os.environ.get("METRICS_FILE"):
+        root, ext = os.path.splitext(os.environ["METRICS_FILE"])
+        env["METRICS_FILE"] = f"{root}.replica{index}{ext}"
+    for name, directory in REPLICA_STORE_DIRS.items():
+        if directory:
+            env[name] = os.path.join(directory, f"replica{index}")
+    for name, budget in REPLICA_STORE_BUDGETS.items():
+        share = budget / len(devices)
+        env[name] = str(int(share) if isinstance(budget, int) else share)
+    return env
+
+
+def replica_main(conn, setup, handle, loaded):
+    """
+    Replica process: load the pipeline, then run jobs from the dispatcher until told to stop
+
+    Args:
+        conn: Connection to the dispatcher
+        setup: Callable loading the pipeline (e.g. handler.initialize_pipeline)
+        handle: Callable running one job and returning its result (e.g. handler.generate_image)
+        loaded: Callable returning the LoRA keys currently loaded
+    """
+    try:
+        setup()
+    except Exception:
+        traceback.print_exc()
+        raise SystemExit(1)
+    conn.send(("ready", loaded()))
+    while True:
+        try:
+            job = conn.recv()
+        except EOFError:
+            return
+        if job is None:
+            return
+        try:
+            result = handle(job)
+        except Exception as e:
+            traceback.print_exc()
+            result = {"error": str(e)}
+        conn.send(("result", result, loaded()))
+
+
+class _Job:
+    """A job waiting for or running on a replica"""
+
+    __slots__ = ("job", "key", "future", "skips", "submitted")
+
+    def __init__(self, job, key, future):
+        self.job = job
+        self.key = key
+        self.future = future
+        self.skips = 0
+        self.submitted = time.perf_counter()
+
+
+class _Replica:
+    """Process, connection and dispatch state of one device"""
+
+    def __init__(self, index, device):
+        self.index = index
+        self.device = device
+        self.process = None
+        self.conn = None
+        self.ready = False
+        self.current = None
+        self.loaded = set()
+        self.restarts = 0
+        self.restart_at = None
+        self.failed = False
+        self.jobs = 0
+        self.affinity_hits = 0
+
+    def has(self, key):
+        return key is None or key in self.loaded
+
+
+class ReplicaPool:
+    """Runs one replica process per device and dispatches jobs to them with LoRA affinity"""
+
+    def __init__(self, devices, setup, handle, loaded, affinity=True, affinity_window=AFFINITY_WINDOW,
+                 max_skips=AFFINITY_MAX_SKIPS, max_restarts=REPLICA_MAX_RESTARTS,
+                 restart_backoff=REPLICA_RESTART_BACKOFF, queue_depth=REPLICA_QUEUE_DEPTH, registry=None):
+        """
+        Initialize the pool
+
+        Args:
+            devices: One device per replica ("0", "1", ... or "cpu")
+            setup: Picklable callable loading the pipeline in a replica
+            handle: Picklable callable running one job in a replica
+            loaded: Picklable callable returning a replica's loaded LoRA keys
+            affinity: Route by loaded LoRA (False = oldest job to the first idle replica)
+            affinity_window: Waiting jobs considered for an affinity match
+            max_skips: Times a job may be passed over before it is dispatched next
+            max_restarts: Restarts per replica before it is given up
+            restart_backoff: First restart delay in seconds
+            queue_depth: Jobs held beyond one per replica (see concurrency)
+            registry: Optional MetricsRegistry for dispatch counters
+        """
+        if not devices:
+            raise ValueError("No replica devices configured")
+        self.replicas = [_Replica(index, device) for index, device in enumerate(devices)]
+        self.setup = setup
+        self.handle = handle
+        self.loaded = loaded
+        self.affinity = affinity
+        self.affinity_window = affinity_window
+        self.max_skips = max_skips
+        self.max_restarts = max_restarts
+        self.restart_backoff = restart_backoff
+        self.queue_depth = queue_depth
+        self.registry = registry
+        self._context = get_context("spawn")
+        self._pending = deque()
+        self._lock = threading.Lock()
+        self._wake_recv, self._wake_send = self._context.Pipe(duplex=False)
+        self._closed = False
+        self._thread = None
+
+    @property
+    def concurrency(self):
+        """Jobs the worker should accept at once: one per live replica plus the queue depth"""
+        return sum(1 for replica in self.replicas if not replica.failed) + self.queue_depth
+
+    def start(self):
+        """Spawn every replica and start the dispatcher thread"""
+        for replica in self.replicas:
+            self._spawn(replica)
+        self._thread = threading.Thread(target=self._run, name="dispatcher", daemon=True)
+        self._thread.start()
+        return self
+
+    def submit(self, job, key=None):
+        """
+        Queue a job for the next suitable replica
+
+        Args:
+            job: RunPod job ({"id", "input"}), passed to the replica's handle
+            key: LoRA the job activates (a loaded() key), or None
+
+        Returns:
+            Future: The handler result, or ReplicaError if the replica running it exited
+        """
+        future = Future()
+        with self._lock:
+            if self._closed:
+                raise RuntimeError("Replica pool is shut down")
+            if all(replica.failed for replica in self.replicas):
+                future.set_exception(ReplicaError("Every replica has failed"))
+                return future
+            self._pending.append(_Job(job, key, future))
+        self._wake()
+        return future
+
+    def stats(self):
+        """Per-replica dispatch counters"""
+        return {
+            "pending": len(self._pending),
+            "replicas": [
+                {
+                    "index": replica.index,
+                    "device": replica.device,
+                    "ready": replica.ready,
+                    "busy": replica.current is not None,
+                    "jobs": replica.jobs,
+                    "affinity_hits": replica.affinity_hits,
+                    "loaded_loras": len(replica.loaded),
+                    "restarts": replica.restarts,
+                    "failed": replica.failed,
+                }
+                for replica in self.replicas
+            ],
+        }
+
+    def shutdown(self, timeout=30.0):
+        """Stop the dispatcher, let running jobs finish and stop every replica"""
+        with self._lock:
+            self._closed = True
+        self._wake()
+        if self._thread is not None:
+            self._thread.join()
+        for replica in self.replicas:
+            if replica.process is not None and replica.process.is_alive():
+                try:
+                    replica.conn.send(None)
+                except OSError:
+                    pass
+        deadline = time.monotonic() + timeout
+        for replica in self.replicas:
+            if replica.process is not None:
+                replica.process.join(max(0.0, deadline - time.monotonic()))
+                if replica.process.is_alive():
+                    replica.process.terminate()
+                    replica.process.join()
+
+    def _wake(self):
+        try:
+            self._wake_send.send_bytes(b"x")
+        except OSError:
+            pass
+
+    def _spawn(self, replica):
+        parent_conn, child_conn = self._context.Pipe()
+        process = self._context.Process(
+            target=replica_main,
+            args=(child_conn, self.setup, self.handle, self.loaded),
+            name=f"replica-{replica.index}",
+            daemon=True
+        )
+        # The spawned interpreter inherits the environment at start(), before it imports torch
+        env = replica_env(replica.index, replica.device, [r.device for r in self.replicas])
+        saved = {name: os.environ.get(name) for name in env}
+        os.environ.update(env)
+        try:
+            process.start()
+        finally:
+            for name, value in saved.items():
+                if value is None:
+                    os.environ.pop(name, None)
+                else:
+                    os.environ[name] = value
+        child_conn.close()
+        replica.process = process
+        replica.conn = parent_conn
+        replica.ready = False
+        replica.restart_at = None
+        print(f"Started replica {replica.index} on {replica.device} (pid {process.pid})")
+
+    def _run(self):
+        """Dispatcher loop: results, exits, restarts and dispatch, all on this thread"""
+        while True:
+            with self._lock:
+                if self._closed and not any(replica.current for replica in self.replicas):
+                    break
+            waitables = {self._wake_recv: None}
+            for replica in self.replicas:
+                if replica.process is not None:
+                    waitables[replica.conn] = replica
+                    waitables[replica.process.sentinel] = replica
+            restarts = [replica.restart_at for replica in self.replicas if replica.restart_at is not None]
+            timeout = max(0.0, min(restarts) - time.monotonic()) if restarts else None
+
+            ready = wait(list(waitables), timeout)
+            # Messages before exits, so a result sent just before a crash is kept
+            for obj in sorted(ready, key=lambda obj: isinstance(obj, int)):
+                replica = waitables[obj]
+                if replica is None:
+                    while self._wake_recv.poll():
+                        self._wake_recv.recv_bytes()
+                elif isinstance(obj, int):
+                    self._exited(replica)
+                elif replica.process is not None:
+                    self._receive(replica)
+
+            now = time.monotonic()
+            for replica in self.replicas:
+                if replica.restart_at is not None and replica.restart_at <= now and not self._closed:
+                    self._spawn(replica)
+            self._dispatch()
+        self._fail_pending(ReplicaError("Replica pool shut down"))
+
+    def _receive(self, replica):
+        try:
+            message = replica.conn.recv()
+        except (EOFError, OSError):
+            # The exit is handled through the process sentinel
+            return
+        if message[0] == "ready":
+            replica.ready = True
+            replica.loaded = set(message[1])
+            print(f"Replica {replica.index} on {replica.device} is ready")
+        elif message[0] == "result":
+            job, replica.current = replica.current, None
+            replica.loaded = set(message[2])
+            if job is not None:
+                job.future.set_result(message[1])
+
+    def _exited(self, replica):
+        code = replica.process.exitcode
+        replica.conn.close()
+        replica.process = None
+        replica.conn = None
+        replica.ready = False
+        job, replica.current = replica.current, None
+        replica.loaded = set()
+        if job is not None:
+            job.future.set_exception(ReplicaError(
+                f"Replica {replica.index} on {replica.device} exited with code {code} while running this job"
+            ))
+        if self._closed:
+            return
+        if replica.restarts >= self.max_restarts:
+            replica.failed = True
+            print(f"Replica {replica.index} on {replica.device} exited with code {code}, "
+                  f"giving up after {replica.restarts} restarts")
+            if all(r.failed for r in self.replicas):
+                self._fail_pending(ReplicaError("Every replica has failed"))
+            return
+        delay = min(60.0, self.restart_backoff * 2 ** replica.restarts)
+        replica.restarts += 1
+        replica.restart_at = time.monotonic() + delay
+        print(f"Replica {replica.index} on {replica.device} exited with code {code}, restarting in {delay:.1f}s")
+        if self.registry is not None:
+            self.registry.inc("replica_restarts_total", "Replica processes restarted after exiting",
+                              replica=str(replica.index))
+
+    def _fail_pending(self, error):
+        with self._lock:
+            jobs = list(self._pending)
+            self._pending.clear()
+        for job in jobs:
+            job.future.set_exception(error)
+
+    def _dispatch(self):
+        """Hand waiting jobs to idle replicas until either runs out"""
+        while True:
+            idle = [replica for replica in self.replicas if replica.ready and replica.current is None]
+            with self._lock:
+                if not idle or not self._pending:
+                    return
+                job, replica = self._choose(idle)
+                self._pending.remove(job)
+            self._send(job, replica)
+
+    def _choose(self, idle):
+        """Pick the next (job, replica) pair among the waiting jobs and idle replicas"""
+        oldest = self._pending[0]
+        if self.affinity and oldest.skips < self.max_skips:
+            for position, job in enumerate(self._pending):
+                if position >= self.affinity_window:
+                    break
+                matches = [replica for replica in idle if replica.has(job.key)]
+                if matches:
+                    for skipped in list(self._pending)[:position]:
+                        skipped.skips += 1
+                    return job, min(matches, key=lambda replica: len(replica.loaded))
+        if not self.affinity:
+            return oldest, idle[0]
+        matches = [replica for replica in idle if replica.has(oldest.key)]
+        return oldest, min(matches or idle, key=lambda replica: len(replica.loaded))
+
+    def _send(self, job, replica):
+        hit = job.key is not None and job.key in replica.loaded
+        try:
+            replica.conn.send(job.job)
+        except OSError:
+            # The replica is exiting; the job waits for the next one
+            with self._lock:
+                self._pending.appendleft(job)
+            replica.ready = False
+            return
+        replica.current = job
+        replica.jobs += 1
+        replica.affinity_hits += hit
+        if self.registry is not None:
+            affinity = "none" if job.key is None else ("hit" if hit else "miss")
+            self.registry.inc("replica_jobs_total", "Jobs dispatched to replicas, by replica and LoRA affinity",
+                              replica=str(replica.index), affinity=affinity)
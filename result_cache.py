@@ -0,0 +1,217 @@
+"""
+Content-addressed cache of finished job outputs, with in-flight deduplication
+
+With a fixed seed, a job's images are fully determined by the prompt, the
+generation parameters, the loaded models and LoRAs, and the output encoding.
+Jobs are keyed by a SHA-256 of a canonical JSON of those inputs. The encoded
+images are kept on local disk under a size budget with LRU eviction, together
+with the S3 object keys they were uploaded to, so a repeat returns the
+existing URLs without generating or uploading again.
+
+Concurrent identical jobs are collapsed: the first one generates, the others
+wait for it and are then served from the cache.
+"""
+
+import hashlib
+import json
+import os
+import shutil
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+
+
+RESULT_CACHE_ENABLED = os.environ.get("RESULT_CACHE_ENABLED", "1") == "1"
+RESULT_CACHE_DIR = os.environ.get("RESULT_CACHE_DIR", "/tmp/flux-result-cache")
+RESULT_CACHE_MAX_MB = float(os.environ.get("RESULT_CACHE_MAX_MB", "1024"))
+
+META_FILE = "meta.json"
+
+
+def result_key(identity):
+    """SHA-256 of the canonical JSON of a job's identity"""
+    payload = json.dumps(identity, sort_keys=True, separators=(",", ":"), default=str)
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+class ResultCache:
+    """Disk LRU of encoded job outputs, bounded by total size"""
+
+    def __init__(self, cache_dir=RESULT_CACHE_DIR, max_bytes=None):
+        """
+        Initialize the cache, indexing entries already on disk
+
+        Args:
+            cache_dir: Directory holding one subdirectory per cached job
+            max_bytes: Size budget (defaults to RESULT_CACHE_MAX_MB)
+        """
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes if max_bytes is not None else int(RESULT_CACHE_MAX_MB * 1024 * 1024)
+        self.lock = threading.Lock()
+        self._entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        os.makedirs(cache_dir, exist_ok=True)
+        existing = []
+        for key in os.listdir(cache_dir):
+            meta_path = os.path.join(cache_dir, key, META_FILE)
+            try:
+                with open(meta_path) as f:
+                    meta = json.load(f)
+                existing.append((os.path.getmtime(meta_path), key, meta["bytes"]))
+            except (OSError, ValueError, KeyError):
+                # Partially written or foreign directory
+                shutil.rmtree(os.path.join(cache_dir, key), ignore_errors=True)
+        for _, key, size in sorted(existing):
+            self._entries[key] = size
+        self._evict()
+
+    @property
+    def total_bytes(self):
+        return sum(self._entries.values())
+
+    def _dir(self, key):
+        return os.path.join(self.cache_dir, key)
+
+    def get(self, key):
+        """
+        Look up a job
+
+        Returns:
+            dict or None: The entry's metadata plus "images" (list of bytes)
+        """
+        with self.lock:
+            if key not in self._entries:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+        try:
+            meta_path = os.path.join(self._dir(key), META_FILE)
+            with open(meta_path) as f:
+                meta = json.load(f)
+            images = []
+            for name in meta["files"]:
+                with open(os.path.join(self._dir(key), name), "rb") as f:
+                    images.append(f.read())
+            os.utime(meta_path)
+        except (OSError, ValueError, KeyError) as e:
+            print(f"Dropping unreadable result cache entry {key}: {e}")
+            self._remove(key)
+            with self.lock:
+                self.misses += 1
+            return None
+        with self.lock:
+            self.hits += 1
+        meta["images"] = images
+        return meta
+
+    def put(self, key, images, extension, seed, s3=None):
+        """
+        Store a job's encoded images
+
+        Args:
+            key: result_key of the job
+            images: Encoded image bytes, in order
+            extension: File extension of the images
+            seed: Seed the images were generated with
+            s3: Optional {"bucket", "region", "endpoint_url", "keys"} the images were uploaded to
+        """
+        size = sum(len(image) for image in images)
+        if size > self.max_bytes:
+            return
+        tmp_dir = f"{self._dir(key)}.tmp{threading.get_ident()}"
+        try:
+            os.makedirs(tmp_dir, exist_ok=True)
+            files = []
+            for idx, image in enumerate(images):
+                name = f"{idx}.{extension}"
+                with open(os.path.join(tmp_dir, name), "wb") as f:
+                    f.write(image)
+                files.append(name)
+            meta = {"seed": seed, "files": files, "bytes": size, "s3": s3, "created": time.time()}
+            with open(os.path.join(tmp_dir, META_FILE), "w") as f:
+                json.dump(meta, f)
+            shutil.rmtree(self._dir(key), ignore_errors=True)
+            os.replace(tmp_dir, self._dir(key))
+        except OSError as e:
+            print(f"Could not write result cache entry {key}: {e}")
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+            return
+        with self.lock:
+            self._entries[key] = size
+            self._entries.move_to_end(key)
+        self._evict()
+
+    def record_s3(self, key, s3):
+        """Remember where an entry's images were uploaded (e.g. after re-uploading a hit)"""
+        meta_path = os.path.join(self._dir(key), META_FILE)
+        try:
+            with open(meta_path) as f:
+                meta = json.load(f)
+            meta["s3"] = s3
+            tmp_path = f"{meta_path}.tmp{threading.get_ident()}"
+            with open(tmp_path, "w") as f:
+                json.dump(meta, f)
+            os.replace(tmp_path, meta_path)
+        except (OSError, ValueError) as e:
+            print(f"Could not update result cache entry {key}: {e}")
+
+    def _remove(self, key):
+        with self.lock:
+            self._entries.pop(key, None)
+        shutil.rmtree(self._dir(key), ignore_errors=True)
+
+    def _evict(self):
+        """Drop least recently used entries until the cache fits its budget"""
+        while True:
+            with self.lock:
+                if self.total_bytes <= self.max_bytes or not self._entries:
+                    return
+                key = next(iter(self._entries))
+                self.evictions += 1
+            self._remove(key)
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "bytes": self.total_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+        }
+
+
+class InFlight:
+    """Tracks generations in progress so identical concurrent jobs share one"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self._futures = {}
+        self.collapsed = 0
+
+    def claim(self, key):
+        """
+        Register interest in a key
+
+        Returns:
+            tuple: (future, leader). The leader must call release(key) when done;
+            followers wait on the future and then read the cache.
+        """
+        with self.lock:
+            if key in self._futures:
+                self.collapsed += 1
+                return self._futures[key], False
+            future = Future()
+            self._futures[key] = future
+            return future, True
+
+    def release(self, key):
+        with self.lock:
+            future = self._futures.pop(key, None)
+        if future is not None:
+            future.set_result(None)
@@ -0,0 +1,118 @@
+"""
+Pool of reusable S3 clients keyed by credentials, region and endpoint
+
+Building a boto3 client per job pays for endpoint resolution, session setup
+and fresh TLS connections every time. Clients here are cached (with a TTL
+and a size limit) so steady-state jobs reuse warm connections, and large
+outputs are uploaded with concurrent multipart transfers.
+"""
+
+import hashlib
+import io
+import os
+import threading
+import time
+from collections import OrderedDict
+
+import boto3
+from boto3.s3.transfer import TransferConfig
+from botocore.config import Config
+
+
+S3_CLIENT_TTL_SECONDS = float(os.environ.get("S3_CLIENT_TTL_SECONDS", "900"))
+S3_CLIENT_POOL_SIZE = int(os.environ.get("S3_CLIENT_POOL_SIZE", "16"))
+S3_MAX_POOL_CONNECTIONS = int(os.environ.get("S3_MAX_POOL_CONNECTIONS", "32"))
+S3_MULTIPART_THRESHOLD_MB = float(os.environ.get("S3_MULTIPART_THRESHOLD_MB", "8"))
+S3_MULTIPART_CHUNK_MB = float(os.environ.get("S3_MULTIPART_CHUNK_MB", "8"))
+S3_TRANSFER_CONCURRENCY = int(os.environ.get("S3_TRANSFER_CONCURRENCY", "4"))
+
+CLIENT_CONFIG = Config(
+    max_pool_connections=S3_MAX_POOL_CONNECTIONS,
+    tcp_keepalive=True,
+    connect_timeout=5,
+    read_timeout=60,
+    retries={"max_attempts": 5, "mode": "adaptive"},
+)
+
+TRANSFER_CONFIG = TransferConfig(
+    multipart_threshold=int(S3_MULTIPART_THRESHOLD_MB * 1024 * 1024),
+    multipart_chunksize=int(S3_MULTIPART_CHUNK_MB * 1024 * 1024),
+    max_concurrency=S3_TRANSFER_CONCURRENCY,
+    use_threads=True,
+)
+
+
+class S3ClientPool:
+    """LRU pool of boto3 S3 clients with a time-to-live"""
+
+    def __init__(self, max_size=S3_CLIENT_POOL_SIZE, ttl_seconds=S3_CLIENT_TTL_SECONDS, config=CLIENT_CONFIG):
+        """
+        Initialize the pool
+
+        Args:
+            max_size: Maximum number of cached clients
+            ttl_seconds: Clients older than this are rebuilt on next use
+            config: botocore Config applied to every client
+        """
+        self.max_size = max_size
+        self.ttl_seconds = ttl_seconds
+        self.config = config
+        self.lock = threading.Lock()
+        self._clients = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, aws_access_key_id, aws_secret_access_key, region_name, endpoint_url=None):
+        """Return a cached client for these credentials, creating one if needed"""
+        # The secret is hashed so rotated credentials never reuse a stale client
+        secret_digest = hashlib.sha256(aws_secret_access_key.encode()).hexdigest()
+        key = (aws_access_key_id, secret_digest, region_name, endpoint_url)
+        now = time.monotonic()
+
+        with self.lock:
+            entry = self._clients.get(key)
+            if entry is not None and now - entry[1] < self.ttl_seconds:
+                self._clients.move_to_end(key)
+                self.hits += 1
+                return entry[0]
+
+            # boto3's default session is not thread-safe, so every client gets its own session
+            client = boto3.session.Session().client(
+                's3',
+                aws_access_key_id=aws_access_key_id,
+                aws_secret_access_key=aws_secret_access_key,
+                region_name=region_name,
+                endpoint_url=endpoint_url,
+                config=self.config
+            )
+            self.misses += 1
+            self._clients[key] = (client, now)
+            self._clients.move_to_end(key)
+            while len(self._clients) > self.max_size:
+                self._clients.popitem(last=False)
+            return client
+
+    def clear(self):
+        with self.lock:
+            self._clients.clear()
+
+
+def upload_bytes(s3_client, bucket, key, body, content_type, transfer_config=TRANSFER_CONFIG):
+    """Upload bytes with a single PUT, or a concurrent multipart transfer for large bodies"""
+    if len(body) >= transfer_config.multipart_threshold:
+        s3_client.upload_fileobj(
+            io.BytesIO(body),
+            bucket,
+            key,
+            ExtraArgs={"ContentType": content_type},
+            Config=transfer_config
+        )
+    else:
+        s3_client.put_object(Bucket=bucket, Key=key, Body=body, ContentType=content_type)
+
+
+def object_url(bucket, key, region, endpoint_url=None):
+    """Public URL of an uploaded object"""
+    if endpoint_url:
+        return f"{endpoint_url.rstrip('/')}/{bucket}/{key}"
+    return f"https://{bucket}.s3.{region}.amazonaws.com/{key}"
@@ -1,8 +1,47 @@
-INPUT_SCHEMA = {
+# Most items one batch job may carry
+MAX_BATCH_ITEMS = 64
+# Largest seed: seed + item index (or image offset) must still fit torch.Generator's signed 64-bit seed
+MAX_SEED = 2**63 - 1 - MAX_BATCH_ITEMS
+
+ITEM_SCHEMA = {
     "prompt": {
         "type": str,
         "required": True,
-        "description": "The main text prompt describing the desired image"
+        "description": "Text prompt of this item's image"
+    },
+    "seed": {
+        "type": int,
+        "required": False,
+        "default": None,
+        "description": "Random seed of this item (defaults to the job seed + item index, or random)",
+        "constraints": lambda x: 0 <= x <= MAX_SEED,
+        "allowed": f"0-{MAX_SEED}"
+    },
+    "custom_lora_scale": {
+        "type": float,
+        "required": False,
+        "default": None,
+        "description": "Adapter weight of the custom faces LoRA for this item (defaults to the job's)",
+        "constraints": lambda x: 0.0 <= x <= 2.0,
+        "allowed": "0.0-2.0"
+    }
+}
+
+INPUT_SCHEMA = {
+    "prompt": {
+        "type": str,
+        "required": False,
+        "default": None,
+        "description": "The main text prompt describing the desired image (required unless items are given)"
+    },
+    "items": {
+        "type": list,
+        "required": False,
+        "default": None,
+        "description": "Batch job: one image per item, each an object matching ITEM_SCHEMA",
+        "item_schema": ITEM_SCHEMA,
+        "constraints": lambda x: 1 <= len(x) <= MAX_BATCH_ITEMS,
+        "allowed": "1-64 items"
     },
     "negative_prompt": {
         "type": str,
@@ -15,41 +54,114 @@ INPUT_SCHEMA = {
         "required": False,
         "default": 1024,
         "description": "The height of the generated image in pixels",
-        "constraints": lambda x: 256 <= x <= 2048
+        "constraints": lambda x: 256 <= x <= 2048,
+        "allowed": "256-2048"
     },
     "width": {
         "type": int,
         "required": False,
         "default": 1024,
         "description": "The width of the generated image in pixels",
-        "constraints": lambda x: 256 <= x <= 2048
+        "constraints": lambda x: 256 <= x <= 2048,
+        "allowed": "256-2048"
     },
     "num_inference_steps": {
         "type": int,
         "required": False,
         "default": 28,
         "description": "Number of denoising steps",
-        "constraints": lambda x: 1 <= x <= 100
+        "constraints": lambda x: 1 <= x <= 100,
+        "allowed": "1-100"
     },
     "guidance_scale": {
         "type": float,
         "required": False,
         "default": 3.5,
         "description": "Classifier-Free Guidance scale",
-        "constraints": lambda x: 0.0 <= x <= 20.0
+        "constraints": lambda x: 0.0 <= x <= 20.0,
+        "allowed": "0.0-20.0"
     },
     "num_images": {
         "type": int,
         "required": False,
         "default": 1,
         "description": "Number of images to generate per prompt",
-        "constraints": lambda x: 1 <= x <= 4
+        "constraints": lambda x: 1 <= x <= 4,
+        "allowed": "1-4"
     },
     "seed": {
         "type": int,
         "required": False,
         "default": None,
-        "description": "Random seed for reproducibility"
+        "description": "Random seed for reproducibility",
+        "constraints": lambda x: 0 <= x <= MAX_SEED,
+        "allowed": f"0-{MAX_SEED}"
+    },
+    "fast_mode": {
+        "type": bool,
+        "required": False,
+        "default": False,
+        "description": "Skip transformer blocks on steps whose first-block output barely changed (faster, approximate)"
+    },
+    "fast_mode_threshold": {
+        "type": float,
+        "required": False,
+        "default": 0.08,
+        "description": "fast_mode: relative first-block change below which a step reuses the cached blocks",
+        "constraints": lambda x: 0.0 <= x <= 1.0,
+        "allowed": "0.0-1.0"
+    },
+    "output_format": {
+        "type": str,
+        "required": False,
+        "default": "png",
+        "description": "Encoding of the returned/uploaded images: png, webp or jpeg",
+        "constraints": lambda x: x in ("png", "webp", "jpeg"),
+        "allowed": "png, webp or jpeg"
+    },
+    "output_quality": {
+        "type": int,
+        "required": False,
+        "default": 90,
+        "description": "Quality for webp and jpeg outputs",
+        "constraints": lambda x: 1 <= x <= 100,
+        "allowed": "1-100"
+    },
+    "png_compress_level": {
+        "type": int,
+        "required": False,
+        "default": 6,
+        "description": "zlib compression level for png outputs (0 = fastest, 9 = smallest)",
+        "constraints": lambda x: 0 <= x <= 9,
+        "allowed": "0-9"
+    },
+    "return_mode": {
+        "type": str,
+        "required": False,
+        "default": "both",
+        "description": "inline (base64 only, no upload), s3_only (S3 URLs only) or both",
+        "constraints": lambda x: x in ("inline", "s3_only", "both"),
+        "allowed": "inline, s3_only or both"
+    },
+    "return_metrics": {
+        "type": bool,
+        "required": False,
+        "default": False,
+        "description": "Include per-stage timings and peak memory in the result"
+    },
+    "dry_run": {
+        "type": bool,
+        "required": False,
+        "default": False,
+        "description": "Return the predicted latency and memory plan of the job without generating"
+    },
+    "preview_every": {
+        "type": int,
+        "required": False,
+        "default": 4,
+        "description": "Streaming mode: stream a latent preview every N steps (0 = progress only)",
+        "constraints": lambda x: 0 <= x <= 100,
+        "allowed": "0-100"
     },
     "aws_access_key_id": {
         "type": str,
@@ -81,6 +193,12 @@ INPUT_SCHEMA = {
         "default": "runpods_custom_faces",
         "description": "S3 key prefix for uploaded images"
     },
+    "s3_endpoint_url": {
+        "type": str,
+        "required": False,
+        "default": None,
+        "description": "Custom S3-compatible endpoint URL (e.g. MinIO, R2 or a local stand-in)"
+    },
     "hf_token": {
         "type": str,
         "required": False,
@@ -98,6 +216,22 @@ INPUT_SCHEMA = {
         "required": False,
         "default": "lora.safetensors",
         "description": "Filename of the LoRA weights in the repository"
+    },
+    "custom_lora_revision": {
+        "type": str,
+        "required": False,
+        "default": None,
+        "description": "Git revision (branch, tag or commit) of the custom faces LoRA repository"
+    },
+    "custom_lora_scale": {
+        "type": float,
+        "required": False,
+        "default": 1.0,
+        "description": "Adapter weight applied to the custom faces LoRA",
+        "constraints": lambda x: 0.0 <= x <= 2.0,
+        "allowed": "0.0-2.0"
     }
 }
 
+
+
@@ -0,0 +1,385 @@
+"""
+Cold-start fast path for the Flux pipeline
+
+Components (transformer, both text encoders, VAE, tokenizers, scheduler) are
+loaded concurrently from the memory-mapped safetensors in the baked model
+cache, optionally fully offline, and every phase is timed so cold-start
+regressions show up in the worker logs.
+
+When download_weights.py baked the base model into BASE_MODEL_DIR, its
+weights manifest lists every file with its size and content hash. The worker
+then loads from that directory without any hub lookup, after checking that
+every listed file is present and complete. Components in the fused or
+quantized checkpoints are loaded from those instead.
+"""
+
+import functools
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+import accelerate.big_modeling
+import torch
+from diffusers import AutoencoderKL, FlowMatchEulerDiscreteScheduler, FluxPipeline, FluxTransformer2DModel
+from huggingface_hub import snapshot_download
+from transformers import CLIPTextModel, CLIPTokenizer, T5EncoderModel, T5TokenizerFast
+
+from hub_download import file_matches_etag
+from quantization import load_quantized
+
+
+BASE_MODEL_ID = "black-forest-labs/FLUX.1-dev"
+UNCENSORED_LORA_ID = "enhanceaiteam/Flux-uncensored"
+MODEL_CACHE_DIR = os.environ.get("MODEL_CACHE_DIR", "/workspace/models")
+# Where download_weights.py puts the uncensored LoRA
+UNCENSORED_LORA_DIR = os.path.join(MODEL_CACHE_DIR, "enhanceaiteam--Flux-uncensored")
+
+# Where download_weights.py puts the base model files, with a manifest of their sizes and hashes
+BASE_MODEL_DIR = os.path.join(MODEL_CACHE_DIR, "black-forest-labs--FLUX.1-dev")
+WEIGHTS_MANIFEST = "weights.json"
+# Weight variant to download and load, e.g. fp16 for *.fp16.safetensors (empty = the repository's default weights)
+MODEL_VARIANT = os.environ.get("MODEL_VARIANT") or None
+# Hash every manifest file at startup instead of only checking sizes (slow for tens of GB)
+VERIFY_WEIGHT_CHECKSUMS = os.environ.get("VERIFY_WEIGHT_CHECKSUMS", "0") == "1"
+
+# Checkpoint with the uncensored LoRA fused into the weights (built by download_weights.py)
+FUSED_MODEL_DIR = os.path.join(MODEL_CACHE_DIR, "flux-dev-uncensored-fused")
+FUSED_MANIFEST = "fused.json"
+USE_FUSED_CHECKPOINT = os.environ.get("USE_FUSED_CHECKPOINT", "1") == "1"
+
+# Weight-only quantized transformer and/or T5 encoder (built by download_weights.py)
+QUANTIZED_MODEL_DIR = os.path.join(MODEL_CACHE_DIR, "flux-dev-quantized")
+QUANTIZED_MANIFEST = "quantized.json"
+USE_QUANTIZED_CHECKPOINT = os.environ.get("USE_QUANTIZED_CHECKPOINT", "1") == "1"
+
+# Initialize the pipeline before runpod.serverless.start instead of on the first job
+EAGER_INIT = os.environ.get("EAGER_INIT", "1") == "1"
+# Load pipeline components concurrently instead of through FluxPipeline.from_pretrained
+PARALLEL_LOAD = os.environ.get("PARALLEL_LOAD", "1") == "1"
+# Load the base model and uncensored LoRA strictly from the baked cache, without
+# contacting the hub (custom faces LoRAs are still fetched per request)
+OFFLINE = os.environ.get("MODEL_OFFLINE", "0") == "1" or os.environ.get("HF_HUB_OFFLINE", "0") == "1"
+# Steps of the optional warmup inference (0 disables it)
+WARMUP_STEPS = int(os.environ.get("WARMUP_STEPS", "0"))
+WARMUP_SIZE = int(os.environ.get("WARMUP_SIZE", "256"))
+
+# Components download_weights.py can quantize, and their model classes
+QUANTIZABLE_MODELS = {"transformer": FluxTransformer2DModel, "text_encoder_2": T5EncoderModel}
+
+# Model components with weights (every other component is configs and vocabularies)
+WEIGHT_COMPONENTS = ("text_encoder", "text_encoder_2", "transformer", "vae")
+
+# Files the runtime needs from the base model repository: safetensors weights only, and not the
+# single-file checkpoints at the top level
+BASE_MODEL_PATTERNS = [
+    "model_index.json",
+    "scheduler/*",
+    "tokenizer/*",
+    "tokenizer_2/*",
+] + [
+    f"{component}/{pattern}"
+    for component in WEIGHT_COMPONENTS
+    for pattern in ("*.json", "*.safetensors")
+]
+
+
+def weight_variant(filename):
+    """
+    Variant of a weight or weight index file (e.g. "fp16"), None for the default weights
+
+    Returns:
+        str or None or bool: The variant, or False for files that are not weights
+    """
+    name = os.path.basename(filename)
+    if name.endswith(".safetensors"):
+        # model.safetensors, model-00001-of-00002.safetensors, model.fp16-00001-of-00002.safetensors
+        parts = name[:-len(".safetensors")].split(".")
+        return parts[-1].split("-")[0] if len(parts) > 1 else None
+    if ".safetensors.index" in name and name.endswith(".json"):
+        # model.safetensors.index.json, model.safetensors.index.fp16.json
+        return name[:-len(".json")].split(".safetensors.index")[1].lstrip(".") or None
+    return False
+
+
+def select_variant(variant=MODEL_VARIANT):
+    """Filter for download_snapshot keeping non-weight files and the weights of one variant"""
+    return lambda filename: weight_variant(filename) in (False, variant)
+
+
+class PhaseTimer:
+    """Collects wall-clock durations of named startup phases"""
+
+    def __init__(self):
+        self.phases = OrderedDict()
+        self.lock = threading.Lock()
+        self.started = time.perf_counter()
+
+    @contextmanager
+    def phase(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            with self.lock:
+                self.phases[name] = time.perf_counter() - start
+
+    def report(self):
+        """Per-phase breakdown plus total wall time, in seconds"""
+        breakdown = dict(self.phases)
+        breakdown["total"] = time.perf_counter() - self.started
+        return breakdown
+
+    def print_report(self, title="Startup"):
+        breakdown = self.report()
+        print(f"{title} breakdown:")
+        for name, seconds in breakdown.items():
+            print(f"  {name:<20} {seconds:8.2f}s")
+
+
+def weights_manifest(model_dir=BASE_MODEL_DIR):
+    """Weights manifest written by download_weights.py, or None"""
+    try:
+        with open(os.path.join(model_dir, WEIGHTS_MANIFEST)) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def check_weights(model_dir, manifest, checksums=VERIFY_WEIGHT_CHECKSUMS):
+    """Raise if a file in the manifest is missing, truncated or (with checksums) corrupted"""
+    for name, entry in manifest["files"].items():
+        path = os.path.join(model_dir, name)
+        if not os.path.isfile(path) or os.path.getsize(path) != entry["size"]:
+            raise FileNotFoundError(f"{path} is missing or incomplete, run download_weights.py again")
+        if checksums and file_matches_etag(path, entry["etag"]) is False:
+            raise ValueError(f"Checksum mismatch for {path}, run download_weights.py again")
+
+
+def model_variant(model_path):
+    """Weight variant to load from a model directory (its manifest's, else MODEL_VARIANT)"""
+    manifest = weights_manifest(model_path)
+    return manifest.get("variant") if manifest else MODEL_VARIANT
+
+
+def resolve_base_model(timer, model_id=BASE_MODEL_ID, cache_dir=MODEL_CACHE_DIR, offline=OFFLINE):
+    """Return the local directory of the base model (the baked download, or a hub cache snapshot)"""
+    if os.path.isdir(model_id):
+        return model_id
+    manifest = weights_manifest()
+    if manifest is not None and manifest["repo"] == model_id:
+        # Everything is listed in the manifest, so the hub is never asked
+        with timer.phase("check_weights"):
+            check_weights(BASE_MODEL_DIR, manifest)
+        return BASE_MODEL_DIR
+    with timer.phase("resolve_snapshot"):
+        return snapshot_download(
+            model_id,
+            cache_dir=cache_dir,
+            allow_patterns=BASE_MODEL_PATTERNS,
+            local_files_only=offline
+        )
+
+
+def fused_checkpoint(fused_dir=FUSED_MODEL_DIR):
+    """Return the fused checkpoint manifest if one was built and is enabled, else None"""
+    manifest_path = os.path.join(fused_dir, FUSED_MANIFEST)
+    if not USE_FUSED_CHECKPOINT or not os.path.isfile(manifest_path):
+        return None
+    with open(manifest_path) as f:
+        manifest = json.load(f)
+    manifest["path"] = fused_dir
+    return manifest
+
+
+def quantized_checkpoint(fused=None, quantized_dir=QUANTIZED_MODEL_DIR):
+    """
+    Return the quantized checkpoint manifest if one was built and is enabled, else None
+
+    A component is only used if it was quantized from the weights the worker
+    would otherwise load (with or without the fused LoRA), so the uncensored
+    LoRA is never applied twice or left out.
+    """
+    manifest_path = os.path.join(quantized_dir, QUANTIZED_MANIFEST)
+    if not USE_QUANTIZED_CHECKPOINT or not os.path.isfile(manifest_path):
+        return None
+    with open(manifest_path) as f:
+        manifest = json.load(f)
+    components = {}
+    for name, spec in manifest["components"].items():
+        fused_lora = fused["lora"] if fused and name in fused["components"] else None
+        if spec["fused_lora"] != fused_lora:
+            print(f"Not using the quantized {name}: it was built {'with' if spec['fused_lora'] else 'without'} "
+                  f"the fused LoRA")
+            continue
+        components[name] = spec
+    if not components:
+        return None
+    manifest["components"] = components
+    manifest["path"] = quantized_dir
+    return manifest
+
+
+def component_path(name, model_path, fused):
+    """Directory to load a component from, preferring the fused checkpoint"""
+    if fused and name in fused["components"]:
+        return fused["path"]
+    return model_path
+
+
+@contextmanager
+def thread_local_meta_init():
+    """
+    Keep accelerate's empty-weights model construction to the thread that asked for it
+
+    low_cpu_mem_usage loading builds each model inside accelerate's
+    init_on_device, which patches nn.Module.register_parameter for the whole
+    process. With components loading on concurrent threads, parameters that
+    another thread registers meanwhile (e.g. T5 tying its embeddings) land on
+    the meta device, and overlapping contexts can leave the patch installed.
+    Here register_parameter is patched once, for the duration of the load, and
+    only moves parameters of threads inside an init_on_device context.
+    """
+    state = threading.local()
+    init_on_device = accelerate.big_modeling.init_on_device
+    register_parameter = torch.nn.Module.register_parameter
+
+    @contextmanager
+    def thread_init_on_device(device, include_buffers=None):
+        if include_buffers:
+            # Also patches the tensor constructors; none of the loaders ask for it
+            with init_on_device(device, include_buffers=True):
+                yield
+            return
+        previous = getattr(state, "device", None)
+        state.device = device
+        try:
+            yield
+        finally:
+            state.device = previous
+
+    def thread_register_parameter(module, name, param):
+        register_parameter(module, name, param)
+        device = getattr(state, "device", None)
+        if param is not None and device is not None:
+            param = module._parameters[name]
+            kwargs = dict(param.__dict__)
+            kwargs["requires_grad"] = param.requires_grad
+            # Not a constructor argument (set by transformers), restored afterwards
+            initialized = kwargs.pop("_is_hf_initialized", None)
+            module._parameters[name] = type(param)(param.to(device), **kwargs)
+            if initialized is not None:
+                module._parameters[name]._is_hf_initialized = initialized
+
+    accelerate.big_modeling.init_on_device = thread_init_on_device
+    torch.nn.Module.register_parameter = thread_register_parameter
+    try:
+        yield
+    finally:
+        accelerate.big_modeling.init_on_device = init_on_device
+        torch.nn.Module.register_parameter = register_parameter
+
+
+def load_components(model_path, dtype, device, timer, fused=None, quantized=None):
+    """Load every pipeline component concurrently and move the models to the device"""
+    transformer_path = component_path("transformer", model_path, fused)
+    text_encoder_path = component_path("text_encoder", model_path, fused)
+    variant = model_variant(model_path)
+    # The fused checkpoint is saved without a variant suffix
+    transformer_variant = None if transformer_path != model_path else variant
+    text_encoder_variant = None if text_encoder_path != model_path else variant
+
+    def load_model(name, loader):
+        with timer.phase(name):
+            model = loader()
+            return model.to(device)
+
+    def load_other(name, loader):
+        with timer.phase(name):
+            return loader()
+
+    tasks = {
+        "transformer": (load_model, lambda: FluxTransformer2DModel.from_pretrained(
+            transformer_path, subfolder="transformer", torch_dtype=dtype, low_cpu_mem_usage=True,
+            variant=transformer_variant)),
+        "text_encoder": (load_model, lambda: CLIPTextModel.from_pretrained(
+            text_encoder_path, subfolder="text_encoder", torch_dtype=dtype, low_cpu_mem_usage=True,
+            variant=text_encoder_variant)),
+        "text_encoder_2": (load_model, lambda: T5EncoderModel.from_pretrained(
+            model_path, subfolder="text_encoder_2", torch_dtype=dtype, low_cpu_mem_usage=True, variant=variant)),
+        "vae": (load_model, lambda: AutoencoderKL.from_pretrained(
+            model_path, subfolder="vae", torch_dtype=dtype, low_cpu_mem_usage=True, variant=variant)),
+        "tokenizer": (load_other, lambda: CLIPTokenizer.from_pretrained(model_path, subfolder="tokenizer")),
+        "tokenizer_2": (load_other, lambda: T5TokenizerFast.from_pretrained(model_path, subfolder="tokenizer_2")),
+        "scheduler": (load_other, lambda: FlowMatchEulerDiscreteScheduler.from_pretrained(
+            model_path, subfolder="scheduler")),
+    }
+    # Quantized components are assigned from their checkpoint instead
+    for name, spec in (quantized or {}).get("components", {}).items():
+        component_dir = os.path.join(quantized["path"], name)
+        tasks[name] = (load_model, functools.partial(
+            load_quantized, QUANTIZABLE_MODELS[name], component_dir, spec, dtype))
+
+    with thread_local_meta_init(), ThreadPoolExecutor(max_workers=len(tasks), thread_name_prefix="load") as executor:
+        futures = {name: executor.submit(run, name, loader) for name, (run, loader) in tasks.items()}
+        return {name: future.result() for name, future in futures.items()}
+
+
+def load_base_pipeline(device, timer, dtype=torch.bfloat16, parallel=PARALLEL_LOAD, offline=OFFLINE,
+                       model_id=BASE_MODEL_ID, fused=None, quantized=None):
+    """
+    Load FLUX.1-dev, either component-parallel or through FluxPipeline.from_pretrained
+
+    Components listed in the quantized or fused checkpoint manifests are loaded
+    from them instead of the base model (the quantized checkpoint first).
+    """
+    model_path = resolve_base_model(timer, model_id=model_id, offline=offline)
+
+    if not parallel:
+        with timer.phase("from_pretrained"):
+            overrides = {}
+            for name in (fused or {}).get("components", []):
+                loader = FluxTransformer2DModel if name == "transformer" else CLIPTextModel
+                overrides[name] = loader.from_pretrained(fused["path"], subfolder=name, torch_dtype=dtype)
+            for name, spec in (quantized or {}).get("components", {}).items():
+                overrides[name] = load_quantized(QUANTIZABLE_MODELS[name], os.path.join(quantized["path"], name),
+                                                 spec, dtype)
+            return FluxPipeline.from_pretrained(
+                model_path,
+                torch_dtype=dtype,
+                variant=model_variant(model_path),
+                **overrides
+            ).to(device)
+
+    with timer.phase("load_components"):
+        components = load_components(model_path, dtype, device, timer, fused=fused, quantized=quantized)
+    with timer.phase("assemble"):
+        return FluxPipeline(**components)
+
+
+def uncensored_lora_source():
+    """Prefer the baked local copy of the uncensored LoRA over a hub lookup"""
+    if os.path.isdir(UNCENSORED_LORA_DIR):
+        return UNCENSORED_LORA_DIR
+    return UNCENSORED_LORA_ID
+
+
+def warmup(pipe, prompt_cache, timer, steps=WARMUP_STEPS, size=WARMUP_SIZE):
+    """Run a tiny inference so kernels, allocator pools and the encoders are warm"""
+    if steps <= 0:
+        return
+    with timer.phase("warmup"):
+        prompt_embeds, pooled_prompt_embeds = prompt_cache.encode(["warmup"])
+        pipe(
+            prompt_embeds=prompt_embeds,
+            pooled_prompt_embeds=pooled_prompt_embeds,
+            height=size,
+            width=size,
+            num_inference_steps=steps,
+            guidance_scale=3.5
+        )
+        if torch.cuda.is_available():
+            torch.cuda.synchronize()
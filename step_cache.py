@@ -0,0 +1,122 @@
+"""
+First-block caching of the Flux transformer for fast_mode jobs
+
+In the middle of the schedule the transformer output changes little from one
+denoising step to the next. With fast_mode every step still runs the first
+double-stream block and measures how far its residual (output minus input)
+moved from the last fully computed step:
+
+    change = mean|r_t - r_ref| / mean|r_ref|
+
+Below the job's threshold the remaining blocks are skipped and the residual
+they added at the reference step is reused; otherwise every block runs and
+the reference moves to this step. The reference only moves on full steps, so
+drift over consecutive skips adds up until a step is recomputed. In a batched
+call the decision is shared by all images of the batch.
+
+One CacheState serves every transformer call of a pipeline call, so jobs
+with a negative prompt (true CFG: a conditional and an unconditional pass
+per step) run without fast_mode; handler.read_job_input turns it off.
+
+The cached block runner is swapped in only for the duration of one pipeline
+call, so LoRA injection, compilation and offload hooks always see the
+unmodified transformer.
+"""
+
+import os
+from contextlib import contextmanager
+
+import torch
+from torch import nn
+
+
+# Default change threshold for fast_mode jobs (benchmarks/bench_fast_mode.py helps pick it)
+FAST_MODE_THRESHOLD = float(os.environ.get("FAST_MODE_THRESHOLD", "0.08"))
+
+
+class CacheState:
+    """Reference residuals and skip counters of one pipeline call"""
+
+    def __init__(self, threshold):
+        self.threshold = threshold
+        self.reference = None
+        self.hidden_residual = None
+        self.steps = 0
+        self.skipped = 0
+        self.changes = []
+
+    def can_skip(self, residual):
+        if self.reference is None or self.reference.shape != residual.shape:
+            return False
+        # One device sync per step: the branch needs the value on the host
+        change = ((residual - self.reference).abs().mean() / self.reference.abs().mean()).item()
+        self.changes.append(change)
+        return change < self.threshold
+
+    def report(self):
+        return {
+            "threshold": self.threshold,
+            "steps": self.steps,
+            "skipped_steps": self.skipped,
+            "mean_change": round(sum(self.changes) / len(self.changes), 4) if self.changes else None,
+        }
+
+
+class CachedBlocks(nn.Module):
+    """Runs all double- and single-stream blocks in place of the first double-stream block"""
+
+    def __init__(self, double_blocks, single_blocks, state):
+        super().__init__()
+        self.double_blocks = double_blocks
+        self.single_blocks = single_blocks
+        self.state = state
+
+    def forward(self, hidden_states, encoder_hidden_states, temb, image_rotary_emb, joint_attention_kwargs=None):
+        state = self.state
+        block_kwargs = {"temb": temb, "image_rotary_emb": image_rotary_emb,
+                        "joint_attention_kwargs": joint_attention_kwargs}
+
+        first_input = hidden_states
+        encoder_hidden_states, hidden_states = self.double_blocks[0](
+            hidden_states=hidden_states, encoder_hidden_states=encoder_hidden_states, **block_kwargs)
+        residual = hidden_states - first_input
+        state.steps += 1
+
+        if state.can_skip(residual):
+            state.skipped += 1
+            return encoder_hidden_states, hidden_states + state.hidden_residual
+
+        remainder_input = hidden_states
+        for block in self.double_blocks[1:]:
+            encoder_hidden_states, hidden_states = block(
+                hidden_states=hidden_states, encoder_hidden_states=encoder_hidden_states, **block_kwargs)
+        text_length = encoder_hidden_states.shape[1]
+        hidden_states = torch.cat([encoder_hidden_states, hidden_states], dim=1)
+        for block in self.single_blocks:
+            hidden_states = block(hidden_states=hidden_states, **block_kwargs)
+        # The transformer only keeps the image tokens; the text tokens are just a shape to slice by
+        encoder_hidden_states, hidden_states = hidden_states[:, :text_length], hidden_states[:, text_length:]
+
+        state.reference = residual
+        state.hidden_residual = hidden_states - remainder_input
+        return encoder_hidden_states, hidden_states
+
+
+@contextmanager
+def first_block_cache(transformer, threshold):
+    """
+    Enable first-block caching on a Flux transformer for the enclosed pipeline call
+
+    Yields:
+        CacheState: Counters to report once the call is done
+    """
+    state = CacheState(threshold)
+    double_blocks = transformer.transformer_blocks
+    single_blocks = transformer.single_transformer_blocks
+    transformer.transformer_blocks = nn.ModuleList([CachedBlocks(double_blocks, single_blocks, state)])
+    transformer.single_transformer_blocks = nn.ModuleList()
+    try:
+        yield state
+    finally:
+        transformer.transformer_blocks = double_blocks
+        transformer.single_transformer_blocks = single_blocks
@@ -0,0 +1,226 @@
+"""
+Fast-fail job input validation compiled from INPUT_SCHEMA
+
+The schema is compiled once into one checker per field, and every job is
+checked before anything else runs (no hub login, pipeline init or LoRA
+load). The checker:
+
+- rejects fields the schema does not define
+- coerces values to the schema type where that is unambiguous
+  ("1024" or 1024.0 -> 1024, 3 -> 3.0, "true" -> True)
+- applies defaults and each field's constraint, nested batch items included
+- applies the Flux rules: height and width must be multiples of 16 (latents
+  are 2x2-packed after the 8x VAE) and each image at most MAX_IMAGE_PIXELS
+- estimates the job's cost in megapixel-steps (height x width x steps x
+  images) and refuses jobs over MAX_JOB_COST
+
+Every problem is reported at once, as a list of {"field", "message"}.
+"""
+
+import math
+import os
+
+from schemas import INPUT_SCHEMA
+
+
+# Largest height x width of one image
+MAX_IMAGE_PIXELS = int(os.environ.get("MAX_IMAGE_PIXELS", str(2048 * 2048)))
+# Most megapixel-steps (height x width x steps x images / 1e6) one job may cost (0 = no limit);
+# e.g. 1024x1024, 28 steps, 4 images is 117
+MAX_JOB_COST = float(os.environ.get("MAX_JOB_COST", "0"))
+
+# Flux latents are 2x2-packed after the 8x VAE
+SIZE_MULTIPLE = 16
+
+# Fields the job-level rules read
+RULE_FIELDS = {
+    "prompt", "items", "num_images", "height", "width", "num_inference_steps",
+    "return_mode", "aws_access_key_id", "aws_secret_access_key", "s3_bucket"
+}
+
+TRUE_STRINGS = ("true", "1", "yes")
+FALSE_STRINGS = ("false", "0", "no")
+
+
+class ValidationError(ValueError):
+    """Invalid job input, with one {"field", "message"} entry per problem"""
+
+    def __init__(self, errors):
+        self.errors = errors
+        super().__init__("Invalid input: " + "; ".join(f"{error['field']} {error['message']}" for error in errors))
+
+
+def coerce(value, expected):
+    """
+    Convert a value to the schema type where the conversion is lossless
+
+    Raises:
+        TypeError or ValueError: If the value cannot stand for the type
+    """
+    if expected is bool:
+        if isinstance(value, bool):
+            return value
+        if isinstance(value, int) and value in (0, 1):
+            return bool(value)
+        if isinstance(value, str) and value.strip().lower() in TRUE_STRINGS + FALSE_STRINGS:
+            return value.strip().lower() in TRUE_STRINGS
+        raise TypeError(value)
+    if expected in (int, float):
+        if isinstance(value, bool):
+            raise TypeError(value)
+        number = value
+        if isinstance(value, str):
+            # Integer strings are parsed exactly ("9007199254740993" is not rounded through a float)
+            try:
+                number = int(value.strip())
+            except ValueError:
+                number = float(value.strip())
+        if not isinstance(number, (int, float)) or not math.isfinite(number):
+            raise TypeError(value)
+        if expected is int:
+            if isinstance(number, float) and not number.is_integer():
+                raise ValueError(value)
+            return int(number)
+        return float(number)
+    if not isinstance(value, expected):
+        raise TypeError(value)
+    return value
+
+
+def compile_schema(schema, defaults=None):
+    """
+    Compile a schema into one checker per field
+
+    Args:
+        schema: Field name -> {"type", "required", "default", "constraints", "allowed", "item_schema"}
+        defaults: Defaults overriding the schema's (e.g. from environment variables)
+
+    Returns:
+        dict: Field name -> check(values, errors, prefix) returning the field's value
+    """
+    defaults = defaults or {}
+    return {name: compile_field(name, spec, defaults.get(name, spec.get("default"))) for name, spec in schema.items()}
+
+
+def compile_field(name, spec, default):
+    expected = spec["type"]
+    required = spec.get("required", False)
+    constraint = spec.get("constraints")
+    allowed = spec.get("allowed")
+    items = compile_schema(spec["item_schema"]) if "item_schema" in spec else None
+
+    def check(values, errors, prefix=""):
+        field = prefix + name
+        value = values.get(name)
+        if value is None:
+            if required:
+                errors.append({"field": field, "message": "is required"})
+            return default
+        try:
+            value = coerce(value, expected)
+        except (TypeError, ValueError):
+            errors.append({"field": field, "message": f"must be of type {expected.__name__}, got {value!r}"})
+            return None
+        if constraint is not None and not constraint(value):
+            shown = f"{len(value)} items" if isinstance(value, list) else repr(value)
+            errors.append({"field": field, "message": f"is out of range: {shown} (allowed: {allowed})"})
+            return None
+        if items is not None:
+            value = [check_object(item, items, errors, f"{field}[{index}].") for index, item in enumerate(value)]
+        return value
+
+    return check
+
+
+def check_object(values, checkers, errors, prefix=""):
+    """Check a dict against compiled field checkers, collecting errors; returns the checked values"""
+    if not isinstance(values, dict):
+        errors.append({"field": prefix.rstrip(".") or "input", "message": "must be an object"})
+        return None
+    for name in values:
+        if name not in checkers:
+            errors.append({"field": prefix + name, "message": "is not a known field"})
+    return {name: check(values, errors, prefix) for name, check in checkers.items()}
+
+
+def job_cost(params):
+    """Estimated cost of a job in megapixel-steps (height x width x steps x images / 1e6)"""
+    images = len(params['items']) if params['items'] is not None else params['num_images']
+    return params['height'] * params['width'] * params['num_inference_steps'] * images / 1e6
+
+
+class InputValidator:
+    """INPUT_SCHEMA compiled once, applied to every job before any other work"""
+
+    def __init__(self, schema=INPUT_SCHEMA, defaults=None, max_image_pixels=MAX_IMAGE_PIXELS,
+                 max_job_cost=MAX_JOB_COST):
+        """
+        Initialize the validator
+
+        Args:
+            schema: Field schema of the job input
+            defaults: Defaults overriding the schema's
+            max_image_pixels: Largest height x width of one image
+            max_job_cost: Most megapixel-steps per job (0 = no limit)
+        """
+        self.checkers = compile_schema(schema, defaults)
+        self.max_image_pixels = max_image_pixels
+        self.max_job_cost = max_job_cost
+
+    def validate(self, job_input):
+        """
+        Check a job input and apply defaults
+
+        Returns:
+            dict: Every schema field, coerced or defaulted
+
+        Raises:
+            ValidationError: Listing every problem found
+        """
+        errors = []
+        params = check_object(job_input, self.checkers, errors)
+        # The job-level rules need well-formed fields to work on
+        invalid = {error["field"].split("[")[0] for error in errors}
+        if params is not None and not invalid & RULE_FIELDS:
+            self._check_rules(params, errors)
+        if errors:
+            raise ValidationError(errors)
+        return params
+
+    def _check_rules(self, params, errors):
+        """Rules spanning several fields: prompt or items, Flux sizes, S3 destination and cost"""
+        if params['items'] is not None:
+            if params['num_images'] != 1:
+                errors.append({"field": "num_images", "message": "must be 1 with items (each item renders one image)"})
+        elif not params['prompt']:
+            errors.append({"field": "prompt", "message": "is required (or a list of items)"})
+
+        for name in ('height', 'width'):
+            value = params[name]
+            if value % SIZE_MULTIPLE:
+                lower = value // SIZE_MULTIPLE * SIZE_MULTIPLE
+                errors.append({
+                    "field": name,
+                    "message": f"must be a multiple of {SIZE_MULTIPLE}, got {value} (use {lower} or {lower + SIZE_MULTIPLE})"
+                })
+        pixels = params['height'] * params['width']
+        if pixels > self.max_image_pixels:
+            errors.append({
+                "field": "height",
+                "message": f"{params['width']}x{params['height']} exceeds the pixel budget of {self.max_image_pixels} per image"
+            })
+
+        if params['return_mode'] == 's3_only' and not (
+            params['aws_access_key_id'] and params['aws_secret_access_key'] and params['s3_bucket']
+        ):
+            errors.append({
+                "field": "return_mode",
+                "message": "'s3_only' requires aws_access_key_id, aws_secret_access_key and s3_bucket"
+            })
+
+        cost = job_cost(params)
+        if self.max_job_cost and cost > self.max_job_cost:
+            errors.append({
+                "field": "input",
+                "message": f"estimated cost of {cost:.1f} megapixel-steps exceeds the budget of {self.max_job_cost:g}"
+            })